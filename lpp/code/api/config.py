@@ -45,4 +45,5 @@ class Prediction(BaseModel):
     log_odds: float
     threshold: float
     x_domain: dict
-    shap_values: list
\ No newline at end of file
+    shap_values: list
+    contributions: Optional[dict] = None
\ No newline at end of file
@@ -2,6 +2,7 @@
 import pickle, json
 
 import pandas as pd
+from typing import Optional
 from fastapi import FastAPI, HTTPException
 from fastapi.responses import JSONResponse
 
@@ -18,7 +19,8 @@ from celery.result import AsyncResult
 from aiohttp import ClientSession
 
 
-from utils.database import SetupDatabase, DOMAINS_REAL_TIME_NAME
+from utils.database import SetupDatabase, DOMAINS_REAL_TIME_NAME, VT_CACHE_NAME, alert_date
+from utils.vt_cache import VtCache, plan_refresh, freshness
 from utils.pipelines import pipeline_domains_dataframe
 from utils.static_functions import format_data, create_mock_alert
 from utils.apis import VtApi, clean_keys, DomainNotFoundException, InvalidDomainException, \
@@ -28,49 +30,58 @@ from utils.static_functions import format_data, create_mock_alert
 from api.queries import tickets_aggregation_projection
 from api.config import Alert, Acknowledgement, Task, Prediction
 
-from predict.tasks import predict
+from predict.batching import MicroBatcher
 
 pipeline = pipeline_domains_dataframe({}, DOMAINS_REAL_TIME_NAME)
 relevant_data = pipeline[1]["$project"]
 setup = SetupDatabase
 
-vt_api = VtApi()
 setup = SetupDatabase()
+vt_cache = VtCache(setup.db[VT_CACHE_NAME])
+vt_api = VtApi(cache=vt_cache)
 api = FastAPI()
+batcher = MicroBatcher()
 
-async def fetch_domain_data(domain):
-    """ fetches vt api data for domain.
+async def fetch_domain_data(domain, end_points=None, fetched_at=None):
+    """ fetches vt api data for domain, only `end_points` if given. `fetched_at` as in `VtApi.fetch_vt`.
     
         Throws HTTPException
     """
     try:
         async with ClientSession(trust_env=True) as session:
-            data = await vt_api.fetch_vt(domain, session)
+            data = await vt_api.fetch_vt(domain, session, end_points=end_points, fetched_at=fetched_at)
             return data
     except (OtherVtException, QuotaExceededException, DomainNotFoundException, IsIpException, InvalidDomainException) as e:
         raise HTTPException(status_code=404, detail=e.message)
 
 
 async def get_prediction_data(domain: str):
-    domain_has_been_analyzed_past_day = {
-        "name": domain,
-        "x_domain": {"$exists": True},
-        "last_analysis" : {"$gt": datetime.now() - timedelta(hours=24)}
-    }
-    fresh_analysis = setup.db[DOMAINS_REAL_TIME_NAME].find_one(domain_has_been_analyzed_past_day, projection={"x_domain": 1})
+    known = setup.db[DOMAINS_REAL_TIME_NAME].find_one(
+        {"name": domain},
+        projection={"x_domain": 1, "last_analysis": 1, "vt_fetched_at": 1}
+    ) or {}
 
     try:
-        if fresh_analysis: # If yes load old prediction
-            return fresh_analysis["x_domain"]
-        else: 
-            # fetch the data
-            data = await fetch_domain_data(domain)
+        if "x_domain" in known and known.get("last_analysis", datetime.min) > datetime.now() - timedelta(hours=24): # If yes load old prediction
+            return known["x_domain"]
+        
+        # only the endpoints past their TTL are fetched again
+        stale = plan_refresh(known.get("vt_fetched_at"), [None] + vt_api.endpoints)
+        if stale:
+            # fetch the data, the cached responses keep the date they were fetched from VT
+            fetched_at = {}
+            data = await fetch_domain_data(domain, end_points=stale, fetched_at=fetched_at)
             
             # make some formating
             data = format_data(data, domain)
             
             # clean keys from bad chars
             data = clean_keys(data)
+
+            # merge the fresh endpoints into the stored `vt`
+            vt_data = data.pop("vt")
+            data.update({f"vt.{name}": val for name, val in vt_data.items()})
+            data.update({f"vt_fetched_at.{name}": date for name, date in freshness(vt_data, fetched_at=fetched_at).items()})
             
             # insert and project
             doc = setup.db[DOMAINS_REAL_TIME_NAME].find_one_and_update(
@@ -80,13 +91,15 @@ async def get_prediction_data(domain: str):
                 return_document=ReturnDocument.AFTER,
                 upsert=True
             )
+        else:
+            doc = setup.db[DOMAINS_REAL_TIME_NAME].find_one({"name": domain}, projection=relevant_data)
             
-            # if alerts not present document then make a mock alert
-            # happens when a user requests an analysis of an arbitrary domain that never triggered alert
-            if "alerts" not in doc.keys():
-                doc["alerts"] = create_mock_alert()
+        # if alerts not present document then make a mock alert
+        # happens when a user requests an analysis of an arbitrary domain that never triggered alert
+        if "alerts" not in doc.keys():
+            doc["alerts"] = create_mock_alert()
 
-            return doc
+        return doc
     except UnicodeEncodeError as e:
         raise HTTPException(status_code=422, detail=str(e))
 
@@ -110,18 +123,18 @@ async def predict_result(task_id: str):
         return result
 
 @api.get("/predict/{name}",  response_model=Task, status_code=202)
-async def get_prediction(name: str):
+async def get_prediction(name: str, top_k: Optional[int] = None):
     data = await get_prediction_data(name) # io bound
-    task_id = predict.delay(data) #cpu bound
+    task_id = batcher.submit(data, top_k=top_k) #cpu bound, scored in batches
     return {'task_id': str(task_id), 'status': 'Processing'}
 
 
 @api.post("/predict/",  response_model=Task, status_code=202)
-async def post_prediction(alert: Alert):
+async def post_prediction(alert: Alert, top_k: Optional[int] = None):
     domain = alert.dst
     if alert.timestamp:
         try:
-            alert.date = datetime.fromtimestamp(float(alert.timestamp))
+            alert.date = alert_date(alert.timestamp)
         except TypeError:
             raise HTTPException(422, f"could not convert {alert.timestamp} to a date.")
     
@@ -139,7 +152,7 @@ async def post_prediction(alert: Alert):
     except DuplicateKeyError:
         raise HTTPException(422, "{} has already been analyzed".format(tmp["sha"]))
     data = await get_prediction_data(domain) # io bound
-    task_id = predict.delay(data) #cpu bound
+    task_id = batcher.submit(data, top_k=top_k) #cpu bound, scored in batches
     return {'task_id': str(task_id), 'status': 'Processing'}
 
 
@@ -166,6 +179,10 @@ async def ack_alert(ack: Acknowledgement):
     else:
         raise HTTPException(422, "did not find matching alert for sha {}".format(ack.sha))
 
+@api.get("/stats/vt_cache")
+async def get_vt_cache_stats():
+    return vt_cache.stats()
+
 @api.get("/ping")
 async def pong():
     return {
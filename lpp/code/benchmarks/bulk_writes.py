@@ -0,0 +1,68 @@
+"""
+Documents per second of the alert enrichment with one `update_one` per document, with `BatchedWriter` and with
+a server side update pipeline.
+
+Runs against the mongod configured by the `MONGO_*` variables, in a scratch collection that is dropped afterwards:
+
+    python -m benchmarks.bulk_writes --docs 50000 --batch-size 1000
+"""
+import time, random, argparse, logging, sys
+
+from utils.database import SetupDatabase, PIPELINE_UPDATES_VERSION
+from utils.queries import HAS_NO_ALERT_ENRICHMENT
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(asctime)s %(levelname)-8s:%(name)s:  %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger("l++ benchmark bulk writes")
+
+COLLECTION = "benchmark_alerts"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="benchmark of per document writes against bulk writes")
+    parser.add_argument("--docs", type=int, default=50000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    return parser.parse_args()
+
+
+def seed(setup, nr_docs):
+    rng = random.Random(1337)
+    setup.db[COLLECTION].drop()
+    setup.db[COLLECTION].insert_many([{
+        "sha": "{:064x}".format(rng.getrandbits(256)),
+        "dst": "host{}.example.com".format(i),
+        "dest_host_uniq": ",".join("host{}.example.com".format(rng.randrange(nr_docs)) for _ in range(rng.randrange(1, 4))),
+    } for i in range(nr_docs)])
+    setup.db[COLLECTION].create_index("sha", unique=True)
+
+
+def per_document(setup):
+    """ the enrichment as it was, one round trip per document """
+    for doc in setup.db[COLLECTION].find(HAS_NO_ALERT_ENRICHMENT):
+        hosts = list(filter(lambda a: a != '', doc["dest_host_uniq"].split(',')))
+        setup.db[COLLECTION].update_one({"sha": doc["sha"]}, {"$set": {"hosts_array": hosts}})
+
+
+def timed(name, nr_docs, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    logger.info("{:<14} {:>8.2f}s {:>10.0f} docs/s".format(name, elapsed, nr_docs / elapsed))
+
+
+def main():
+    args = parse_args()
+    setup = SetupDatabase()
+    try:
+        seed(setup, args.docs)
+        timed("update_one", args.docs, lambda: per_document(setup))
+        seed(setup, args.docs)
+        timed("bulk_write", args.docs, lambda: setup.create_hosts_array(collection=COLLECTION, batch_size=args.batch_size, server_side=False))
+        if setup.server_version >= PIPELINE_UPDATES_VERSION:
+            seed(setup, args.docs)
+            timed("update_many", args.docs, lambda: setup.create_hosts_array(collection=COLLECTION))
+    finally:
+        setup.db[COLLECTION].drop()
+
+
+if __name__ == "__main__":
+    main()
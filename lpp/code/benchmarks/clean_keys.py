@@ -0,0 +1,84 @@
+"""
+Micro-benchmark of `clean_keys` against the recursive `re.sub` version it replaced, on VT documents of a
+realistic size: engine results keyed by engine name and pe imports keyed by dll name.
+
+    python -m benchmarks.clean_keys --docs 200
+"""
+import re, copy, time, random, argparse, logging, sys
+
+from utils.apis import clean_keys
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(asctime)s %(levelname)-8s:%(name)s:  %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger("l++ benchmark clean keys")
+
+ENGINES = ["Engine{}".format(i) for i in range(60)] + ["Sophos.AV", "CRDF", "Comodo Valkyrie Verdict", "Trustwave", "Dr.Web", "G-Data",
+           "alphaMountain.ai", "benkow.cc", "Quick Heal", "SecureBrain", "Sangfor", "ESET-NOD32", "MAX", "K7GW", "URLhaus"]
+DLLS = ["KERNEL32.dll", "USER32.dll", "ADVAPI32.dll", "msvcrt.dll", "WS2_32.dll", "SHELL32.dll", "ole32.dll", "$SHARED.dll"]
+RELATIONSHIPS = ["communicating_files", "downloaded_files", "historical_whois", "referrer_files", "resolutions", "siblings", "subdomains", "urls"]
+ENTRIES = 25
+
+
+def recursive_clean_keys(data):
+    """ `clean_keys` as it was """
+    if isinstance(data, dict):
+        for key, val in data.copy().items():
+            new_key = re.sub(r"[\[\]\$,\.]", "_", key)
+            if new_key != key:
+                data[new_key] = recursive_clean_keys(val)
+                del data[key]
+            else:
+                data[key] = recursive_clean_keys(val)
+        return data
+    elif isinstance(data, list):
+        for item in data:
+            recursive_clean_keys(item)
+        return data
+    else:
+        return data
+
+
+def analysis_results(rng):
+    return {engine: {"category": "harmless", "result": "clean", "method": "blacklist", "engine_name": engine} for engine in rng.sample(ENGINES, 60)}
+
+
+def entry(rng):
+    return {"attributes": {
+        "last_analysis_results": analysis_results(rng),
+        "last_analysis_stats": {"harmless": 60, "malicious": 0},
+        "pe_info": {"import_list": [{"library_name": dll, "imported_functions": ["f{}".format(i) for i in range(10)]} for dll in DLLS],
+                    "imports": {dll: ["f{}".format(i) for i in range(10)] for dll in DLLS}},
+        "names": ["file{}.exe".format(rng.randrange(1000)) for _ in range(5)],
+    }, "id": "{:064x}".format(rng.getrandbits(256)), "type": "file"}
+
+
+def make_document(rng):
+    doc = {"domain": {"data": {"attributes": {"last_analysis_results": analysis_results(rng), "categories": {"Dr.Web": "adult"}}}}}
+    for relationship in RELATIONSHIPS:
+        doc[relationship] = {"data": [entry(rng) for _ in range(ENTRIES)], "meta": {"count": ENTRIES}, "links": {"self": "..."}}
+    return doc
+
+
+def timed(name, docs, func):
+    docs = copy.deepcopy(docs)
+    start = time.perf_counter()
+    for doc in docs:
+        func(doc)
+    elapsed = time.perf_counter() - start
+    logger.info("{:<20} {:>8.3f}s {:>8.2f} ms/doc".format(name, elapsed, 1000 * elapsed / len(docs)))
+    return docs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="micro-benchmark of clean_keys")
+    parser.add_argument("--docs", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(1337)
+    docs = [make_document(rng) for _ in range(args.docs)]
+    expected = timed("recursive re.sub", docs, recursive_clean_keys)
+    actual = timed("clean_keys", docs, clean_keys)
+    assert expected == actual
+
+
+if __name__ == "__main__":
+    main()
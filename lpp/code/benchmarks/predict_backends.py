@@ -0,0 +1,67 @@
+"""
+Cold-start load time and single row latency of the prediction backends of `DomainPredicter`: the pickled
+`XGBClassifier`, the exported booster with `inplace_predict` and the compiled numpy forest.
+
+Runs on the model under `model/`, trained with `lpp train --compile`, and rows of the feature store:
+
+    python -m benchmarks.predict_backends --collection domains_dataframe --rows 1000
+"""
+import time, pickle, argparse, logging, sys
+
+import numpy as np
+
+from train.xgb import MODEL_PATH, feature_frame
+from train.export import BOOSTER_PATH, FOREST_PATH, load_booster
+from utils.feature_store import load_matrix, load_labels, training_data_path
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(asctime)s %(levelname)-8s:%(name)s:  %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger("l++ benchmark predict backends")
+
+
+def load_pickle(file_path):
+    with open(file_path, "rb") as fp:
+        return pickle.load(fp)
+
+
+def backends(xgb_model):
+    """ (name, loader, predict) of every backend, `predict` takes the loaded artifact and one float32 row """
+    return [
+        ("sklearn", lambda: load_pickle(MODEL_PATH), lambda model, X: model.predict_proba(feature_frame(xgb_model, X))[:, 1]),
+        ("booster", lambda: load_booster(BOOSTER_PATH), lambda booster, X: booster.inplace_predict(X, validate_features=False)),
+        ("compiled", lambda: load_pickle(FOREST_PATH), lambda forest, X: forest.predict(X)),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark of the prediction backends")
+    parser.add_argument("-c", "--collection", default="domains_dataframe")
+    parser.add_argument("--rows", type=int, default=1000)
+    args = parser.parse_args()
+
+    xgb_model = load_pickle(MODEL_PATH)
+    file_path = training_data_path(args.collection)
+    rows = np.random.default_rng(1337).permutation(len(load_labels(file_path)))[:args.rows]
+    X, _, _ = load_matrix(file_path, rows=rows)
+    expected = xgb_model.predict_proba(feature_frame(xgb_model, X))[:, 1]
+
+    for name, loader, predict in backends(xgb_model):
+        start = time.perf_counter()
+        try:
+            artifact = loader()
+        except FileNotFoundError as e:
+            logger.warning("{:<10} not exported: {}".format(name, e))
+            continue
+        load_time = time.perf_counter() - start
+
+        latencies = np.empty(len(X))
+        actual = np.empty(len(X))
+        for i in range(len(X)):
+            start = time.perf_counter()
+            actual[i] = predict(artifact, X[i:i + 1])[0]
+            latencies[i] = time.perf_counter() - start
+        logger.info("{:<10} load {:>8.1f} ms  p50 {:>8.3f} ms  p99 {:>8.3f} ms  max |diff| {:.2e}".format(
+            name, 1000 * load_time, 1000 * np.median(latencies), 1000 * np.percentile(latencies, 99), np.max(np.abs(actual - expected))))
+
+
+if __name__ == "__main__":
+    main()
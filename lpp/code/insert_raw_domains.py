@@ -2,6 +2,7 @@ import json, logging, sys, argparse
 
 from datetime import datetime
 from utils.database import SetupDatabase
+from utils.domains import domain_fields
 from pymongo.errors import DuplicateKeyError
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(asctime)s %(levelname)-8s:%(name)s:  %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
@@ -29,7 +30,9 @@ def main():
                     new_entries[item.split(":")[0]] = item.split(":")[-1].strip()
                 doc["date"] = datetime.strptime(new_entries["Event Published"], '%Y-%m-%d')
                 doc["name"] = doc["identifier"]
+                doc.update(domain_fields(doc["name"]))
                 doc["tickets"] = []
+                doc["updated_at"] = datetime.utcnow()
                 doc["alerts"] = [
                     {
                         "date":doc["date"],
@@ -42,9 +45,9 @@ def main():
                     setup.db[args.collection].insert_one(doc)
                 except DuplicateKeyError:
                     logger.warn("The domain {} has already been inserted".format(doc["name"]))
-                    setup.db[args.collection].update_one({"name": doc["name"]}, {"$set": {"ioc_first_date": doc["date"]}})
+                    setup.db[args.collection].update_one({"name": doc["name"]}, {"$set": {"ioc_first_date": doc["date"], "updated_at": doc["updated_at"]}})
 
-    # Extracting tld and domain for analysis    
+    # Extracting tld and domain for the domains inserted before they were split on insert
     logger.info("Adding tld and domain to domains")
     setup.add_domain_and_tld(args.collection)
     logger.info("Done")
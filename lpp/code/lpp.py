@@ -1,25 +1,64 @@
-import argparse, logging, sys
+import argparse, logging, os, sys
+
+from datetime import datetime
 
 from pandas import json_normalize
 
-from train.xgb import main as train_main
+from train.xgb import main as train_main, write_manifest
+from train.external_memory import main as train_external_memory
+from train.tune import main as tune_main, load_best_params, LEADERBOARD_PATH
 from utils.database import SetupDatabase
+from utils.pipelines import pipeline_domains_dataframe
 from setup.create_dataframe import CreateDataframe
+from setup.flatten import projected_paths, CHUNK_SIZE
+from utils.feature_store import save_features, load_features, upsert_features, feature_store_path, load_checkpoint, save_checkpoint, changed_since
 
 logging.basicConfig(stream=sys.stdout, level=logging.DEBUG, format="%(asctime)s %(levelname)-8s:%(name)s:  %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
 logger = logging.getLogger("l++")
 
 
-def make_frame(collection, outfile=None):
+def update_frame(setup, collection, file_path, checkpoint):
+    """ transforms the domains changed since `checkpoint` with the artifacts of the last full run and upserts them """
+    setup.db[collection].create_index("updated_at")
+    changed = [doc["name"] for doc in setup.db[collection].find(changed_since(checkpoint), projection={"name": 1, "_id": 0})]
+    names = [doc["name"] for doc in setup.db[collection].find(projection={"name": 1, "_id": 0})]
+    logger.info("{} of {} domains in `{}` changed since {}".format(len(changed), len(names), collection, checkpoint))
+    if changed:
+        cursor = setup.db[collection].find({"name": {"$in": changed}}, batch_size=CHUNK_SIZE)
+        creator = CreateDataframe(cursor, collection, load_model=True, paths=projected_paths(pipeline_domains_dataframe({})[1]["$project"]))
+        creator.create_row()
+        df = creator.df
+    else:
+        df = load_features(file_path, rows=[])
+    upsert_features(df, file_path, replaced=changed, keep=names)
+
+
+def make_frame(collection, outfile=None, incremental=False, jobs=1):
     logger.info("Start of creating dataframe script")
     setup = SetupDatabase()
-    cursor = setup.db[collection].find()    
-    creator = CreateDataframe(cursor, collection)
-    creator.create_dataframe()
-    if outfile:
-        creator.df.to_pickle(outfile)
+    file_path = outfile or feature_store_path(collection)
+    started = datetime.utcnow()
+    checkpoint = load_checkpoint(file_path) if os.path.exists(file_path) else None
+    if incremental and checkpoint:
+        update_frame(setup, collection, file_path, checkpoint)
     else:
-        creator.df.to_pickle("model/df_post_scaling-{}.pickle".format(collection))
+        if incremental:
+            logger.warning("No checkpoint for {}, building the whole frame".format(file_path))
+        cursor = setup.db[collection].find(batch_size=CHUNK_SIZE)
+        creator = CreateDataframe(cursor, collection, paths=projected_paths(pipeline_domains_dataframe({})[1]["$project"]))
+        if jobs > 1:
+            creator.create_dataframe_parallel(jobs)
+        else:
+            creator.create_dataframe()
+        save_features(creator.df, file_path)
+    save_checkpoint(file_path, started)
+
+
+def parquet_path(path):
+    """ the feature store is parquet and read by its suffix, a `-o` path with another suffix is rejected """
+    if not path.endswith(".parquet"):
+        raise argparse.ArgumentTypeError("`{}` is not a .parquet file".format(path))
+    return path
 
 
 def create_parser():
@@ -30,10 +69,26 @@ def create_parser():
 
     parser_create_dataframe = subparsers.add_parser('frame', help='create dataframe')
     parser_create_dataframe.add_argument("-c", "--collection", required=True)
-    parser_create_dataframe.add_argument('-o', "--outfile", required=False)
+    parser_create_dataframe.add_argument('-o', "--outfile", type=parquet_path, required=False, help="the .parquet file of the feature store")
+    parser_create_dataframe.add_argument('-i', "--incremental", action="store_true", help="only transform the domains updated since the last run, with the artifacts of the last full run")
+    parser_create_dataframe.add_argument('-j', "--jobs", type=int, default=1, help="number of processes transforming row chunks of a full build")
     
     parser_train = subparsers.add_parser('train', help="train model")
     parser_train.add_argument('-c', '--collection', required=True)
+    parser_train.add_argument('-e', '--external-memory', action="store_true", help="read the feature store one row group at a time instead of loading it")
+    parser_train.add_argument('--compile', action="store_true", help="also compile the trees to the numpy predictor serving can use")
+    parser_train.add_argument('-t', '--tuned', nargs="?", const=LEADERBOARD_PATH, help="train with the best params of the leaderboard of `lpp tune`")
+
+    parser_tune = subparsers.add_parser('tune', help="search the xgb params with cross validation")
+    parser_tune.add_argument('-c', '--collection', required=True)
+    parser_tune.add_argument('-m', '--method', choices=["halving", "random"], default="halving")
+    parser_tune.add_argument('-n', '--trials', type=int, default=27, help="number of sampled candidates")
+    parser_tune.add_argument('-j', '--jobs', type=int, help="number of trials run at once, the cores are split between them")
+    parser_tune.add_argument('--cv', type=int, default=3, help="number of folds")
+    parser_tune.add_argument('--seed', type=int)
+
+    parser_manifest = subparsers.add_parser('manifest', help="write the serving manifest of the trained model")
+    parser_manifest.add_argument('-c', '--collection', required=True)
 
     return parser
     
@@ -46,9 +101,17 @@ def main():
         return
 
     if args.script == "frame":
-        make_frame(collection=args.collection, outfile=args.outfile)
+        make_frame(collection=args.collection, outfile=args.outfile, incremental=args.incremental, jobs=args.jobs)
     elif args.script == "train":
-        train_main(args.collection)
+        train = train_external_memory if args.external_memory else train_main
+        if args.tuned:
+            train(args.collection, params=load_best_params(args.tuned), compile=args.compile)
+        else:
+            train(args.collection, compile=args.compile)
+    elif args.script == "tune":
+        tune_main(args.collection, method=args.method, nr_trials=args.trials, jobs=args.jobs, cv=args.cv, seed=args.seed)
+    elif args.script == "manifest":
+        write_manifest(args.collection)
 
 if __name__ == "__main__":
     main()
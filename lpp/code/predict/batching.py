@@ -0,0 +1,49 @@
+import os
+import asyncio
+import logging
+
+from celery.utils import uuid
+
+from predict.tasks import predict_batch
+
+# seconds to wait for more requests before a batch is sent, and largest batch sent
+BATCH_WINDOW = float(os.getenv("PREDICT_BATCH_WINDOW", 0.05))
+BATCH_SIZE = int(os.getenv("PREDICT_BATCH_SIZE", 64))
+
+log = logging.getLogger("uvicorn")
+
+
+class MicroBatcher(object):
+    """
+    Coalesces prediction requests arriving within a short window into one `predict_batch` task.
+
+    Every request gets its own task id right away. `predict_batch` stores each result under that id,
+    so `AsyncResult(task_id)` works the same as for a task sent with `predict.delay`.
+    """
+
+    def __init__(self, task=predict_batch, window=BATCH_WINDOW, max_size=BATCH_SIZE):
+        self.task = task
+        self.window = window
+        self.max_size = max_size
+        self._pending = []
+        self._timer = None
+
+    def submit(self, data, top_k=None) -> str:
+        """ queues data for prediction and returns the task id its result will be stored under """
+        task_id = uuid()
+        self._pending.append((task_id, data, top_k))
+        if len(self._pending) >= self.max_size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_event_loop().call_later(self.window, self.flush)
+        return task_id
+
+    def flush(self):
+        """ sends the pending requests as one batch """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        items, self._pending = self._pending, []
+        if items:
+            log.debug("sending batch of {} predictions".format(len(items)))
+            self.task.apply_async(args=[items])
@@ -1,23 +1,57 @@
-import sys, logging, pickle, logging
+import os, sys, logging
 import shap
 import pandas as pd
 import xgboost as xgb
 import numpy as np
 
-from sklearn.metrics import precision_recall_curve 
-
-from setup.create_dataframe import CreateDataframe, load_model
+from setup.create_dataframe import CreateDataframe
+from setup.feature_plan import feature_plan_path
+from train.xgb import MODEL_PATH, MANIFEST_PATH, load_manifest
+from train.export import BOOSTER_PATH, FOREST_PATH, load_booster
+from utils.artifacts import artifacts
 from utils.database import flatten_array_data
 from utils.queries import API_ENDPOINTS
 
 logging.basicConfig(stream=sys.stdout, level=logging.WARN, format="%(asctime)s %(levelname)-8s:%(name)s:  %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
 logger = logging.getLogger("l++ domain predicter")
 
-def get_shap_model(bst, data):
-    explainer = shap.TreeExplainer(bst)
-    shap_values = explainer.shap_values(data)
+COLLECTION = "domains_dataframe"
+
+# `sklearn` for `XGBClassifier.predict_proba`, `booster` for `Booster.inplace_predict`, `compiled` for the numpy forest
+PREDICT_BACKEND = os.getenv("PREDICT_BACKEND", "booster")
+
+def get_shap_model(bst, data, explainer=None):
+    if explainer is None:
+        explainer = shap.TreeExplainer(bst)
     explanation = explainer(data)
-    return explainer, shap_values, explanation
+    return explainer, explanation.values, explanation
+
+
+def load_predictor(model, backend=PREDICT_BACKEND):
+    """
+    A function from model input frames to positive probabilities with `backend`. Models trained before the booster
+    was exported, or without the compiled forest, fall back to the next backend down to `predict_proba`.
+    """
+    if backend == "compiled":
+        try:
+            forest = artifacts.get(FOREST_PATH)
+            return lambda X: forest.predict(X.to_numpy(dtype=np.float32))
+        except FileNotFoundError:
+            logger.warning("No compiled forest found, predicting with the booster")
+    if backend in ("booster", "compiled"):
+        try:
+            booster = artifacts.get(BOOSTER_PATH, loader=load_booster)
+            # the columns are already in model order, numpy input has no names to validate
+            return lambda X: booster.inplace_predict(X.to_numpy(dtype=np.float32), validate_features=False)
+        except FileNotFoundError:
+            logger.warning("No exported booster found, predicting with the sklearn wrapper")
+    return lambda X: model.predict_proba(X)[:, 1]
+
+
+def top_contributions(x_domain, shap_values, top_k):
+    """ the `top_k` features with the largest absolute shap value, largest first """
+    order = np.argsort(-np.abs(shap_values))[:top_k]
+    return {x_domain.columns[i]: float(shap_values[i]) for i in order}
 
 
 class DomainPredicter(object):
@@ -34,15 +68,33 @@ class DomainPredicter(object):
         # error margin for "not sure" predictions
         self.error_margin = 0.2
         
-        # Load train model
-        self.model = load_model("model/xgb_model.pickle")
+        self.model = None
+        self.predict = None
+        self.explainer = None
+        self.feature_plan = None
+        self._load_artifacts()
+        
+    def _load_artifacts(self):
+        """ (re)loads the model artifacts through the worker's registry, picks up models dropped into model/ """
+        model = artifacts.get(MODEL_PATH)
+        
+        # Load compiled feature plan, models trained before it existed fall back to `create_row`
+        try:
+            self.feature_plan = artifacts.get(feature_plan_path(COLLECTION))
+        except FileNotFoundError:
+            self.feature_plan = None
         
-        # Load model data for setting threshold
-        self.model_input_data =  pd.read_pickle("model/df_post_scaling-domains_dataframe.pickle")
-        test_idx = pickle.load(open("model/test_idx.pickle", "rb"))
-        self.X_test = self.model_input_data.iloc[test_idx,1:].copy()
-        self.y_test = self.model_input_data.iloc[test_idx,0].copy()
-        self._set_optimal_threshold()
+        # threshold and curves computed when the model was trained
+        self.manifest = artifacts.get(MANIFEST_PATH, loader=load_manifest)
+        self.threshold = self.manifest["threshold"]
+        
+        if model is self.model:
+            return
+        self.model = model
+        self.predict = load_predictor(self.model)
+        self.explainer = shap.TreeExplainer(self.model)
+        if self.feature_plan is None:
+            logger.warning("No feature plan found, creating features with pandas")
         
     def _crunch_data(self):
 
@@ -50,37 +102,43 @@ class DomainPredicter(object):
         for endpoint in API_ENDPOINTS:
             flatten_array_data(self.raw_data, endpoint)            
         
-        creator = CreateDataframe(self.raw_data, collection="domains_dataframe", load_model=True)
+        if self.feature_plan is not None:
+            self.x_domain = self.feature_plan.transform_frame(self.raw_data)
+            return
+
+        creator = CreateDataframe(self.raw_data, collection=COLLECTION, load_model=True)
         creator.create_row()
         
         # order columns to how the model trained on them
-        cols_when_model_builds = self.model.get_booster().feature_names
+        cols_when_model_builds = self.manifest["feature_names"]
         
         # Set the input data
         self.x_domain = creator.df[cols_when_model_builds].iloc[[-1]]
         
 
-    def _set_optimal_threshold(self):
-        """ Sets the threshold to optimize f1 score """
-        probabilities = self.model.predict_proba(self.X_test)
-        
-        # keep probabilities for the positive outcome only
-        probabilities = probabilities[:, 1]
-
-        precision, recall, thresholds = precision_recall_curve(self.y_test, probabilities)
-        f1_scores = 2*recall*precision/(recall+precision)
-        self.threshold = thresholds[np.argmax(f1_scores)]
-        
-    def get_prediction(self, data: dict) -> dict:
-        """outputs prediction"""
+    def _set_x_domain(self, data):
+        """ sets the one row model input for a raw domain document or a cached `x_domain` """
         if "alerts" in data.keys():
             self.raw_data = data
             self._crunch_data()
         else:
-            self.x_domain = pd.DataFrame.from_dict(self.x_domain)
-             
-        prob = self.model.predict_proba(self.x_domain)
-        positive_prediction = prob[:, 1]
+            self.x_domain = pd.DataFrame.from_dict(data)
+        return self.x_domain
+
+    def _model_input(self, data):
+        """
+        the model input of one domain in the columns of the model. A cached `x_domain` made before the model was
+        retrained may lack some of them, that fails only its own domain.
+        """
+        x_domain = self._set_x_domain(data)
+        cols_when_model_builds = self.manifest["feature_names"]
+        missing = x_domain.columns.get_indexer(cols_when_model_builds) < 0
+        if missing.any():
+            raise KeyError("model input lacks {} of the model's features, e.g. `{}`".format(
+                missing.sum(), cols_when_model_builds[missing.argmax()]))
+        return x_domain[cols_when_model_builds]
+
+    def _format_result(self, positive_prediction, shap_values, top_k=None):
         if positive_prediction > self.threshold:
             verdict = "Malicious"
         elif positive_prediction + self.error_margin > self.threshold:
@@ -92,8 +150,6 @@ class DomainPredicter(object):
         evilness = round(np.log(float(positive_prediction) / (1 - float(positive_prediction))), 4)
         evil_threshold = round(np.log(float(self.threshold) / (1 - float(self.threshold))), 4)
         
-
-        _, shap_values, _ = self.get_explanation()
         result = {
             "verdict": verdict,
             "name": self.x_domain.index[0],
@@ -102,8 +158,50 @@ class DomainPredicter(object):
             "x_domain": self.x_domain.to_dict(),
             "shap_values": shap_values.tolist()
         }
+        if top_k:
+            result["shap_values"] = []
+            result["contributions"] = top_contributions(self.x_domain, shap_values[0], top_k)
+        return result
+
+    def get_predictions(self, batch: list, top_k=None) -> list:
+        """
+        outputs predictions for many domains with one predict_proba and one SHAP evaluation.
+        
+        A domain that can not be crunched gets its exception in place of a result. With `top_k`, a number
+        or one per domain, only the largest shap contributions are returned instead of all shap values.
+        """
+        if not isinstance(top_k, list):
+            top_k = [top_k] * len(batch)
+        self._load_artifacts()
+        results, x_domains = [], []
+        for data in batch:
+            try:
+                x_domains.append(self._model_input(data))
+                results.append(None)
+            except Exception as e:
+                logger.exception("Could not create model input for `{}`".format(data.get("name")))
+                results.append(e)
+        if not x_domains:
+            return results
+        
+        X = pd.concat(x_domains)
+        positive_predictions = self.predict(X)
+        shap_values = self.explainer.shap_values(X)
+        
+        row = 0
+        for i, result in enumerate(results):
+            if result is None:
+                self.x_domain = X.iloc[[row]]
+                results[i] = self._format_result(positive_predictions[row], shap_values[[row]], top_k[i])
+                row += 1
+        return results
+
+    def get_prediction(self, data: dict, top_k=None) -> dict:
+        """outputs prediction"""
+        result = self.get_predictions([data], top_k=top_k)[0]
+        if isinstance(result, Exception):
+            raise result
         return result
     
     def get_explanation(self):
-        return get_shap_model(self.model, self.x_domain)
-
+        return get_shap_model(self.model, self.x_domain, explainer=self.explainer)
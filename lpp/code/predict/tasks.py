@@ -1,9 +1,12 @@
 import importlib
 import logging
-from celery import Task
+from celery import Task, states
 from predict.domain_predicter import DomainPredicter
 from predict.worker import app
 
+# models loaded in this worker, shared by all tasks with the same path
+_models = {}
+
 class PredictTask(Task):
     """
     Abstraction of Celery's Task class to support loading ML model.
@@ -21,11 +24,13 @@ class PredictTask(Task):
         Avoids the need to load model on each task request
         """
         if not self.model:
-            logging.info('Loading Model...')
-            module_import = importlib.import_module(self.path[0])
-            model_obj = getattr(module_import, self.path[1])
-            self.model = model_obj()
-            logging.info('Model loaded')
+            if self.path not in _models:
+                logging.info('Loading Model...')
+                module_import = importlib.import_module(self.path[0])
+                model_obj = getattr(module_import, self.path[1])
+                _models[self.path] = model_obj()
+                logging.info('Model loaded')
+            self.model = _models[self.path]
         return self.run(*args, **kwargs)
 
 @app.task(ignore_result=False,
@@ -33,8 +38,30 @@ class PredictTask(Task):
           base=PredictTask,
           path=('predict.domain_predicter', 'DomainPredicter'),
           name='{}.{}'.format(__name__, 'Domain'))
-def predict(self, data):
+def predict(self, data, top_k=None):
     """
     creates a prediction for data and crunches it if this is not a cached result
     """
-    return self.model.get_prediction(data)
+    return self.model.get_prediction(data, top_k=top_k)
+
+@app.task(ignore_result=True,
+          bind=True,
+          base=PredictTask,
+          path=('predict.domain_predicter', 'DomainPredicter'),
+          name='{}.{}'.format(__name__, 'DomainBatch'))
+def predict_batch(self, items):
+    """
+    creates predictions for [(task_id, data, top_k)] in one go and stores each result under its own task id
+    """
+    try:
+        results = self.model.get_predictions([data for _, data, _ in items], top_k=[top_k for _, _, top_k in items])
+    except Exception as e:
+        # the task has no result of its own, without this the requests of the batch would stay pending
+        for task_id, _, _ in items:
+            self.backend.mark_as_failure(task_id, e)
+        raise
+    for (task_id, _, _), result in zip(items, results):
+        if isinstance(result, Exception):
+            self.backend.mark_as_failure(task_id, result)
+        else:
+            self.backend.store_result(task_id, result, states.SUCCESS)
@@ -10,22 +10,72 @@ import pandas as pd
 import numpy as np
 
 from datetime import datetime
-from pandas import json_normalize
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, repeat
+from operator import itemgetter
+from dateutil.tz import tzlocal
+from scipy import sparse
 from sklearn.preprocessing import MinMaxScaler
 from sklearn.decomposition import TruncatedSVD
 
 from utils.database import SetupDatabase
+from utils.artifacts import artifacts
+from setup.flatten import stream_normalize
+from utils.feature_store import save_features, feature_store_path, LABEL_COLUMN, FEATURE_DTYPE, LABEL_DTYPE
 
 
 
 NA_fraction_threshold = 0.8
 
+# columns that identify a domain but are not features
+META_DATA_COLUMNS = [
+    '_id', 
+    'name', 
+    'alert_first_name', 
+    'alert_first_sha',
+    'ticket_first_severity',
+    'ticket_first_id',
+    'domain', 
+    'subdomain',
+    'updated_at'
+]
+
+# one-hot encoded feature groups that are compressed with truncated svd, in order of compression
+SVD_GROUPS = [
+    ("url_header_content_http", lambda col: "attributes.last_http_response_headers.content" in col),
+    ("historical_whois", lambda col: col.startswith("vt.historical_whois")),
+    ("domain_categories", lambda col: col.startswith("vt.domain.data.attributes.categories")),
+    ("domain_registrar", lambda col: "vt.domain.data.attributes.registrar" in col),
+    ("tld", lambda col: col.startswith("tld")),
+]
+
+ENDPOINT_STATS_REGEXES = [
+    # Calc stats on all vt native endpoints and attributes, like malicious votes and the like
+    r"vt\.(?P<endpoint>.*?)\.data\.\d*?\.attributes\.(?P<attribute>.*)",
+    # Calc stats on time related vt data for all enpoinds and attributes
+    r"delta_vt\.(?P<endpoint>.*?)\.data\.\d*?\.attributes\.(?P<attribute>.*)",
+]
+
+# steps of `create_dataframe` that only look at their own row once the columns are fixed, in order, split by the
+# steps that learn from the whole corpus. `create_dataframe_parallel` runs them on row chunks in a process pool
+CHUNK_STEPS_TIME = ["make_time_objects", "create_tickets_columns", "create_alerts_columns"]
+CHUNK_STEPS_PROCESSED = ["create_time_diff", "keep_processed", "make_time_unitless"]
+CHUNK_STEPS_DELTAS = CHUNK_STEPS_PROCESSED + ["calculate_endpoint_statistics"]
+CHUNKS_PER_JOB = 4
+
 logging.basicConfig(stream=sys.stdout, level=logging.DEBUG, format="%(asctime)s %(levelname)-8s:%(name)s:  %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
 logger = logging.getLogger("l++ create  dataframe")
 
 class TypeNotFoundExcpetion(Exception):
     pass
 
+def svd_path(prefix, collection):
+    return "model/svd_{}_{}.pickle".format(prefix, collection)
+
+def processed_columns_path(collection):
+    """ the columns of the training frame before compression, with the dummies among them """
+    return "model/processed_columns_{}.pickle".format(collection)
+
 def save_model(obj, file_path):
     with open(file_path, 'wb') as fp:
         pickle.dump(obj, fp)
@@ -35,17 +85,147 @@ def load_model(file_path):
         obj = pickle.load(fp)
     return obj
 
+def explode_records(column, key):
+    """ one row per dict in the lists of `column` with its `key`, the dict as `record` and `row`, the position of its list """
+    lists = [val if isinstance(val, list) else [] for val in column]
+    lengths = [len(val) for val in lists]
+    records = np.fromiter(chain.from_iterable(lists), dtype=object, count=sum(lengths))
+    return pd.DataFrame({
+        "row": np.repeat(np.arange(len(lists)), lengths),
+        # `np.fromiter` keeps datetimes as objects, a list would have numpy convert every one of them
+        key: np.fromiter(map(itemgetter(key), records), dtype=object, count=len(records)),
+        "record": records
+    })
+
+def parse_alert_dates(dates):
+    """ alert dates from datetimes, `%Y-%m-%dT%H:%M:%S.%f` strings or epoch strings with two trailing digits, in local time """
+    parsed = pd.to_datetime(dates, format='%Y-%m-%dT%H:%M:%S.%f', errors="coerce", cache=False)
+    failed = dates[parsed.isna() & dates.notna()]
+    if not failed.empty:
+        digits = failed.map(lambda date: isinstance(date, str) and date.isdigit()).astype(bool)
+        epochs = pd.to_datetime(failed[digits].str[:-2].astype(np.int64), unit="s", utc=True)
+        parsed[digits.index[digits]] = epochs.dt.tz_convert(tzlocal()).dt.tz_localize(None)
+        pd.to_datetime(failed[~digits], format='%Y-%m-%dT%H:%M:%S.%f') # raises on the dates that are neither
+    return parsed
+
+def first_by_date(rows, dates):
+    """
+    Positions of the earliest of `dates` per value of `rows`, the first one on ties, like `groupby(rows).idxmin()`.
+    A stable sort on (row, date) instead, `idxmin` of pandas 1.x runs in python once per group.
+    """
+    if not len(rows):
+        return np.empty(0, dtype=np.int64)
+    nanos = dates.values.astype("datetime64[ns]").view(np.int64)
+    nanos = np.where(dates.isna().values, np.iinfo(np.int64).max, nanos)
+    order = np.lexsort((nanos, rows))
+    return order[np.r_[True, rows[order][1:] != rows[order][:-1]]]
+
+def column_at(rows, values, nr_rows, missing=None):
+    """
+    `values` at the positions in `rows` and `missing` elsewhere. Dates are returned as datetime64 with NaT, anything
+    else as a list so pandas infers the dtype like it does for the lists the python loops built.
+    """
+    if len(rows) and getattr(values, "dtype", None) is not None and values.dtype.kind == "M":
+        column = np.full(nr_rows, np.datetime64("NaT"), dtype=values.dtype)
+        column[rows] = values
+        return column
+    column = np.full(nr_rows, missing, dtype=object)
+    column[rows] = np.fromiter(values, dtype=object, count=len(rows))
+    return column.tolist()
+
+def run_steps(df, collection, steps):
+    """ runs the `CreateDataframe` methods in `steps` on `df`, in a worker of `create_dataframe_parallel` """
+    creator = CreateDataframe.from_frame(df, collection)
+    for step in steps:
+        getattr(creator, step)()
+    return creator.df
+
+def concat_chunks(chunks):
+    """
+    Concatenates the row chunks of one frame. Columns a step dropped in some chunk are dropped, like the step drops
+    them from the whole frame. Date columns of chunks without any date are all None, they are made datetime64 again.
+    """
+    df = pd.concat(chunks, axis=0, join="inner", sort=False, copy=False)
+    for col in df.select_dtypes("object").columns:
+        if any(chunk[col].dtype.kind == "M" for chunk in chunks):
+            df[col] = pd.to_datetime(df[col])
+    return df
+
+def svd_group(col):
+    """ prefix of the first of `SVD_GROUPS` the dummy column `col` is compressed with, None if it is kept """
+    for prefix, in_group in SVD_GROUPS:
+        if in_group(col):
+            return prefix
+    return None
+
+def one_hot(encodings, vocabulary, nr_rows):
+    """
+    Sparse one-hot matrix over the dummy columns in `vocabulary` from (dummy names, codes) per object column,
+    where `codes` are the positions in the names or -1. Dummies outside `vocabulary` are left out.
+    """
+    index = {name: i for i, name in enumerate(vocabulary)}
+    rows, cols = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+    for names, codes in encodings:
+        target = np.array([index.get(name, -1) for name in names] + [-1], dtype=np.int64)[codes]
+        hit = np.flatnonzero(target >= 0)
+        rows.append(hit)
+        cols.append(target[hit])
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    X = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(nr_rows, len(vocabulary)))
+    X.sum_duplicates()
+    return X
+
+def stats_groups(columns, regex):
+    """
+    The columns matching `regex` and the (endpoint, attribute, columns) groups they make. The columns of a group are
+    all columns of the endpoint that end with the attribute, whether they match `regex` or not.
+    """
+    matches = [(col, re.match(regex, col)) for col in columns]
+    matching_columns = [col for col, match in matches if match]
+    pairs = sorted({(match.group(1), match.group(2)) for _, match in matches if match})
+    endpoint_columns = {}
+    for endpoint in {endpoint for endpoint, _ in pairs}:
+        match_endpoint = re.compile(".*?vt.{0}".format(endpoint)).match
+        endpoint_columns[endpoint] = [col for col in columns if match_endpoint(col)]
+    groups = [(endpoint, attribute, [col for col in endpoint_columns[endpoint] if col.endswith(attribute)]) for endpoint, attribute in pairs]
+    return matching_columns, groups
+
+def grouped_stats(X, sizes):
+    """
+    Count, mean and std (ddof 1) of every row of `X` over consecutive groups of columns of `sizes`, skipping NaN
+    like `DataFrame.count`, `mean` and `std` do. Sums run in column order, the same for one row or many.
+    """
+    starts = np.r_[0, np.cumsum(sizes)[:-1]]
+    valid = ~np.isnan(X)
+    values = np.where(valid, X, 0)
+    count = np.add.reduceat(valid.astype(np.int64), starts, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.add.reduceat(values, starts, axis=1) / count
+        deviations = np.where(valid, values - np.repeat(mean, sizes, axis=1), 0)
+        std = np.where(count > 1, np.sqrt(np.add.reduceat(deviations ** 2, starts, axis=1) / (count - 1)), np.nan)
+    return count, mean, std
+
 
 class CreateDataframe(object):
 
-    def __init__(self, cursor, collection, load_model=False, n_components=50) -> None:
+    def __init__(self, cursor, collection, load_model=False, n_components=50, paths=None) -> None:
         logger.info(f"flattening `{collection}`")
-        df = json_normalize(cursor)
+        df = stream_normalize(cursor, paths=paths)
         self.df = df
         self.load_model = load_model
         self.n_components = n_components
         self.collection = collection
         super().__init__()
+
+    @classmethod
+    def from_frame(cls, df, collection, load_model=False, n_components=50):
+        """ a `CreateDataframe` over an already flattened frame """
+        creator = cls.__new__(cls)
+        creator.df = df
+        creator.load_model = load_model
+        creator.n_components = n_components
+        creator.collection = collection
+        return creator
     
     def sort_data(self):
         temp = self.df["ticket_label"]
@@ -53,24 +233,26 @@ class CreateDataframe(object):
         self.df.sort_index(axis=1, inplace=True)
         self.df.insert(0, "ticket_label", temp)
 
-    def set_trunc_svd(self, prefix, cols, n_components):
+    def cast_data(self):
+        """ float32 features, the precision xgboost splits on, and a uint8 label, half the memory of float64 """
+        dtypes = dict.fromkeys(self.df.columns, FEATURE_DTYPE)
+        dtypes[LABEL_COLUMN] = LABEL_DTYPE
+        self.df = self.df.astype(dtypes)
+
+    def set_trunc_svd(self, prefix, encodings, n_components):
         
         if self.load_model:
-            svd, original_cols = load_model("model/svd_{}_{}.pickle".format(prefix, self.collection))
-            
-            missing_cols = list(set(original_cols) - set(cols))
-            self.df.loc[:,missing_cols] = 0 # Impute the missing columns
-
-            extra_cols = list(set(cols) - set(original_cols))
-            self.df.drop(columns=extra_cols, inplace=True) # drop the extra columns
-
+            svd, original_cols = artifacts.get(svd_path(prefix, self.collection))
+            n_components = svd.components_.shape[0]
+            # categories the model has not seen are not encoded
             cols = original_cols
-            X = self.df.loc[:,cols].values
         else:
             svd = TruncatedSVD(n_components=n_components, n_iter=7, random_state=42)
-            X = self.df.loc[:,cols].values
+            cols = [name for names, _ in encodings for name in names]
+        X = one_hot(encodings, cols, len(self.df))
+        if not self.load_model:
             svd.fit(X)
-            save_model((svd, cols), "model/svd_{}_{}.pickle".format(prefix, self.collection))
+            save_model((svd, cols), svd_path(prefix, self.collection))
         
         
         svdDf = svd.transform(X)
@@ -80,7 +262,6 @@ class CreateDataframe(object):
                             columns = [f'svd_{prefix}_{i}' for i in range(n_components)]
                         )
         svdDf.index = self.df.index
-        self.df.drop(columns=cols, inplace=True)
         self.df = pd.concat([self.df, svdDf], axis=1, sort=False)
 
 
@@ -118,29 +299,17 @@ class CreateDataframe(object):
         self.df.drop(columns=tags, inplace=True)
     
     def keep_same_columns_as_model(self):
+        """
+        Drops the columns the training frame dropped for missing values and gives object columns of the training
+        frame the object dtype. Missing columns are not imputed, `align_processed_columns` adds them like a full
+        build has them, as missing values.
+        """
         logger.info("Matching columns to model after na drop")
-        original_data = pd.read_pickle("model/df_after_na_drop_{}.pickle".format(self.collection))
-        new_columns = set(self.df.columns)
-        original_columns = set(original_data.columns)
-        have_both = original_columns.intersection(new_columns)
-        only_in_new = new_columns - original_columns
-        only_in_old = original_columns - new_columns
+        original_data = artifacts.get("model/df_after_na_drop_{}.pickle".format(self.collection), loader=pd.read_pickle)
+        only_in_new = set(self.df.columns) - set(original_data.columns)
         self.df.drop(columns=list(only_in_new), inplace=True)
-        only_in_old = list(only_in_old)
-        
-        # add nans for old columns
-        for col in only_in_old:
-            if col in original_data.select_dtypes("datetime64").columns or col in original_data.select_dtypes("timedelta64").columns:
-                self.df[col] = np.datetime64('nat')
-            elif col in original_data.select_dtypes("object").columns:
-                self.df[col] = ""
-            elif col in original_data.select_dtypes("float64").columns:
-                self.df[col] = 0.0
-            elif col in original_data.select_dtypes("int64").columns:
-                self.df[col] = 0
-            else:
-                raise TypeNotFoundExcpetion(f"could not find type of column: {col}") 
-        
+        objects = [col for col in original_data.select_dtypes("object").columns if col in self.df.columns]
+        self.df[objects] = self.df[objects].astype(object)
 
     def drop_nas(self):
         logger.info("Drop columns with too many missing values")
@@ -155,29 +324,18 @@ class CreateDataframe(object):
     
     def create_tickets_columns(self):
         logger.info("create ticket data from array")
-        tickets = self.df["tickets"]
+        # only the tickets of the first `tickets_aggregation` document count
+        tickets = self.df["tickets"].map(lambda row: row[0]["tickets"] if isinstance(row, list) and row else [])
+        long = explode_records(tickets, "date")
+        first = first_by_date(long["row"].values, pd.to_datetime(long["date"], cache=False))
+        rows, records = long["row"].values[first], long["record"].values[first]
+
         labels = {
-            "ticket_label": [],
-            "ticket_first_id": [],
-            "ticket_first_date": [],
-            "ticket_first_severity": []
+            "ticket_label": np.isin(np.arange(len(self.df)), rows).astype(np.int64).tolist(),
+            "ticket_first_id": column_at(rows, (ticket["id"] for ticket in records), len(self.df)),
+            "ticket_first_date": column_at(rows, long["date"].values[first], len(self.df)),
+            "ticket_first_severity": column_at(rows, (ticket["severity"] for ticket in records), len(self.df))
         }
-
-        for row in tickets:
-            if not row:
-                labels["ticket_label"].append(0)
-                labels["ticket_first_id"].append(None)
-                labels["ticket_first_date"].append(None)
-                labels["ticket_first_severity"].append(None)
-            else:
-                ticket = min(row[0]["tickets"], key=lambda x: x["date"])
-                labels["ticket_label"].append(1)
-                labels["ticket_first_id"].append(ticket["id"])
-                labels["ticket_first_date"].append(ticket["date"])
-                labels["ticket_first_severity"].append(ticket["severity"])
-        for key in labels.keys():
-            assert len(self.df) == len(labels[key]), "Something went wrong when creating ticket data."
-
         for key in labels.keys():
             self.df.insert(2, key, labels[key])
         logger.info("Inserted the following ticket columns:")
@@ -188,35 +346,16 @@ class CreateDataframe(object):
 
     def create_alerts_columns(self):
         logger.info("create alert data from array")
-
-        alerts = self.df["alerts"]
+        long = explode_records(self.df["alerts"], "date")
+        dates = parse_alert_dates(long["date"])
+        first = first_by_date(long["row"].values, dates)
+        rows, records = long["row"].values[first], long["record"].values[first]
 
         new_alert_data = {
-            "alert_first_sha": [],
-            "alert_first_date": [],
-            "alert_first_name": []
+            "alert_first_sha": column_at(rows, (alert["sha"] for alert in records), len(self.df), missing=""),
+            "alert_first_date": column_at(rows, dates.values[first], len(self.df)),
+            "alert_first_name": column_at(rows, (alert["name"] for alert in records), len(self.df), missing="")
         }
-
-        logger.info("Creating alerts columns")
-        for row in alerts:
-            
-            if row:
-                for alert in row:
-                    if isinstance(alert["date"], str) and alert["date"].isdigit():
-                        alert["date"] = datetime.fromtimestamp(int(alert["date"][:-2]))
-                    elif isinstance(alert["date"], str):
-                        alert["date"] = datetime.strptime(alert["date"], '%Y-%m-%dT%H:%M:%S.%f')
-                alert = min(row, key=lambda x: x["date"])
-                new_alert_data["alert_first_sha"].append(alert["sha"])
-                new_alert_data["alert_first_date"].append(alert["date"])
-                new_alert_data["alert_first_name"].append(alert["name"])
-            else:
-                new_alert_data["alert_first_sha"].append("")
-                new_alert_data["alert_first_date"].append(None)
-                new_alert_data["alert_first_name"].append("")
-        for key in new_alert_data.keys():
-            assert len(new_alert_data[key]) == len(self.df), "Something went wrong creating alert data"
-
         for key in new_alert_data.keys():
                 self.df.insert(2, key, new_alert_data[key])
         logger.info("Inserting the following ticket colums")
@@ -250,17 +389,7 @@ class CreateDataframe(object):
 
         logger.info("Remove metadata")
 
-        meta_data = [
-            '_id', 
-            'name', 
-            'alert_first_name', 
-            'alert_first_sha',
-            'ticket_first_severity',
-            'ticket_first_id',
-            'domain', 
-            'subdomain' 
-        ]
-        for col in meta_data:    
+        for col in META_DATA_COLUMNS:    
             try:
                 self.df.drop(columns=col, inplace=True)
             except KeyError as e:
@@ -277,9 +406,29 @@ class CreateDataframe(object):
         self.df.drop(columns=list_columns, inplace=True)
     
     def get_dummies(self):
+        """
+        One-hot encodes the object columns. Dummies of the `SVD_GROUPS` are kept as category codes per group and
+        encoded as sparse matrices by `compress_data`, the other dummies become uint8 columns like `pd.get_dummies`.
+        """
         logger.info("Get one-hot encoding")
-        dummies = pd.get_dummies(self.df.select_dtypes("object"))
-
+        self.encodings = {prefix: [] for prefix, _ in SVD_GROUPS}
+        dummies = {}
+        for col in self.df.select_dtypes("object").columns:
+            categorical = pd.Categorical(self.df[col])
+            names = np.array(["{}_{}".format(col, level) for level in categorical.categories], dtype=object)
+            groups = np.array([svd_group(name) for name in names], dtype=object)
+            for prefix, _ in SVD_GROUPS:
+                in_group = groups == prefix
+                if in_group.any():
+                    # codes of the categories outside the group are -1, like missing values
+                    codes = np.where(in_group, np.arange(len(names)), -1)[categorical.codes]
+                    codes[categorical.codes < 0] = -1
+                    self.encodings[prefix].append((names.tolist(), codes))
+            for j in np.flatnonzero(groups == None):
+                dummies[names[j]] = (categorical.codes == j).astype(np.uint8)
+
+        dummies = pd.DataFrame(dummies, index=self.df.index)
+        self.dummy_columns = list(dummies.columns)
         self.df[dummies.columns] = dummies
         self.df.drop(columns=self.df.select_dtypes("object"), inplace=True)
 
@@ -306,65 +455,64 @@ class CreateDataframe(object):
         logger.info("Create unitless columns from time")
         self.df.loc[:,self.df.select_dtypes("timedelta64").columns] = self.df.select_dtypes("timedelta64") / pd.to_timedelta(1, unit="D")
     
+    def save_processed_columns(self, columns):
+        save_model((list(columns), self.dummy_columns), processed_columns_path(self.collection))
+
+    def align_processed_columns(self):
+        """
+        Saves the columns of a full build before compression. With `load_model` new rows get exactly those
+        columns, dummies they lack as 0 and other columns as NaN, so that the endpoint statistics and the scaling
+        see the same columns and values as the row has in a full build.
+        """
+        if not self.load_model:
+            self.save_processed_columns(self.df.columns)
+            return
+        try:
+            columns, dummy_columns = artifacts.get(processed_columns_path(self.collection))
+        except FileNotFoundError:
+            logger.warning("No processed columns for `{}`, rebuild the frame to match it".format(self.collection))
+            return
+        missing_dummies = [col for col in dummy_columns if col not in self.df.columns]
+        self.df = self.df.reindex(columns=columns)
+        self.df[missing_dummies] = self.df[missing_dummies].fillna(0).astype(np.uint8)
+
     def compress_data(self):
         logger.info("Compress Various Categorical Features with Truncated SVD")
-        http_cols = [col for col in self.df.select_dtypes("uint8") if "attributes.last_http_response_headers.content" in col]
-        if http_cols:
-            self.set_trunc_svd("url_header_content_http", http_cols, n_components=self.n_components)
-
-        historical_whois_cols = [col for col in self.df.select_dtypes("uint8") if col.startswith("vt.historical_whois")]
-        if historical_whois_cols:
-            self.set_trunc_svd("historical_whois", historical_whois_cols, n_components=self.n_components)
-
-        domains_categories = [col for col in self.df.select_dtypes("uint8") if col.startswith("vt.domain.data.attributes.categories")]
-        if domains_categories:
-            self.set_trunc_svd("domain_categories", domains_categories, n_components=self.n_components)
-
-        domain_registrar = [col for col in self.df.select_dtypes("uint8").columns if "vt.domain.data.attributes.registrar" in col]
-        if domain_registrar:
-            self.set_trunc_svd("domain_registrar", domain_registrar, n_components=self.n_components)
-
-        tld = [col for col in self.df.select_dtypes("uint8").columns if col.startswith("tld")]
-        if tld:
-            self.set_trunc_svd("tld", tld, n_components=self.n_components)
+        for prefix, _ in SVD_GROUPS:
+            # a frozen group compresses rows without any of its dummies too, to the projection of zeros
+            if self.encodings[prefix] or (self.load_model and os.path.exists(svd_path(prefix, self.collection))):
+                self.set_trunc_svd(prefix, self.encodings[prefix], n_components=self.n_components)
     
     def calculate_endpoint_statistics(self):
-        # Calc stats on all vt native endpoints and attributes, like malicious votes and the like
-        regex = r"vt\.(?P<endpoint>.*?)\.data\.\d*?\.attributes\.(?P<attribute>.*)"
-        self.calc_stats_on_columns(regex)
-        
-        # Calc stats on time related vt data for all enpoinds and attributes
-        regex = r"delta_vt\.(?P<endpoint>.*?)\.data\.\d*?\.attributes\.(?P<attribute>.*)"
-        self.calc_stats_on_columns(regex)
+        for regex in ENDPOINT_STATS_REGEXES:
+            self.calc_stats_on_columns(regex)
 
     def calc_stats_on_columns(self, regex):
         """calculate mean, std and count on some rows with mult entries"""
         col_name = "vt_stats.{endpoint}.{attribute}.{statistic}"
-        
-        matching_columns = [col for col in self.df.columns if re.match(regex, col)]
-        logger.info("found {} matching columns. Calculating stats...".format(len(matching_columns)))
-        meta_data = [(re.match(regex, col).group(1), re.match(regex, col).group(2)) for col in self.df.columns if re.match(regex, col)]
-        meta_data = list(set(meta_data))
-        for endpoint, attribute in meta_data:
-            
-            # get columns matching an <endpoint> with an <attribute>
-            end_point_attr_columns = [col for col in self.df.columns if re.match(".*?vt.{0}".format(endpoint), col) and col.endswith(attribute)]
-            
-            df_subset = self.df[end_point_attr_columns].T.copy(deep=True)
 
-            # calculate stats
-            self.df.loc[:,col_name.format(endpoint=endpoint, attribute=attribute, statistic="count")] = df_subset.count()
-            self.df.loc[:,col_name.format(endpoint=endpoint, attribute=attribute, statistic="mean")] = df_subset.mean()
-            self.df.loc[:,col_name.format(endpoint=endpoint, attribute=attribute, statistic="std")] = df_subset.std()
-        
-        # drop the old columns when done
-        logger.info("Dropping columns. This can take a while...")
-        self.df.drop(columns=matching_columns, inplace=True)
+        matching_columns, groups = stats_groups(self.df.columns, regex)
+        logger.info("found {} matching columns. Calculating stats...".format(len(matching_columns)))
+        if not groups:
+            return
+
+        # all groups in one matrix, a column in several groups is repeated
+        X = self.df[[col for _, _, cols in groups for col in cols]].to_numpy(dtype=np.float64)
+        count, mean, std = grouped_stats(X, [len(cols) for _, _, cols in groups])
+        stats = {}
+        for i, (endpoint, attribute, _) in enumerate(groups):
+            stats[col_name.format(endpoint=endpoint, attribute=attribute, statistic="count")] = count[:, i]
+            stats[col_name.format(endpoint=endpoint, attribute=attribute, statistic="mean")] = mean[:, i]
+            stats[col_name.format(endpoint=endpoint, attribute=attribute, statistic="std")] = std[:, i]
+
+        # drop the old columns and the stats of an earlier call, if any
+        replaced = [col for col in stats if col in self.df.columns]
+        self.df = pd.concat([self.df.drop(columns=matching_columns + replaced), pd.DataFrame(stats, index=self.df.index)], axis=1)
     
     def scale_data(self):
         cols = [col for col in self.df.columns if not col.startswith("svd_") and col != "ticket_label"]
         if self.load_model:
-            scaler, original_cols = load_model("model/minmax_{}.pickle".format(self.collection))
+            scaler, original_cols = artifacts.get("model/minmax_{}.pickle".format(self.collection))
             
             missing_cols = list(set(original_cols) - set(cols))
             self.df.loc[:, missing_cols] = 0 # Impute the missing columns
@@ -389,10 +537,12 @@ class CreateDataframe(object):
         self.create_time_diff()
         self.keep_processed()
         self.make_time_unitless() 
+        self.align_processed_columns()
         self.compress_data()        
         self.calculate_endpoint_statistics()
         self.scale_data()
         self.sort_data()
+        self.cast_data()
 
     def create_dataframe(self):
         self.drop_nas()
@@ -405,10 +555,43 @@ class CreateDataframe(object):
         self.create_time_diff()
         self.keep_processed()
         self.make_time_unitless() 
+        self.align_processed_columns()
         self.compress_data()        
         self.calculate_endpoint_statistics()
         self.scale_data()
         self.sort_data()
+        self.cast_data()
+
+    def map_chunks(self, executor, steps, nr_chunks):
+        """ runs `steps` on `nr_chunks` row chunks of the frame in `executor` and concatenates them in order """
+        bounds = np.linspace(0, len(self.df), nr_chunks + 1).astype(np.int64)
+        chunks = [self.df.iloc[start:stop] for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+        logger.info("Running {} on {} chunks".format(", ".join(steps), len(chunks)))
+        self.df = concat_chunks(list(executor.map(run_steps, chunks, repeat(self.collection), repeat(steps))))
+
+    def create_dataframe_parallel(self, jobs):
+        """
+        Same frame and artifacts as `create_dataframe`, with the row local steps on chunks in `jobs` processes.
+        The steps that learn from the whole corpus, the NA and no variance drops, the one-hot vocabularies and the
+        SVD and scaler fits, run on the whole frame between the chunked steps.
+        """
+        self.drop_nas()
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            self.map_chunks(executor, CHUNK_STEPS_TIME, jobs * CHUNKS_PER_JOB)
+            self.drop_cols_no_variance()
+            self.rename_index()
+            self.get_dummies()
+            # the columns the chunks have before their statistics, from a chunk without rows
+            self.save_processed_columns(run_steps(self.df.iloc[:0], self.collection, CHUNK_STEPS_PROCESSED).columns)
+            self.map_chunks(executor, CHUNK_STEPS_DELTAS, jobs * CHUNKS_PER_JOB)
+        stats = [col for col in self.df.columns if col.startswith("vt_stats.")]
+        self.compress_data()
+        # the svd columns go before the stats, where `create_dataframe` puts them
+        svd = [col for col in self.df.columns if col.startswith("svd_")]
+        self.df = self.df[[col for col in self.df.columns if col not in stats and col not in svd] + svd + stats]
+        self.scale_data()
+        self.sort_data()
+        self.cast_data()
 
 
 def main():
@@ -423,4 +606,4 @@ def main():
     
     creator = CreateDataframe(cursor, collection)
     creator.create_dataframe()
-    creator.df.to_pickle("model/df_post_scaling-{}.pickle".format(collection))
\ No newline at end of file
+    save_features(creator.df, feature_store_path(collection))
\ No newline at end of file
@@ -1,5 +1,5 @@
 # Requires pymongo 3.6.0+
-from utils.database import SetupDatabase, TICKETS_NAME, ALERTS_NAME, DOMAINS_NAME, INCIDENTS_NAME, DOMAINS_REAL_TIME_NAME
+from utils.database import SetupDatabase, TICKETS_NAME, ALERTS_NAME, DOMAINS_NAME, INCIDENTS_NAME, DOMAINS_REAL_TIME_NAME, VT_CACHE_NAME, VT_JOBS_NAME
 
 from pymongo.errors import ServerSelectionTimeoutError
 import logging
@@ -26,6 +26,10 @@ def main():
     setup.db[ALERTS_NAME].create_index("dst")
     setup.db[ALERTS_NAME].create_index("hosts_array")
     setup.db[INCIDENTS_NAME].create_index("number", unique=True)
+    setup.db[VT_CACHE_NAME].create_index([("domain", 1), ("endpoint", 1)], unique=True)
+    setup.db[VT_CACHE_NAME].create_index("expires_at", expireAfterSeconds=0)
+    setup.db[VT_JOBS_NAME].create_index([("collection", 1), ("name", 1)], unique=True)
+    setup.db[VT_JOBS_NAME].create_index([("collection", 1), ("status", 1), ("priority", -1), ("name", 1)])
     setup.client.close()
     logger.info("Done.")
 
@@ -0,0 +1,396 @@
+"""
+Compiled feature plan for single domain inference.
+
+`CreateDataframe.create_row` runs the whole pandas training pipeline on a one row frame and reloads
+every artifact from `model/` to do so. The plan is compiled once from those artifacts at training time
+and replays the same steps on a plain dict, returning a numpy vector in the order of the model features.
+
+Rows are aligned to the columns the training frame had before compression, so a domain gets the features
+its row of the training frame has. Plans of frames built before those columns were saved are not aligned,
+their endpoint statistics differ from the training frame.
+"""
+import re, sys, logging
+
+import numpy as np
+import pandas as pd
+
+from scipy import sparse
+
+from datetime import datetime
+
+from setup.flatten import flatten_document
+from setup.create_dataframe import load_model, save_model, processed_columns_path, \
+                                   META_DATA_COLUMNS, SVD_GROUPS, ENDPOINT_STATS_REGEXES, grouped_stats
+from utils.feature_store import FEATURE_DTYPE
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(asctime)s %(levelname)-8s:%(name)s:  %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger("l++ feature plan")
+
+STATS_COLUMN = "vt_stats.{endpoint}.{attribute}.{statistic}"
+STATISTICS = ["count", "mean", "std"]
+NS_PER_SECOND = 10**9
+NS_PER_DAY = np.timedelta64(24 * 3600 * NS_PER_SECOND, "ns")
+
+# value kinds, named after the dtype a one row frame gives the value
+INT, FLOAT, BOOL, OBJECT, DATETIME, TIMEDELTA, UINT8 = "int64", "float64", "bool", "object", "datetime64", "timedelta64", "uint8"
+NUMERIC = (INT, FLOAT, UINT8)
+_INT64_MIN, _INT64_MAX = -2**63, 2**63 - 1
+
+
+def feature_plan_path(collection):
+    return "model/feature_plan_{}.pickle".format(collection)
+
+
+def value_kind(value):
+    """ dtype pandas infers for a column holding only `value` """
+    if isinstance(value, bool) or isinstance(value, np.bool_):
+        return BOOL
+    if isinstance(value, (int, np.integer)):
+        return INT if _INT64_MIN <= value <= _INT64_MAX else OBJECT
+    if isinstance(value, (float, np.floating)):
+        return FLOAT
+    if isinstance(value, (datetime, np.datetime64)):
+        return DATETIME
+    return OBJECT
+
+
+def _as_ns(value):
+    """ nanoseconds since epoch of a datetime value, None for NaT """
+    if value is None or pd.isna(value):
+        return None
+    return pd.Timestamp(value).value
+
+
+def _staged(value):
+    """ (kind, value) pair a raw value enters the plan with """
+    kind = value_kind(value)
+    return (kind, _as_ns(value)) if kind == DATETIME else (kind, value)
+
+
+def _to_datetime_like_pandas(value, **kwargs):
+    """ converts a value like `pd.to_datetime` converts a one row column. Returns ns or None for NaT """
+    converted = pd.to_datetime(pd.Series([value]), **kwargs)
+    if converted.dtype != "datetime64[ns]":
+        raise ValueError("conversion of {!r} did not give naive datetimes".format(value))
+    return _as_ns(converted.iloc[0])
+
+
+def _alert_date(date):
+    if isinstance(date, str) and date.isdigit():
+        return datetime.fromtimestamp(int(date[:-2]))
+    elif isinstance(date, str):
+        return datetime.strptime(date, '%Y-%m-%dT%H:%M:%S.%f')
+    return date
+
+
+def _endpoint_stats(values):
+    """ count, mean and std as `CreateDataframe.calc_stats_on_columns` computes them """
+    if not values:
+        return 0, np.nan, np.nan
+    count, mean, std = grouped_stats(np.array([values], dtype=np.float64).reshape(1, -1), [len(values)])
+    return int(count[0, 0]), mean[0, 0], std[0, 0]
+
+
+class FeaturePlan(object):
+    """
+    Replays `CreateDataframe.create_row` for one document without pandas frames or disk reads.
+
+    Built with `compile_feature_plan` from the artifacts `lpp frame` saved to `model/`.
+    """
+
+    # plans compiled before these existed keep all dummies and do not align
+    object_columns = frozenset()
+    processed_columns = None
+
+    def __init__(self, collection, raw_columns, svd_groups, scaler_columns, scale, min_, feature_names,
+                 object_columns=frozenset(), processed_columns=None):
+        self.collection = collection
+        # columns of the na dropped training frame, and those with the object dtype
+        self.raw_columns = raw_columns
+        self.object_columns = object_columns
+        # [(column, missing value)] of the training frame before compression, None without the artifact
+        self.processed_columns = processed_columns
+        # [(prefix, {dummy column: index}, components)]
+        self.svd_groups = svd_groups
+        self.scaler_columns = scaler_columns
+        self.scale = scale
+        self.min = min_
+        self.feature_names = feature_names
+        self.stats_pairs = self._stats_pairs()
+        self.pair_index = {pair: i for i, pair in enumerate(self.stats_pairs)}
+        self.svd_index = {prefix: i for i, (prefix, _, _) in enumerate(svd_groups)}
+        self._compile_output()
+        self._routes = [{} for _ in ENDPOINT_STATS_REGEXES]
+        self._date_strings = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_routes"] = [{} for _ in ENDPOINT_STATS_REGEXES]
+        state["_date_strings"] = {}
+        return state
+
+    def _stats_pairs(self):
+        """ (endpoint, attribute) pairs whose statistics are used by the scaler """
+        pairs = []
+        for col in self.scaler_columns:
+            if not col.startswith("vt_stats."):
+                continue
+            name, _, statistic = col.rpartition(".")
+            if statistic not in STATISTICS:
+                continue
+            endpoint, _, attribute = name[len("vt_stats."):].partition(".")
+            if (endpoint, attribute) not in pairs:
+                pairs.append((endpoint, attribute))
+        return pairs
+
+    def _compile_output(self):
+        scaler_index = {col: i for i, col in enumerate(self.scaler_columns)}
+        svd_offsets, offset = {}, len(self.scaler_columns)
+        for prefix, _, components in self.svd_groups:
+            svd_offsets[prefix] = offset
+            offset += components.shape[0]
+
+        output_index = []
+        for feature in self.feature_names:
+            if feature in scaler_index:
+                output_index.append(scaler_index[feature])
+                continue
+            match = re.fullmatch(r"svd_(?P<prefix>.*)_(?P<component>\d+)", feature)
+            if match and match.group("prefix") in svd_offsets:
+                output_index.append(svd_offsets[match.group("prefix")] + int(match.group("component")))
+                continue
+            raise KeyError("feature `{}` is not produced by the artifacts of `{}`".format(feature, self.collection))
+        self.output_index = np.array(output_index, dtype=np.intp)
+
+    def transform(self, data):
+        """ turns one domain document, with flattened relationship arrays, into the model's feature vector """
+        stage = self._keep_same_columns_as_model(flatten_document(data))
+        self._make_time_objects(stage)
+        name, alert_ns = self._create_tickets_and_alerts_columns(stage)
+        stage = self._get_dummies(stage)
+        stage = self._create_time_diff(stage, alert_ns)
+        svd_values = self._compress_data(stage)
+        stage = self._align_processed_columns(stage)
+        for stats_pass in range(len(ENDPOINT_STATS_REGEXES)):
+            stage = self._calculate_endpoint_statistics(stats_pass, stage)
+
+        features = np.empty(len(self.scaler_columns) + sum(len(values) for values in svd_values))
+        scaled = np.array([stage.get(col, (INT, 0))[1] for col in self.scaler_columns], dtype=np.float64)
+        scaled *= self.scale
+        scaled += self.min
+        features[:len(scaled)] = scaled
+        offset = len(scaled)
+        for values in svd_values:
+            features[offset:offset + len(values)] = values
+            offset += len(values)
+        return features[self.output_index].astype(FEATURE_DTYPE)
+
+    def transform_frame(self, data):
+        """ same as `transform` but returns a one row frame indexed by the domain name, like `create_row` """
+        return pd.DataFrame([self.transform(data)], columns=self.feature_names, index=[data["name"]])
+
+    def _keep_same_columns_as_model(self, row):
+        stage = {}
+        for col, val in row.items():
+            if col in self.object_columns:
+                stage[col] = (OBJECT, val)
+            elif col in self.raw_columns:
+                stage[col] = _staged(val)
+        return stage
+
+    def _make_time_objects(self, stage):
+        epoch_columns = {INT: [], FLOAT: []}
+        for col, (kind, value) in list(stage.items()):
+            try:
+                if "timestamp" in col:
+                    if kind in epoch_columns:
+                        epoch_columns[kind].append(col)
+                    elif kind != DATETIME:
+                        stage[col] = (DATETIME, _to_datetime_like_pandas(value, unit="s"))
+                elif "Date" in col and kind == OBJECT:
+                    stage[col] = (DATETIME, self._parse_date_string(value))
+                elif "date" in col and kind in epoch_columns:
+                    epoch_columns[kind].append(col)
+            except Exception:
+                del stage[col]
+
+        for kind, cols in epoch_columns.items():
+            if not cols:
+                continue
+            values = np.array([stage[col][1] for col in cols], dtype=kind)
+            try:
+                converted = pd.to_datetime(values, unit="s").asi8.tolist()
+            except Exception:
+                # one out of bounds value only drops its own column
+                converted = []
+                for i in range(len(values)):
+                    try:
+                        converted.append(pd.to_datetime(values[i:i + 1], unit="s").asi8[0])
+                    except Exception:
+                        converted.append(False)
+            for col, ns in zip(cols, converted):
+                if ns is False:
+                    del stage[col]
+                else:
+                    stage[col] = (DATETIME, None if ns == pd.NaT.value else ns)
+
+    def _parse_date_string(self, value):
+        if not isinstance(value, str):
+            return _to_datetime_like_pandas(value, infer_datetime_format=False)
+        try:
+            parsed = self._date_strings[value]
+        except KeyError:
+            try:
+                parsed = _to_datetime_like_pandas(value, infer_datetime_format=False)
+            except Exception as e:
+                parsed = e
+            self._date_strings[value] = parsed
+        if isinstance(parsed, Exception):
+            raise parsed
+        return parsed
+
+    def _create_tickets_and_alerts_columns(self, stage):
+        tickets = stage.pop("tickets")[1]
+        if tickets:
+            ticket = min(tickets[0]["tickets"], key=lambda x: x["date"])
+            stage["ticket_first_date"] = _staged(ticket["date"])
+        else:
+            stage["ticket_first_date"] = (OBJECT, None)
+
+        alerts = stage.pop("alerts")[1]
+        if not alerts:
+            raise ValueError("domain has no alerts to predict on")
+        alert = min(({**alert, "date": _alert_date(alert["date"])} for alert in alerts), key=lambda x: x["date"])
+        name = stage["name"][1]
+        for col in META_DATA_COLUMNS:
+            stage.pop(col, None)
+        return name, _as_ns(alert["date"])
+
+    def _get_dummies(self, stage):
+        processed, dummies = {}, {}
+        for col, (kind, value) in stage.items():
+            if kind != OBJECT:
+                processed[col] = (kind, value)
+            elif isinstance(value, list):
+                continue
+            elif value is not None and not pd.isna(value):
+                dummies["{}_{}".format(col, value)] = (UINT8, 1)
+        processed.update(dummies)
+        return processed
+
+    def _create_time_diff(self, stage, alert_ns):
+        """ keeps the numeric columns and turns vt dates into days relative the first alert """
+        processed, deltas = {}, {}
+        for col, (kind, value) in stage.items():
+            if kind in NUMERIC:
+                processed[col] = (kind, value)
+            elif kind == DATETIME and col.startswith("vt"):
+                if value is None or alert_ns is None:
+                    deltas["delta_" + col] = (FLOAT, np.nan)
+                else:
+                    days = np.timedelta64(value - alert_ns, "ns") / NS_PER_DAY
+                    deltas["delta_" + col] = (FLOAT, float(days))
+        processed.update(deltas)
+        return processed
+
+    def _compress_data(self, stage):
+        svd_values = [np.zeros(components.shape[0]) for _, _, components in self.svd_groups]
+        for prefix, in_group in SVD_GROUPS:
+            cols = [col for col, (kind, _) in stage.items() if kind == UINT8 and in_group(col)]
+            if not cols or prefix not in self.svd_index:
+                continue
+            i = self.svd_index[prefix]
+            _, vocabulary, components = self.svd_groups[i]
+            indices = sorted(vocabulary[col] for col in cols if col in vocabulary)
+            for col in cols:
+                stage.pop(col)
+            # the same sparse product as `set_trunc_svd`, so that the values are equal bit for bit
+            X = sparse.csr_matrix((np.ones(len(indices)), indices, [0, len(indices)]), shape=(1, len(vocabulary)))
+            svd_values[i] = (X @ components.T)[0]
+        return svd_values
+
+    def _align_processed_columns(self, stage):
+        """ the columns of `align_processed_columns` in training order, dummies the row lacks as 0, others as NaN """
+        if self.processed_columns is None:
+            return stage
+        return {col: stage.get(col, missing) for col, missing in self.processed_columns}
+
+    def _route(self, stats_pass, col):
+        """ pair `col` triggers and pairs it is a source column for, cached per column name """
+        routes = self._routes[stats_pass]
+        try:
+            return routes[col]
+        except KeyError:
+            pass
+        match = re.match(ENDPOINT_STATS_REGEXES[stats_pass], col)
+        trigger = (match.group(1), match.group(2)) if match else None
+        sources = [i for i, (endpoint, attribute) in enumerate(self.stats_pairs)
+                   if col.endswith(attribute) and re.match(".*?vt.{0}".format(endpoint), col)]
+        routes[col] = (trigger, sources)
+        return routes[col]
+
+    def _calculate_endpoint_statistics(self, stats_pass, stage):
+        processed = {}
+        triggered = set()
+        sources = [[] for _ in self.stats_pairs]
+        for col, (kind, value) in stage.items():
+            trigger, pair_indexes = self._route(stats_pass, col)
+            for i in pair_indexes:
+                sources[i].append(value)
+            if trigger is None:
+                processed[col] = (kind, value)
+            elif trigger in self.pair_index:
+                triggered.add(self.pair_index[trigger])
+
+        for i in sorted(triggered):
+            endpoint, attribute = self.stats_pairs[i]
+            count, mean, std = _endpoint_stats(sources[i])
+            processed[STATS_COLUMN.format(endpoint=endpoint, attribute=attribute, statistic="count")] = (INT, count)
+            processed[STATS_COLUMN.format(endpoint=endpoint, attribute=attribute, statistic="mean")] = (FLOAT, mean)
+            processed[STATS_COLUMN.format(endpoint=endpoint, attribute=attribute, statistic="std")] = (FLOAT, std)
+        return processed
+
+
+def compile_feature_plan(collection, feature_names):
+    """ compiles the artifacts `lpp frame` saved for `collection` into a `FeaturePlan` """
+    logger.info(f"Compiling feature plan for `{collection}`")
+    original_data = pd.read_pickle("model/df_after_na_drop_{}.pickle".format(collection))
+    raw_columns = set(original_data.columns)
+    object_columns = frozenset(original_data.select_dtypes("object").columns)
+    try:
+        columns, dummy_columns = load_model(processed_columns_path(collection))
+        dummy_columns = set(dummy_columns)
+        processed_columns = [(col, (UINT8, 0) if col in dummy_columns else (FLOAT, np.nan)) for col in columns]
+    except FileNotFoundError:
+        logger.warning(f"No processed columns for `{collection}`, the plan will not match the training frame")
+        processed_columns = None
+
+    svd_groups = []
+    for prefix, _ in SVD_GROUPS:
+        try:
+            svd, cols = load_model("model/svd_{}_{}.pickle".format(prefix, collection))
+        except FileNotFoundError:
+            logger.warning(f"No svd model for `{prefix}`, skipping")
+            continue
+        vocabulary = {col: i for i, col in enumerate(cols)}
+        svd_groups.append((prefix, vocabulary, np.ascontiguousarray(svd.components_)))
+
+    scaler, scaler_columns = load_model("model/minmax_{}.pickle".format(collection))
+    return FeaturePlan(
+        collection=collection,
+        raw_columns=raw_columns,
+        svd_groups=svd_groups,
+        scaler_columns=list(scaler_columns),
+        scale=np.array(scaler.scale_, dtype=np.float64),
+        min_=np.array(scaler.min_, dtype=np.float64),
+        feature_names=list(feature_names),
+        object_columns=object_columns,
+        processed_columns=processed_columns,
+    )
+
+
+def export_feature_plan(collection, feature_names):
+    plan = compile_feature_plan(collection, feature_names)
+    save_model(plan, feature_plan_path(collection))
+    logger.info("Saved feature plan to {}".format(feature_plan_path(collection)))
+    return plan
@@ -0,0 +1,186 @@
+"""
+Streaming replacement for `pandas.json_normalize` on the `*_dataframe` collections.
+
+`json_normalize(cursor)` holds every nested document, every flattened record and a 2D object array of the
+whole frame at once. `stream_normalize` flattens the documents one chunk at a time into per column buffers,
+numeric columns in numpy arrays, and builds a frame equal to the one `json_normalize` gives.
+"""
+import re, sys, logging
+
+import numpy as np
+import pandas as pd
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(asctime)s %(levelname)-8s:%(name)s:  %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger("l++ flatten")
+
+CHUNK_SIZE = 1000
+
+# kinds of column chunks
+INT, FLOAT, OBJECT = "int", "float", "object"
+_INT64_MIN, _INT64_MAX = -2**63, 2**63 - 1
+
+# array indices added by `flatten_array_data`, e.g. `vt.urls.data.3.attributes`
+_ARRAY_INDEX = re.compile(r"\.\d+(?=\.|$)")
+
+
+def _flatten_into(flat, prefix, data, separator):
+    for key, val in data.items():
+        if type(val) is dict:
+            _flatten_into(flat, f"{prefix}{separator}{key}", val, separator)
+        else:
+            flat[f"{prefix}{separator}{key}"] = val
+
+
+def flatten_document(data, separator="."):
+    """ flattens nested dicts to dotted keys in the same order as `pandas.json_normalize` """
+    flat = {key: val for key, val in data.items() if type(val) is not dict}
+    for key, val in data.items():
+        if type(val) is dict:
+            _flatten_into(flat, key, val, separator)
+    return flat
+
+
+def projected_paths(projection):
+    """ the included paths of a `$project` stage, e.g. the one of `pipeline_domains_dataframe` """
+    return tuple(path for path, include in projection.items() if include)
+
+
+class PathFilter(object):
+    """ keeps the flattened columns under one of `paths`, array indices ignored, and `_id` """
+
+    def __init__(self, paths):
+        self.paths = paths
+        self._cache = {"_id": True}
+
+    def __call__(self, column):
+        try:
+            return self._cache[column]
+        except KeyError:
+            path = _ARRAY_INDEX.sub("", column)
+            keep = any(path == prefix or path.startswith(prefix + ".") for prefix in self.paths)
+            self._cache[column] = keep
+            return keep
+
+
+def _chunk_kind(values):
+    """ INT or FLOAT if all values are ints or all are floats, else OBJECT so that ints stay ints in mixed columns """
+    kinds = set()
+    for val in values:
+        if type(val) is int and _INT64_MIN <= val <= _INT64_MAX:
+            kinds.add(INT)
+        elif type(val) is float:
+            kinds.add(FLOAT)
+        else:
+            return OBJECT
+    return kinds.pop() if len(kinds) == 1 else OBJECT
+
+
+class ColumnBuffer(object):
+    """
+    Values of one column, as a list of chunks. Chunks of only ints or only floats are kept as numpy arrays,
+    anything else as a list of the values, missing values are NaN like in `json_normalize`.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.rows = {}
+
+    def add(self, row, value):
+        self.rows[row] = value
+
+    def flush(self, nr_rows):
+        rows, self.rows = self.rows, {}
+        if not rows:
+            self.chunks.append((FLOAT, np.full(nr_rows, np.nan), None))
+            return
+        kind = _chunk_kind(rows.values())
+        if kind == INT:
+            values = np.zeros(nr_rows, dtype=np.int64)
+            missing = np.ones(nr_rows, dtype=bool)
+            for row, val in rows.items():
+                values[row] = val
+                missing[row] = False
+            self.chunks.append((INT, values, missing if missing.any() else None))
+        elif kind == FLOAT:
+            values = np.full(nr_rows, np.nan)
+            for row, val in rows.items():
+                values[row] = val
+            self.chunks.append((FLOAT, values, None))
+        else:
+            values = [np.nan] * nr_rows
+            for row, val in rows.items():
+                values[row] = val
+            self.chunks.append((OBJECT, values, None))
+
+    def _values(self):
+        for kind, values, missing in self.chunks:
+            if kind == OBJECT:
+                yield from values
+            elif kind == INT and missing is not None:
+                yield from (np.nan if miss else val for val, miss in zip(values.tolist(), missing))
+            else:
+                yield from values.tolist()
+
+    def to_array(self):
+        kinds = {kind for kind, _, _ in self.chunks}
+        if kinds == {INT} and all(missing is None for _, _, missing in self.chunks):
+            return np.concatenate([values for _, values, _ in self.chunks])
+        if OBJECT not in kinds:
+            return np.concatenate([
+                np.where(missing, np.nan, values) if missing is not None else values.astype(np.float64)
+                for _, values, missing in self.chunks
+            ])
+        # let pandas infer the dtype from the values, like it does for the records of json_normalize
+        return pd.Series(list(self._values()), dtype=None).values
+
+
+class FrameBuilder(object):
+    """ appends flattened documents chunk by chunk, new columns are backfilled with NaN """
+
+    def __init__(self, paths=None, chunk_size=CHUNK_SIZE):
+        self.keep = PathFilter(paths) if paths else None
+        self.chunk_size = chunk_size
+        self.columns = {}
+        self.nr_rows = 0
+        self.chunk_rows = 0
+
+    def append(self, doc):
+        row = self.chunk_rows
+        for column, val in flatten_document(doc).items():
+            if self.keep and not self.keep(column):
+                continue
+            try:
+                buffer = self.columns[column]
+            except KeyError:
+                buffer = self.columns[column] = ColumnBuffer()
+                if self.nr_rows:
+                    buffer.chunks.append((FLOAT, np.full(self.nr_rows, np.nan), None))
+            buffer.add(row, val)
+        self.chunk_rows += 1
+        if self.chunk_rows >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.chunk_rows:
+            return
+        for buffer in self.columns.values():
+            buffer.flush(self.chunk_rows)
+        self.nr_rows += self.chunk_rows
+        self.chunk_rows = 0
+
+    def to_frame(self):
+        self.flush()
+        data = {}
+        for column in list(self.columns):
+            data[column] = self.columns.pop(column).to_array()
+        return pd.DataFrame(data, index=pd.RangeIndex(self.nr_rows), columns=list(data))
+
+
+def stream_normalize(documents, paths=None, chunk_size=CHUNK_SIZE):
+    """ `json_normalize(documents)`, flattened `chunk_size` documents at a time, keeping only `paths` if given """
+    if isinstance(documents, dict):
+        documents = [documents]
+    builder = FrameBuilder(paths=paths, chunk_size=chunk_size)
+    for doc in documents:
+        builder.append(doc)
+    return builder.to_frame()
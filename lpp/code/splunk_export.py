@@ -15,7 +15,7 @@ import splunklib.results as results
 import splunklib.client as client
 import tqdm
 
-from utils.database import SetupDatabase, ALERTS_NAME
+from utils.database import SetupDatabase, ALERTS_NAME, alert_date
 from utils.queries import VALID_ALERTS
 from utils.pipelines import VALID_ALERTS_REGEX
 from unittests.validate import log_validation_stats
@@ -112,7 +112,7 @@ def main():
                 logger.warning("Message: {msg}".format(msg=result))
                 continue
             try:
-                doc["date"] = datetime.fromtimestamp(float(doc["timestamp"]))
+                doc["date"] = alert_date(doc["timestamp"])
             except KeyError:
                 doc["error"] = {"type": "splunk", "message": "timestamp not found"}
                 logger.warn("timestamp not found in alert with sha {}".format(doc["sha"]))
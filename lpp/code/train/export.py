@@ -0,0 +1,113 @@
+"""
+Exports the trained model for serving without the sklearn wrapper.
+
+The booster is saved in XGBoost's binary UBJ format, cut to the trees up to the best iteration, so that
+`Booster.inplace_predict` gives the probabilities `XGBClassifier.predict_proba` gives. It can also be compiled to a
+`CompiledForest`, the trees as flat numpy arrays evaluated for all trees and rows at once.
+"""
+import sys, json, pickle, logging
+
+import numpy as np
+import xgboost as xgb
+
+BOOSTER_PATH = "model/xgb_model.ubj"
+FOREST_PATH = "model/xgb_forest.pickle"
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(asctime)s %(levelname)-8s:%(name)s:  %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger("xgb export")
+
+
+class CompiledForest(object):
+    """
+    The trees of a binary:logistic booster as one array per node attribute, nodes of all trees in one index space.
+    Leaves point to themselves, so every row walks all trees in lock step until all of them are at a leaf.
+    """
+
+    def __init__(self, roots, feature, threshold, left, right, default, value, base_margin):
+        self.roots = roots
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.default = default
+        self.value = value
+        self.is_leaf = left == np.arange(len(left))
+        self.base_margin = base_margin
+
+    def predict_margin(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        rows = np.arange(len(X))[:, None]
+        pos = np.tile(self.roots, (len(X), 1))
+        while not self.is_leaf[pos].all():
+            x = X[rows, self.feature[pos]]
+            # like xgboost, a value goes left when it is less than the split condition and NaN takes the default
+            pos = np.where(np.isnan(x), self.default[pos], np.where(x < self.threshold[pos], self.left[pos], self.right[pos]))
+        return self.value[pos].sum(axis=1, dtype=np.float32) + self.base_margin
+
+    def predict(self, X):
+        """ probabilities of the positive class, like `Booster.inplace_predict` """
+        return 1 / (1 + np.exp(-self.predict_margin(X)))
+
+
+def best_booster(xgb_model):
+    """ the booster of `xgb_model` with only the trees up to its best iteration, the ones `predict_proba` uses """
+    booster = xgb_model.get_booster()
+    best_iteration = booster.attr("best_iteration")
+    if best_iteration is None:
+        return booster
+    return booster[:int(best_iteration) + 1]
+
+
+def compile_forest(booster):
+    """ a `CompiledForest` from the JSON dump of a binary:logistic booster """
+    model = json.loads(booster.save_raw("json"))["learner"]
+    base_score = float(model["learner_model_param"]["base_score"].strip("[]"))
+    trees = model["gradient_booster"]["model"]["trees"]
+
+    roots, feature, threshold, left, right, default, value = [], [], [], [], [], [], []
+    offset = 0
+    for tree in trees:
+        children = np.array(tree["left_children"], dtype=np.int64)
+        nodes = np.arange(len(children))
+        leaf = children == -1
+        # the split condition of a leaf is its value
+        conditions = np.array(tree["split_conditions"], dtype=np.float32)
+        left_children = np.where(leaf, nodes, children) + offset
+        right_children = np.where(leaf, nodes, tree["right_children"]) + offset
+        roots.append(offset)
+        feature.append(np.where(leaf, 0, tree["split_indices"]))
+        threshold.append(np.where(leaf, 0, conditions))
+        value.append(np.where(leaf, conditions, 0))
+        left.append(left_children)
+        right.append(right_children)
+        default.append(np.where(np.array(tree["default_left"], dtype=bool), left_children, right_children))
+        offset += len(children)
+
+    forest = CompiledForest(
+        roots=np.array(roots, dtype=np.int64),
+        feature=np.concatenate(feature).astype(np.int64),
+        threshold=np.concatenate(threshold).astype(np.float32),
+        left=np.concatenate(left),
+        right=np.concatenate(right),
+        default=np.concatenate(default),
+        value=np.concatenate(value).astype(np.float32),
+        base_margin=np.float32(np.log(base_score / (1 - base_score))),
+    )
+    logger.info("Compiled {} trees with {} nodes".format(len(trees), offset))
+    return forest
+
+
+def load_booster(file_path=BOOSTER_PATH):
+    booster = xgb.Booster()
+    booster.load_model(file_path)
+    return booster
+
+
+def export_model(xgb_model, compile=False):
+    """ saves the native booster for serving and, with `compile`, the `CompiledForest` of it """
+    booster = best_booster(xgb_model)
+    booster.save_model(BOOSTER_PATH)
+    logger.info("Saved booster with {} trees to {}".format(booster.num_boosted_rounds(), BOOSTER_PATH))
+    if compile:
+        with open(FOREST_PATH, "wb") as fp:
+            pickle.dump(compile_forest(booster), fp)
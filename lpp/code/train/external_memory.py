@@ -0,0 +1,104 @@
+"""
+Trains the xgb model without holding the feature frame in memory.
+
+The split is made on the label column alone and kept as the positions of the train and test rows. XGBoost reads
+the rows of each split one parquet row group at a time through a `DataIter` and caches them on disk, so the
+memory needed is about one row group and the model, not the frame. The cached pages go to a directory of the run
+under `CACHE_DIR` that is removed once the model is trained, also when training fails. Only a killed run leaves
+its directory behind, `CACHE_DIR` can be removed whenever no training runs.
+"""
+import os
+import sys
+import time
+import logging
+import tempfile
+
+import numpy as np
+import xgboost as xgb
+
+from setup.feature_plan import export_feature_plan
+from train.export import export_model
+from train.xgb import params, MODEL_PATH, save_model, save_manifest, manifest_from_probabilities, as_classifier, \
+                      feature_frame, split, balanced_params, log_results, log_resources, save_split
+from utils.feature_store import load_matrix, load_labels, load_schema, row_group_batches, feature_store_path
+
+CACHE_DIR = "model/xgb_cache"
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(asctime)s %(levelname)-8s:%(name)s:  %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger("xgb train external memory")
+
+
+class FeatureIter(xgb.DataIter):
+    """ the rows at `rows` of a feature store, one batch per row group """
+
+    def __init__(self, file_path, rows, cache_prefix):
+        self.file_path = file_path
+        self.batches = row_group_batches(file_path, rows)
+        self._it = 0
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data):
+        if self._it == len(self.batches):
+            return 0
+        X, y, feature_names = load_matrix(self.file_path, rows=self.batches[self._it])
+        input_data(data=X, label=y, feature_names=feature_names)
+        self._it += 1
+        return 1
+
+    def reset(self):
+        self._it = 0
+
+
+def predict_batches(xgb_model, file_path, rows):
+    """ probabilities of the rows at `rows` and their labels, in the order of `row_group_batches` """
+    probabilities, labels = [], []
+    for batch in row_group_batches(file_path, rows):
+        X, y, _ = load_matrix(file_path, rows=batch)
+        probabilities.append(xgb_model.predict_proba(feature_frame(xgb_model, X))[:, 1])
+        labels.append(y)
+    return np.concatenate(probabilities), np.concatenate(labels)
+
+
+def train_model(file_path, params):
+    y = load_labels(file_path)
+    train_idx, test_idx = split(y)
+    params = balanced_params(params, y[train_idx])
+    # external memory needs the hist or approx tree method
+    params.setdefault("tree_method", "hist")
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=CACHE_DIR) as cache_dir:
+        dtrain = xgb.DMatrix(FeatureIter(file_path, train_idx, os.path.join(cache_dir, "train")))
+        dtest = xgb.DMatrix(FeatureIter(file_path, test_idx, os.path.join(cache_dir, "test")))
+
+        logger.info("run the xgb algoritm on {} with external memory".format(file_path))
+        booster = xgb.train(
+            params,
+            dtrain,
+            num_boost_round=500,
+            evals=[(dtrain, "train"), (dtest, "test")],
+            early_stopping_rounds=25,
+            verbose_eval=True,
+        )
+        # the matrices hold the cached pages open until they are freed
+        del dtrain, dtest
+    return as_classifier(booster), train_idx, test_idx
+
+
+def main(collection, params=params, compile=False):
+    started = time.perf_counter()
+    file_path = feature_store_path(collection)
+    xgb_model, train_idx, test_idx = train_model(file_path, params=params)
+    probabilities, y_test = predict_batches(xgb_model, file_path, test_idx)
+    log_results(y_test, (probabilities > 0.5).astype(np.int64))
+    log_resources(started)
+
+    save_split(train_idx, test_idx)
+    feature_names = load_schema(file_path)["features"]
+    save_manifest(manifest_from_probabilities(probabilities, y_test, collection, feature_names))
+    export_feature_plan(collection, feature_names)
+
+    export_model(xgb_model, compile=compile)
+
+    # saved last, serving reloads the manifest, feature plan and exported models when the model changes
+    save_model(xgb_model, MODEL_PATH)
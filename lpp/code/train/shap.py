@@ -4,11 +4,12 @@ import argparse
 import xgboost as xgb
 import pandas as pd
 
+from utils.feature_store import load_features
+
 def get_shap_model(bst, data):
     explainer = shap.TreeExplainer(bst)
-    shap_values = explainer.shap_values(data)
     explanation = explainer(data)
-    return explainer, shap_values, explanation
+    return explainer, explanation.values, explanation
 
 def main():
     parser = argparse.ArgumentParser(description='export shap model to model/')
@@ -17,7 +18,7 @@ def main():
     args = parser.parse_args()
     model = xgb.XGBClassifier()
     model.load_model(args.model)
-    data = pd.read_pickle(args.data)
+    data = load_features(args.data)
     explainer, shap_values, explanation = get_shap_model(model, data)
     with open("model/shap_explainer-{}.pickle", "wb") as fp:
         pickle.dump(explainer, fp)
@@ -0,0 +1,171 @@
+"""
+Cross-validated hyperparameter search around the xgb `params`.
+
+Trials run in a process pool. Each worker gets `cores // workers` xgboost threads, so the pool never runs more
+threads than there are cores. The feature matrix is saved once as `.npy` and memory mapped by the workers instead
+of being pickled to each of them. Every trial is written to a leaderboard that `lpp train --tuned` reads the
+best params from.
+"""
+import os
+import sys
+import json
+import time
+import logging
+
+import numpy as np
+import xgboost as xgb
+
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from sklearn.model_selection import StratifiedKFold
+
+from train.xgb import params, balanced_params
+from utils.feature_store import load_matrix, training_data_path
+
+LEADERBOARD_PATH = "model/xgb_leaderboard.json"
+
+# samplers of the searched params, the other params are the ones of `train.xgb`
+SEARCH_SPACE = {
+    "max_depth": lambda rng: int(rng.integers(3, 17)),
+    "gamma": lambda rng: float(rng.uniform(0, 5)),
+    "alpha": lambda rng: float(10 ** rng.uniform(-1, 1.5)),
+    "lambda": lambda rng: float(10 ** rng.uniform(-1, 1)),
+    "learning_rate": lambda rng: float(10 ** rng.uniform(-2.3, -0.7)),
+    "subsample": lambda rng: float(rng.uniform(0.5, 1)),
+    "colsample_bytree": lambda rng: float(rng.uniform(0.3, 1)),
+    "min_child_weight": lambda rng: float(10 ** rng.uniform(0, 1.5)),
+}
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(asctime)s %(levelname)-8s:%(name)s:  %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger("xgb tune")
+
+
+def sample_params(rng):
+    return {name: sample(rng) for name, sample in SEARCH_SPACE.items()}
+
+
+def share_matrix(X, y, collection):
+    """ saves the matrix and labels as `.npy` files the workers memory map, returns their paths """
+    paths = ("model/tune_X_{}.npy".format(collection), "model/tune_y_{}.npy".format(collection))
+    np.save(paths[0], X)
+    np.save(paths[1], y)
+    return paths
+
+
+def run_trial(trial, trial_params, num_boost_round, folds, paths, feature_names, nthread):
+    """ mean and std over `folds` of the best test aucpr of `trial_params`, in a worker """
+    X = np.load(paths[0], mmap_mode="r")
+    y = np.load(paths[1], mmap_mode="r")
+    started = time.perf_counter()
+    scores, iterations = [], []
+    for train_idx, test_idx in folds:
+        fold_params = balanced_params(dict(params, **trial_params, nthread=nthread), y[train_idx])
+        dtrain = xgb.DMatrix(X[train_idx], label=y[train_idx], feature_names=feature_names, nthread=nthread)
+        dtest = xgb.DMatrix(X[test_idx], label=y[test_idx], feature_names=feature_names, nthread=nthread)
+        booster = xgb.train(fold_params, dtrain, num_boost_round=num_boost_round, evals=[(dtest, "test")],
+                            early_stopping_rounds=25, verbose_eval=False)
+        scores.append(booster.best_score)
+        iterations.append(booster.best_iteration)
+    return {
+        "trial": trial,
+        "params": trial_params,
+        "num_boost_round": num_boost_round,
+        "score": float(np.mean(scores)),
+        "score_std": float(np.std(scores)),
+        "best_iteration": int(np.max(iterations)),
+        "seconds": time.perf_counter() - started,
+    }
+
+
+class TrialPool(object):
+    """ runs trials on the shared matrix in `jobs` processes, each with its share of the cores """
+
+    def __init__(self, executor, jobs, folds, paths, feature_names):
+        self.executor = executor
+        self.nthread = max(1, (os.cpu_count() or 1) // jobs)
+        self.folds = folds
+        self.paths = paths
+        self.feature_names = feature_names
+        self.nr_trials = 0
+
+    def __call__(self, candidates, num_boost_round):
+        trials = range(self.nr_trials, self.nr_trials + len(candidates))
+        self.nr_trials += len(candidates)
+        results = list(self.executor.map(run_trial, trials, candidates, repeat(num_boost_round), repeat(self.folds),
+                                         repeat(self.paths), repeat(self.feature_names), repeat(self.nthread)))
+        for result in results:
+            logger.info("trial {trial}: aucpr {score:.4f} +- {score_std:.4f} with {num_boost_round} rounds in {seconds:.1f}s".format(**result))
+        return results
+
+
+def random_search(candidates, run, max_rounds):
+    return run(candidates, max_rounds)
+
+
+def successive_halving(candidates, run, min_rounds, max_rounds, eta=3):
+    """
+    Runs all candidates with `min_rounds` boosting rounds, then the best `1 / eta` of them with `eta` times as many
+    rounds, until `max_rounds` or one candidate is left. Returns the results of every rung.
+    """
+    results = []
+    rounds = min_rounds
+    while True:
+        rung = run(candidates, rounds)
+        results.extend(rung)
+        if rounds >= max_rounds or len(candidates) <= 1:
+            return results
+        rung.sort(key=lambda result: result["score"], reverse=True)
+        candidates = [result["params"] for result in rung[:max(1, len(candidates) // eta)]]
+        rounds = min(rounds * eta, max_rounds)
+
+
+def leaderboard(results, collection, method):
+    """ the trials, the ones with the most boosting rounds first and best first among those """
+    ranked = sorted(results, key=lambda result: (result["num_boost_round"], result["score"]), reverse=True)
+    return {
+        "collection": collection,
+        "created_on": datetime.now().isoformat(),
+        "method": method,
+        "best_params": ranked[0]["params"],
+        "trials": ranked,
+    }
+
+
+def save_leaderboard(board, file_path=LEADERBOARD_PATH):
+    with open(file_path, "w") as fp:
+        json.dump(board, fp, indent=2)
+    logger.info("Saved {} trials to {}, best aucpr: {:.4f}".format(len(board["trials"]), file_path, board["trials"][0]["score"]))
+
+
+def load_best_params(file_path=LEADERBOARD_PATH):
+    """ the train params with the best params of the leaderboard at `file_path` """
+    with open(file_path, "r") as fp:
+        return dict(params, **json.load(fp)["best_params"])
+
+
+def main(collection, method="halving", nr_trials=27, jobs=None, cv=3, min_rounds=50, max_rounds=500, seed=None):
+    started = time.perf_counter()
+    X, y, feature_names = load_matrix(training_data_path(collection))
+    paths = share_matrix(X, y, collection)
+    del X
+
+    rng = np.random.default_rng(seed)
+    candidates = [sample_params(rng) for _ in range(nr_trials)]
+    folds = list(StratifiedKFold(n_splits=cv, shuffle=True, random_state=seed).split(np.zeros(len(y)), y))
+    jobs = min(jobs or os.cpu_count() or 1, nr_trials)
+    logger.info("Searching {} candidates with {} in {} processes".format(nr_trials, method, jobs))
+
+    try:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            run = TrialPool(executor, jobs, folds, paths, feature_names)
+            if method == "halving":
+                results = successive_halving(candidates, run, min_rounds, max_rounds)
+            else:
+                results = random_search(candidates, run, max_rounds)
+    finally:
+        for path in paths:
+            os.remove(path)
+
+    save_leaderboard(leaderboard(results, collection, method))
+    logger.info("Searched in {:.1f}s".format(time.perf_counter() - started))
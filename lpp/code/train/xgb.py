@@ -1,18 +1,32 @@
 """Trains an xgb model and saves to model"""
 import pandas as pd
 import numpy as np
-import argparse, pickle
+import argparse, pickle, json
 import logging
+import resource
 import sys
+import time
 import xgboost as xgb
 
+from datetime import datetime
 from sklearn.metrics import precision_recall_curve, confusion_matrix, auc
 from sklearn.model_selection import StratifiedShuffleSplit
 
+from setup.feature_plan import export_feature_plan
+from train.export import export_model
+from utils.feature_store import load_matrix, training_data_path
+
+MODEL_PATH = "model/xgb_model.pickle"
+MANIFEST_PATH = "model/xgb_manifest.json"
+
 def save_model(obj, file_path):
     with open(file_path, 'wb') as fp:
         pickle.dump(obj, fp)
 
+def load_manifest(file_path=MANIFEST_PATH):
+    with open(file_path, 'r') as fp:
+        return json.load(fp)
+
 logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(asctime)s %(levelname)-8s:%(name)s:  %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
 logger = logging.getLogger("xgb train")
 
@@ -49,60 +63,138 @@ def get_prediction_classes(xgb_model, X_test, y_test):
     return  true_negatives, false_positives, false_negatives, true_positives
 
 
-def train_model(data, params):
-    sss_train_test = StratifiedShuffleSplit(n_splits=1, test_size=0.2)
-    sss_train_test.get_n_splits(data.iloc[:,1:], data.iloc[:,0])
-    train_idx, test_idx = next(sss_train_test.split(data.iloc[:,1:], data.iloc[:,0]))
+def feature_frame(xgb_model, X):
+    """ a frame over a matrix of `load_matrix` without copying it, named like the features the booster checks """
+    return pd.DataFrame(X, columns=xgb_model.get_booster().feature_names, copy=False)
 
-    X_train = data.iloc[train_idx,1:].copy()
-    y_train = data.iloc[train_idx,0].copy()
 
+def create_manifest(xgb_model, X_test, y_test, collection):
+    """ everything serving needs to know about a model besides the model itself """
+    if isinstance(X_test, np.ndarray):
+        X_test = feature_frame(xgb_model, X_test)
+    probabilities = xgb_model.predict_proba(X_test)[:, 1]
+    return manifest_from_probabilities(probabilities, y_test, collection, xgb_model.get_booster().feature_names)
 
-    X_test = data.iloc[test_idx,1:].copy()
-    y_test = data.iloc[test_idx,0].copy()
 
+def manifest_from_probabilities(probabilities, y_test, collection, feature_names):
+    precision, recall, thresholds = precision_recall_curve(y_test, probabilities)
+    f1_scores = 2*recall*precision/(recall+precision)
+    best = np.argmax(f1_scores)
+    return {
+        "collection": collection,
+        "created_on": datetime.now().isoformat(),
+        "threshold": float(thresholds[best]),
+        "f1_score": float(f1_scores[best]),
+        "precision": precision.tolist(),
+        "recall": recall.tolist(),
+        "thresholds": thresholds.tolist(),
+        "feature_names": feature_names,
+    }
 
-    n = sum(y_train+1 % 2)
-    p = sum(y_train)
-    logger.info("class balance: {}".format(p/n))
 
-    n = sum(y_train+1 % 2)
-    p = sum(y_train)
-    params["scale_pos_weight"] = n / p
+def save_manifest(manifest, file_path=MANIFEST_PATH):
+    with open(file_path, 'w') as fp:
+        json.dump(manifest, fp)
+    logger.info("Saved model manifest to {}, threshold: {}".format(file_path, manifest["threshold"]))
 
-    logger.info("run the xgb algoritm")
-    watchlist = [ (X_train, y_train), (X_test, y_test)]
 
-    xgb_model = xgb.XGBClassifier(
-        **params,
-        num_boost_round=500, 
-        early_stopping_rounds=25,
-        verbosity=1,
-    )
-    
-    xgb_model.fit(
-        X_train, 
-        y_train,
-        verbose=True,
-        eval_set=watchlist,
-        eval_metric="aucpr"
-    )
+def as_classifier(booster):
+    """ the `XGBClassifier` serving, shap and the manifest use, around a booster trained with `xgb.train` """
+    booster.set_attr(scikit_learn=json.dumps({"_estimator_type": "classifier", "n_classes_": 2, "classes_": [0, 1]}))
+    xgb_model = xgb.XGBClassifier()
+    xgb_model.load_model(booster.save_raw("json"))
+    return xgb_model
+
+
+def make_dmatrices(X, y, feature_names, train_idx, test_idx, params):
+    """
+    The train and test `DMatrix` of the float32 matrix of `load_matrix`, which xgboost reads as is, unlike a frame.
+    With the hist tree method they are `QuantileDMatrix`es, which only hold the binned features.
+    """
+    if params.get("tree_method") in ("hist", "gpu_hist"):
+        dtrain = xgb.QuantileDMatrix(X[train_idx], label=y[train_idx], feature_names=feature_names)
+        return dtrain, xgb.QuantileDMatrix(X[test_idx], label=y[test_idx], feature_names=feature_names, ref=dtrain)
+    return (xgb.DMatrix(X[train_idx], label=y[train_idx], feature_names=feature_names),
+            xgb.DMatrix(X[test_idx], label=y[test_idx], feature_names=feature_names))
 
-    lr_probs = xgb_model.predict_proba(X_test)    
-    lr_probs = lr_probs[:, 1]
 
-    y_pred = xgb_model.predict(X_test)
+def split(y):
+    """ positions of the stratified train and test split, only the labels are needed """
+    sss_train_test = StratifiedShuffleSplit(n_splits=1, test_size=0.2)
+    return next(sss_train_test.split(np.zeros(len(y)), y))
+
+
+def balanced_params(params, y_train):
+    """ `params` with `scale_pos_weight` set to the number of negatives over the number of positives """
+    n = np.sum(y_train == 0, dtype=np.int64)
+    p = np.sum(y_train == 1, dtype=np.int64)
+    logger.info("class balance: {}".format(p/n))
+    return dict(params, scale_pos_weight=n / p)
+
+
+def log_results(y_test, y_pred):
     precision, recall, _ = precision_recall_curve(y_test, y_pred)
     area = auc(recall, precision)
     tn, fp, fn, tp = confusion_matrix(y_test,y_pred).ravel()
     logger.info('------------ Results for XGBClassifier ---------------')
     logger.info(f'cm: TN: {tn} FP: {fp} FN: {fn} TP: {tp}')
     logger.info(f"Area Under P-R Curve: {area}")
+
+
+def log_resources(started):
+    """ wall time since `started`, a `time.perf_counter`, and the peak resident memory of the process so far """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    logger.info("Trained in {:.1f}s, peak RSS {:.0f} MiB".format(time.perf_counter() - started, peak))
+
+
+def save_split(train_idx, test_idx):
+    save_model(train_idx, "model/train_idx.pickle")
+    save_model(test_idx, "model/test_idx.pickle")
+
+
+def train_model(X, y, feature_names, params):
+    train_idx, test_idx = split(y)
+    y_test = y[test_idx]
+    params = balanced_params(params, y[train_idx])
+
+    dtrain, dtest = make_dmatrices(X, y, feature_names, train_idx, test_idx, params)
+
+    logger.info("run the xgb algoritm")
+    booster = xgb.train(
+        params,
+        dtrain,
+        num_boost_round=500,
+        evals=[(dtrain, "train"), (dtest, "test")],
+        early_stopping_rounds=25,
+        verbose_eval=True,
+    )
+    xgb_model = as_classifier(booster)
+
+    log_results(y_test, xgb_model.predict(feature_frame(xgb_model, X[test_idx])))
     return xgb_model, train_idx, test_idx
 
 
-def main(collection):
-    data = pd.read_pickle("model/df_post_scaling-{}.pickle".format(collection))
-    xgb_model, _, test_idx  = train_model(data, params=params)
-    save_model(xgb_model, "model/xgb_model.pickle")
-    save_model(test_idx, "model/test_idx.pickle")
\ No newline at end of file
+def write_manifest(collection):
+    """ writes the manifest of an already trained model, for models trained before manifests existed """
+    with open("model/test_idx.pickle", "rb") as fp:
+        test_idx = pickle.load(fp)
+    with open(MODEL_PATH, "rb") as fp:
+        xgb_model = pickle.load(fp)
+    # only the row groups holding the test split are read
+    X_test, y_test, _ = load_matrix(training_data_path(collection), rows=test_idx)
+    save_manifest(create_manifest(xgb_model, X_test, y_test, collection))
+
+
+def main(collection, params=params, compile=False):
+    started = time.perf_counter()
+    X, y, feature_names = load_matrix(training_data_path(collection))
+    xgb_model, train_idx, test_idx  = train_model(X, y, feature_names, params=params)
+    log_resources(started)
+    save_split(train_idx, test_idx)
+    save_manifest(create_manifest(xgb_model, X[test_idx], y[test_idx], collection))
+    export_feature_plan(collection, xgb_model.get_booster().feature_names)
+    
+    export_model(xgb_model, compile=compile)
+
+    # saved last, serving reloads the manifest, feature plan and exported models when the model changes
+    save_model(xgb_model, MODEL_PATH)
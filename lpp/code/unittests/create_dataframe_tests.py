@@ -0,0 +1,145 @@
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from datetime import datetime
+
+from setup.create_dataframe import CreateDataframe, ENDPOINT_STATS_REGEXES, one_hot
+from unittests.fixtures import make_corpus, flatten_document
+
+
+def make_documents():
+    first = datetime(2021, 3, 1, 12, 0, 0, 250000)
+    return [
+        {"name": "a.example.com", "tickets": [], "alerts": [
+            {"sha": "late", "date": datetime(2021, 3, 2), "name": "x"},
+            {"sha": "first", "date": first, "name": "y"},
+        ]},
+        {"name": "b.example.com", "tickets": [{"name": "", "tickets": [
+            {"id": "INC2", "date": datetime(2021, 3, 5), "severity": "2"},
+            {"id": "INC1", "date": datetime(2021, 3, 4), "severity": "1"},
+        ]}], "alerts": [
+            {"sha": "string", "date": first.strftime('%Y-%m-%dT%H:%M:%S.%f'), "name": "x"},
+            {"sha": "epoch", "date": str(int(datetime(2021, 3, 3).timestamp())) + "00", "name": "y"},
+        ]},
+        {"name": "c.example.com", "tickets": [], "alerts": [
+            {"sha": "tie 1", "date": first, "name": "x"},
+            {"sha": "tie 2", "date": first, "name": "y"},
+        ]},
+        {"name": "d.example.com", "tickets": [], "alerts": []},
+    ]
+
+
+class TestCreateDataframe(unittest.TestCase):
+
+    def test_first_alerts_and_tickets(self):
+        creator = CreateDataframe(make_documents(), "fixture_dataframe")
+        creator.create_tickets_columns()
+        creator.create_alerts_columns()
+        df = creator.df.set_index("name")
+
+        self.assertEqual(df["alert_first_sha"].tolist(), ["first", "string", "tie 1", ""])
+        self.assertEqual(df.loc["b.example.com", "alert_first_date"], pd.Timestamp(2021, 3, 1, 12, 0, 0, 250000))
+        self.assertTrue(pd.isna(df.loc["d.example.com", "alert_first_date"]))
+        self.assertEqual(df["ticket_label"].tolist(), [0, 1, 0, 0])
+        self.assertEqual(df.loc["b.example.com", ["ticket_first_id", "ticket_first_severity"]].tolist(), ["INC1", "1"])
+        self.assertEqual(df["ticket_first_date"].dtype, "datetime64[ns]")
+        self.assertNotIn("alerts", df.columns)
+        self.assertNotIn("tickets", df.columns)
+
+    def test_sparse_dummies_match_get_dummies(self):
+        df = pd.DataFrame({
+            "tld": ["com", "net", np.nan, "com", "org"],
+            "vt.domain.data.attributes.registrar": ["a", "b", "a", np.nan, "c"],
+            "vt.domain.data.attributes.reputation": [0.0, 1.0, 2.0, 3.0, 4.0],
+            "vt.urls.data.0.attributes.title": ["x", "y", "x", "y", np.nan],
+        })
+        expected = pd.get_dummies(df.select_dtypes("object"))
+        creator = CreateDataframe([], "fixture_dataframe")
+        creator.df = df.copy()
+        creator.get_dummies()
+
+        self.assertEqual([col for col in creator.df.columns if col.startswith("vt.urls")], ["vt.urls.data.0.attributes.title_x", "vt.urls.data.0.attributes.title_y"])
+        for prefix in ["tld", "domain_registrar"]:
+            vocabulary = [name for names, _ in creator.encodings[prefix] for name in names]
+            X = one_hot(creator.encodings[prefix], vocabulary, len(df))
+            np.testing.assert_array_equal(X.toarray(), expected[vocabulary].values)
+        # dummies the vocabulary does not know are left out
+        X = one_hot(creator.encodings["tld"], ["tld_org", "tld_com"], len(df))
+        np.testing.assert_array_equal(X.toarray(), expected[["tld_org", "tld_com"]].values)
+
+
+def reference_calc_stats_on_columns(df, regex):
+    """ `calc_stats_on_columns` as it was before the stats were computed in one grouped reduction """
+    col_name = "vt_stats.{endpoint}.{attribute}.{statistic}"
+    matching_columns = [col for col in df.columns if re.match(regex, col)]
+    meta_data = list(set([(re.match(regex, col).group(1), re.match(regex, col).group(2)) for col in matching_columns]))
+    for endpoint, attribute in meta_data:
+        end_point_attr_columns = [col for col in df.columns if re.match(".*?vt.{0}".format(endpoint), col) and col.endswith(attribute)]
+        df_subset = df[end_point_attr_columns].T.copy(deep=True)
+        df.loc[:,col_name.format(endpoint=endpoint, attribute=attribute, statistic="count")] = df_subset.count()
+        df.loc[:,col_name.format(endpoint=endpoint, attribute=attribute, statistic="mean")] = df_subset.mean()
+        df.loc[:,col_name.format(endpoint=endpoint, attribute=attribute, statistic="std")] = df_subset.std()
+    df.drop(columns=matching_columns, inplace=True)
+    return df
+
+
+class TestEndpointStatistics(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cwd = os.getcwd()
+        cls.workdir = tempfile.mkdtemp()
+        os.chdir(cls.workdir)
+        os.mkdir("model")
+        creator = CreateDataframe([flatten_document(doc) for doc in make_corpus(300, seed=8)], "fixture_dataframe", n_components=3)
+        for step in ["drop_nas", "make_time_objects", "create_tickets_columns", "create_alerts_columns", "drop_cols_no_variance",
+                     "rename_index", "get_dummies", "create_time_diff", "keep_processed", "make_time_unitless", "compress_data"]:
+            getattr(creator, step)()
+        cls.creator = creator
+
+    @classmethod
+    def tearDownClass(cls):
+        os.chdir(cls.cwd)
+        shutil.rmtree(cls.workdir)
+
+    def test_matches_reference(self):
+        expected = self.creator.df.copy()
+        for regex in ENDPOINT_STATS_REGEXES:
+            expected = reference_calc_stats_on_columns(expected, regex)
+        creator = CreateDataframe([], "fixture_dataframe")
+        creator.df = self.creator.df.copy()
+        creator.calculate_endpoint_statistics()
+
+        self.assertTrue(any(col.startswith("vt_stats.") for col in expected.columns))
+        pd.testing.assert_frame_equal(expected.sort_index(axis=1), creator.df.sort_index(axis=1))
+
+
+class TestParallelDataframe(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.workdir = tempfile.mkdtemp()
+        os.chdir(self.workdir)
+        os.mkdir("model")
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.workdir)
+
+    def test_matches_serial(self):
+        corpus = [flatten_document(doc) for doc in make_corpus(300, seed=11)]
+        serial = CreateDataframe(corpus, "fixture_dataframe", n_components=3)
+        serial.create_dataframe()
+        parallel = CreateDataframe(corpus, "fixture_dataframe", n_components=3)
+        parallel.create_dataframe_parallel(jobs=2)
+        pd.testing.assert_frame_equal(serial.df, parallel.df)
+
+
+if __name__ == '__main__':
+    unittest.main()
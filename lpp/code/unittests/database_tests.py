@@ -22,5 +22,22 @@ class TestDatabase(unittest.TestCase):
         nr_hosts_array_not_array = self.database.db[ALERTS_TESTS].find({"hosts_array": {"$not": {"$type" : "array"}}}).count()
         self.assertEqual(nr_hosts_array_not_array, 0, msg="Some alerts have hosts_array that aren't arrays")
 
+    def test_server_side_hosts_array_matches_python(self):
+        self.database.create_hosts_array(collection=ALERTS_TESTS, server_side=False)
+        expected = {doc["sha"]: doc["hosts_array"] for doc in self.database.db[ALERTS_TESTS].find({}, {"sha": 1, "hosts_array": 1})}
+        self.database.db[ALERTS_TESTS].update_many({}, {"$unset": {"hosts_array": ""}})
+        self.database.create_hosts_array(collection=ALERTS_TESTS, server_side=True)
+        actual = {doc["sha"]: doc["hosts_array"] for doc in self.database.db[ALERTS_TESTS].find({}, {"sha": 1, "hosts_array": 1})}
+        self.assertEqual(expected, actual)
+
+    def test_server_side_alert_date_matches_python(self):
+        self.database.db[ALERTS_TESTS].update_many({}, {"$unset": {"date": ""}})
+        self.database.update_timestamps_alerts(collection=ALERTS_TESTS, server_side=False)
+        expected = {doc["sha"]: doc["date"] for doc in self.database.db[ALERTS_TESTS].find({}, {"sha": 1, "date": 1})}
+        self.database.db[ALERTS_TESTS].update_many({}, {"$unset": {"date": ""}})
+        self.database.update_timestamps_alerts(collection=ALERTS_TESTS, server_side=True)
+        actual = {doc["sha"]: doc["date"] for doc in self.database.db[ALERTS_TESTS].find({}, {"sha": 1, "date": 1})}
+        self.assertEqual(expected, actual)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,44 @@
+import unittest
+
+import numpy as np
+
+from predict.domain_predicter import DomainPredicter
+
+FEATURES = ["reputation", "svd_tld_0"]
+
+
+class FakeExplainer(object):
+
+    def shap_values(self, X):
+        return np.zeros(X.shape)
+
+
+def make_predicter():
+    """ a `DomainPredicter` with its artifacts in place, predicting 0.25 for every domain """
+    predicter = DomainPredicter.__new__(DomainPredicter)
+    predicter._load_artifacts = lambda: None
+    predicter.manifest = {"feature_names": FEATURES}
+    predicter.threshold = 0.5
+    predicter.error_margin = 0.2
+    predicter.predict = lambda X: np.full(len(X), 0.25)
+    predicter.explainer = FakeExplainer()
+    return predicter
+
+
+class TestGetPredictions(unittest.TestCase):
+
+    def test_stale_cached_input_fails_only_its_domain(self):
+        current = {"reputation": {"a.example.com": 0.5}, "svd_tld_0": {"a.example.com": 0.1}, "extra": {"a.example.com": 1.0}}
+        # cached before a retrain that added `svd_tld_0`
+        stale = {"reputation": {"b.example.com": 0.5}}
+        results = make_predicter().get_predictions([stale, current, stale])
+
+        self.assertIsInstance(results[0], KeyError)
+        self.assertIsInstance(results[2], KeyError)
+        self.assertEqual(results[1]["name"], "a.example.com")
+        self.assertEqual(results[1]["verdict"], "Benign")
+        self.assertEqual(list(results[1]["x_domain"]), FEATURES)
+
+
+if __name__ == '__main__':
+    unittest.main()
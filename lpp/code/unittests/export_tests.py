@@ -0,0 +1,24 @@
+import unittest
+
+import numpy as np
+import xgboost as xgb
+
+from train.export import compile_forest
+
+
+class TestCompiledForest(unittest.TestCase):
+
+    def test_matches_inplace_predict(self):
+        rng = np.random.default_rng(5)
+        X = rng.random((2000, 6)).astype(np.float32)
+        X[rng.random(X.shape) < 0.1] = np.nan
+        y = (np.nan_to_num(X[:, 0]) + np.nan_to_num(X[:, 3]) > 1).astype(np.uint8)
+        booster = xgb.train({"objective": "binary:logistic", "max_depth": 5, "base_score": 0.3}, xgb.DMatrix(X, label=y), num_boost_round=20)
+
+        forest = compile_forest(booster)
+        np.testing.assert_allclose(forest.predict(X), booster.inplace_predict(X), rtol=1e-5, atol=1e-6)
+        np.testing.assert_allclose(forest.predict(X[:1]), booster.inplace_predict(X[:1]), rtol=1e-5, atol=1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
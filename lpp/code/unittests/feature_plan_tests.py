@@ -0,0 +1,77 @@
+import os
+import copy
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from setup.create_dataframe import CreateDataframe
+from setup.feature_plan import compile_feature_plan, flatten_document
+from unittests.fixtures import make_corpus, flatten_document as flatten_arrays
+
+from pandas import json_normalize
+
+COLLECTION = "fixture_dataframe"
+N_COMPONENTS = 3
+
+
+class TestFeaturePlan(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cwd = os.getcwd()
+        cls.workdir = tempfile.mkdtemp()
+        os.chdir(cls.workdir)
+        os.mkdir("model")
+        cls.docs = [flatten_arrays(doc) for doc in make_corpus(300)]
+        creator = CreateDataframe(copy.deepcopy(cls.docs), COLLECTION, n_components=N_COMPONENTS)
+        creator.create_dataframe()
+        cls.frame = creator.df
+        cls.feature_names = list(creator.df.columns[1:])
+        cls.plan = compile_feature_plan(COLLECTION, cls.feature_names)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.chdir(cls.cwd)
+        shutil.rmtree(cls.workdir)
+
+    def create_row(self, doc):
+        creator = CreateDataframe(copy.deepcopy(doc), COLLECTION, load_model=True, n_components=N_COMPONENTS)
+        creator.create_row()
+        return creator.df[self.feature_names].iloc[[-1]]
+
+    def test_flatten_document_matches_json_normalize(self):
+        doc = flatten_arrays(make_corpus(1, seed=3)[0])
+        self.assertEqual(list(json_normalize(doc).columns), list(flatten_document(doc)))
+
+    def test_bit_for_bit_with_create_row(self):
+        for doc in make_corpus(25, seed=42):
+            doc = flatten_arrays(doc)
+            expected = self.create_row(doc)
+            actual = self.plan.transform(doc)
+            np.testing.assert_array_equal(expected.values[0], actual, err_msg=doc["name"])
+            self.assertEqual(actual.dtype, np.float32)
+
+    def test_matches_training_frame(self):
+        docs = [doc for doc in self.docs if doc["name"] in self.frame.index][:40]
+        for doc in docs:
+            expected = self.frame.loc[doc["name"], self.feature_names].values
+            np.testing.assert_array_equal(expected, self.plan.transform(copy.deepcopy(doc)), err_msg=doc["name"])
+            np.testing.assert_array_equal(expected, self.create_row(doc).values[0], err_msg=doc["name"])
+
+    def test_transform_frame_is_indexed_by_name(self):
+        doc = flatten_arrays(make_corpus(1, seed=5)[0])
+        frame = self.plan.transform_frame(doc)
+        self.assertEqual(frame.index[0], doc["name"])
+        self.assertEqual(list(frame.columns), self.feature_names)
+
+    def test_domain_without_alerts(self):
+        doc = flatten_arrays(make_corpus(1, seed=5)[0])
+        doc["alerts"] = []
+        with self.assertRaises(ValueError):
+            self.plan.transform(doc)
+
+
+if __name__ == '__main__':
+    unittest.main()
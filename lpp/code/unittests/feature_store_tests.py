@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from utils.feature_store import save_features, load_features, load_matrix, load_schema, load_labels, row_group_batches, feature_columns, upsert_features
+
+
+def make_frame(nr_rows=2500):
+    rng = np.random.default_rng(3)
+    df = pd.DataFrame(rng.random((nr_rows, 4)), columns=["svd_alerts_0", "svd_alerts_1", "reputation", "tld_com"])
+    df.insert(0, "ticket_label", rng.integers(0, 2, nr_rows).astype(float))
+    df.index = pd.Index(["host{}.example.com".format(i) for i in range(nr_rows)], name="name")
+    return df
+
+
+class TestFeatureStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "features.parquet")
+        self.df = make_frame()
+        save_features(self.df, self.path, row_group_size=300)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_round_trip(self):
+        pd.testing.assert_frame_equal(self.df, load_features(self.path))
+        self.assertEqual(feature_columns(self.path), list(self.df.columns))
+
+    def test_rows_and_columns(self):
+        rows = np.random.default_rng(5).permutation(len(self.df))[:200]
+        columns = ["ticket_label", "reputation"]
+        pd.testing.assert_frame_equal(self.df.iloc[rows][columns], load_features(self.path, columns=columns, rows=rows))
+
+    def test_load_matrix(self):
+        rows = np.random.default_rng(7).permutation(len(self.df))[:300]
+        X, y, feature_names = load_matrix(self.path, rows=rows)
+        self.assertEqual(feature_names, load_schema(self.path)["features"])
+        self.assertTrue(X.flags.c_contiguous)
+        self.assertEqual(X.dtype, np.float32)
+        np.testing.assert_array_equal(X, self.df.iloc[rows, 1:].to_numpy(dtype=np.float32))
+        np.testing.assert_array_equal(y, self.df["ticket_label"].iloc[rows].to_numpy())
+
+    def test_row_group_batches(self):
+        rows = np.random.default_rng(11).permutation(len(self.df))[:700]
+        batches = row_group_batches(self.path, rows)
+        self.assertTrue(all(batch[0] // 300 == batch[-1] // 300 for batch in batches))
+        np.testing.assert_array_equal(np.concatenate(batches), np.sort(rows))
+        np.testing.assert_array_equal(load_labels(self.path), self.df["ticket_label"].to_numpy())
+
+    def test_upsert(self):
+        changed = self.df.iloc[[3, 10, 2000]].copy()
+        changed["reputation"] = -1.0
+        removed = self.df.index[[5, 10]]
+        new_row = make_frame(1).rename(index={"host0.example.com": "new.example.com"})
+        upsert_features(pd.concat([changed.drop(index=self.df.index[3]), new_row]), self.path,
+                        replaced=changed.index, keep=self.df.index.drop(removed).append(new_row.index))
+        stored = load_features(self.path)
+        self.assertEqual(len(stored), len(self.df) - 3 + 1)
+        self.assertNotIn(self.df.index[3], stored.index)
+        self.assertNotIn(self.df.index[5], stored.index)
+        self.assertEqual(stored.loc[self.df.index[2000], "reputation"], -1.0)
+        self.assertEqual(stored.loc["new.example.com", "ticket_label"], new_row["ticket_label"].iloc[0])
+        pd.testing.assert_series_equal(stored.dtypes, self.df.dtypes)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+"""Synthetic VirusTotal domain documents shaped like the `*_dataframe` collections"""
+import copy
+import random
+
+from datetime import datetime, timedelta
+
+from utils.database import flatten_array_data
+from utils.queries import API_ENDPOINTS
+
+TLDS = ["com", "net", "org", "ru", "xyz", "co.uk"]
+REGISTRARS = ["GoDaddy.com, LLC", "NameCheap, Inc.", "Tucows Domains Inc.", "REG.RU LLC", "Key-Systems GmbH"]
+CATEGORIES = ["malware", "phishing", "business", "parked", "information technology"]
+CONTENT_TYPES = ["text/html", "text/plain", "application/json", "application/octet-stream", "image/png"]
+COPYRIGHTS = ["Microsoft Corporation", "Oracle", "(c) 2019", "Mozilla"]
+MAX_ENTRIES = 10
+
+EPOCH_2019 = 1546300800
+
+
+def _epoch(rng, start=EPOCH_2019, spread=3 * 365 * 24 * 3600):
+    return start + rng.randrange(spread)
+
+
+def _analysis_stats(rng):
+    return {
+        "harmless": rng.randrange(70),
+        "malicious": rng.randrange(10),
+        "suspicious": rng.randrange(3),
+        "undetected": rng.randrange(20),
+        "timeout": 0
+    }
+
+
+def _maybe(rng, value, probability=0.9):
+    return value if rng.random() < probability else None
+
+
+def _entries(rng, make_entry):
+    return [{"attributes": make_entry()} for _ in range(rng.randrange(MAX_ENTRIES))]
+
+
+def _drop_none(attributes):
+    return {key: val for key, val in attributes.items() if val is not None}
+
+
+def make_vt(rng):
+    """ a `vt` subdocument projected like `pipeline_domains_dataframe` """
+    return {
+        "domain": {"data": {"attributes": _drop_none({
+            "creation_date": _maybe(rng, _epoch(rng, start=EPOCH_2019 - 10 * 365 * 24 * 3600)),
+            "last_dns_records_date": _epoch(rng),
+            "last_modification_date": _epoch(rng),
+            "last_analysis_stats": _analysis_stats(rng),
+            "categories": {
+                "Forcepoint ThreatSeeker": rng.choice(CATEGORIES),
+                "BitDefender": rng.choice(CATEGORIES),
+            },
+            "registrar": _maybe(rng, rng.choice(REGISTRARS)),
+            "reputation": rng.randrange(-50, 10),
+        })}},
+        "communicating_files": {"data": _entries(rng, lambda: _drop_none({
+            "creation_date": _maybe(rng, _epoch(rng)),
+            "first_submission_date": _epoch(rng),
+            "last_analysis_date": _epoch(rng),
+            "last_analysis_stats": _analysis_stats(rng),
+        }))},
+        "downloaded_files": {"data": _entries(rng, lambda: {
+            "last_submission_date": _epoch(rng),
+            "size": rng.randrange(1, 10 ** 7),
+            "reputation": rng.randrange(-20, 5),
+        })},
+        "historical_whois": {"data": _entries(rng, lambda: {
+            "first_seen_date": _epoch(rng),
+            "last_updated": _epoch(rng),
+            "registrar_name": rng.choice(REGISTRARS),
+            "whois_map": {"Creation Date": datetime.fromtimestamp(_epoch(rng)).strftime("%Y-%m-%d %H:%M:%S")},
+        })},
+        "referrer_files": {"data": _entries(rng, lambda: {
+            "last_submission_date": _epoch(rng),
+            "signature_info": {"copyright": rng.choice(COPYRIGHTS)},
+        })},
+        "resolutions": {"data": _entries(rng, lambda: {"date": _epoch(rng)})},
+        "siblings": {"data": _entries(rng, lambda: {"last_analysis_stats": _analysis_stats(rng)})},
+        "subdomains": {"data": _entries(rng, lambda: {
+            "creation_date": _epoch(rng),
+            "last_analysis_stats": _analysis_stats(rng),
+        })},
+        "urls": {"data": _entries(rng, lambda: {
+            "last_modification_date": _epoch(rng),
+            "last_analysis_stats": _analysis_stats(rng),
+            "last_http_response_headers": {"content-type": rng.choice(CONTENT_TYPES)},
+            "reputation": rng.randrange(-10, 10),
+        })},
+    }
+
+
+def make_alerts(rng, name):
+    alerts = []
+    for i in range(1 + rng.randrange(3)):
+        date = datetime(2021, 1, 1) + timedelta(seconds=rng.randrange(200 * 24 * 3600), microseconds=rng.randrange(10 ** 6))
+        alerts.append({
+            "sha": "{:064x}".format(rng.getrandbits(256)),
+            "date": date,
+            "name": "PROXY-D.PCK-{}: blacklisted hostname".format(i),
+            "customer": "1337"
+        })
+    return alerts
+
+
+def make_tickets(rng, alerts):
+    if rng.random() < 0.7:
+        return []
+    return [{"name": "", "tickets": [{
+        "id": "INC{:07d}".format(rng.randrange(10 ** 7)),
+        "date": alert["date"] + timedelta(hours=1),
+        "severity": rng.choice(["1", "2", "3"]),
+    } for alert in alerts]}]
+
+
+def make_domain_document(rng, i):
+    """ a domain document as found in the collections fed to `CreateDataframe` before array flattening """
+    tld = rng.choice(TLDS)
+    name = "host{}.example{}.{}".format(i, i % 13, tld)
+    alerts = make_alerts(rng, name)
+    return {
+        "alerts": alerts,
+        "tickets": make_tickets(rng, alerts),
+        "tld": tld,
+        "subdomain": "host{}".format(i),
+        "domain": "example{}.{}".format(i % 13, tld),
+        "name": name,
+        "vt": make_vt(rng),
+    }
+
+
+def make_corpus(nr_docs, seed=1337):
+    rng = random.Random(seed)
+    return [make_domain_document(rng, i) for i in range(nr_docs)]
+
+
+def flatten_document(doc):
+    """ flattens the relationship arrays like `lpp frame` and the predicter do """
+    doc = copy.deepcopy(doc)
+    for endpoint in API_ENDPOINTS:
+        flatten_array_data(doc, endpoint)
+    return doc
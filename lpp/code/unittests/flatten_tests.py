@@ -0,0 +1,52 @@
+import copy
+import unittest
+
+import pandas as pd
+
+from datetime import datetime
+from pandas import json_normalize
+
+from setup.flatten import stream_normalize, projected_paths
+from utils.pipelines import pipeline_domains_dataframe
+from unittests.fixtures import make_corpus, flatten_document
+
+
+def make_documents():
+    docs = [flatten_document(doc) for doc in make_corpus(120, seed=11)]
+    for i, doc in enumerate(docs):
+        doc["_id"] = i
+        attributes = doc["vt"]["domain"]["data"]["attributes"]
+        if i % 7 == 0:
+            attributes["reputation"] = None
+        if i % 11 == 0:
+            attributes["reputation"] = 0.5
+        if i % 13 == 0:
+            doc["ioc_first_date"] = datetime(2021, 1, 1 + i % 28)
+        if i > 100:
+            doc["not_projected"] = i
+    return docs
+
+
+class TestStreamNormalize(unittest.TestCase):
+
+    def test_equals_json_normalize(self):
+        docs = make_documents()
+        expected = json_normalize(copy.deepcopy(docs))
+        for chunk_size in [1, 16, 1000]:
+            actual = stream_normalize(copy.deepcopy(docs), chunk_size=chunk_size)
+            pd.testing.assert_frame_equal(expected, actual, check_exact=True)
+
+    def test_keeps_projected_paths(self):
+        docs = make_documents()
+        paths = projected_paths(pipeline_domains_dataframe({})[1]["$project"])
+        expected = json_normalize(copy.deepcopy(docs)).drop(columns="not_projected")
+        actual = stream_normalize(copy.deepcopy(docs), paths=paths, chunk_size=16)
+        pd.testing.assert_frame_equal(expected, actual, check_exact=True)
+
+    def test_single_document(self):
+        doc = make_documents()[1]
+        pd.testing.assert_frame_equal(json_normalize(copy.deepcopy(doc)), stream_normalize(copy.deepcopy(doc)))
+
+
+if __name__ == '__main__':
+    unittest.main()
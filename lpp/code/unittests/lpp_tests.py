@@ -0,0 +1,95 @@
+import os
+import copy
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from datetime import datetime, timedelta
+
+from lpp import update_frame, create_parser
+from setup.create_dataframe import CreateDataframe
+from setup.flatten import projected_paths
+from utils.feature_store import save_features, load_features
+from utils.pipelines import pipeline_domains_dataframe
+from unittests.fixtures import make_corpus, flatten_document
+
+COLLECTION = "fixture_dataframe"
+
+
+class FakeCollection(object):
+    """ the `find` queries of `update_frame` over a list of documents """
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def create_index(self, key):
+        pass
+
+    def _matches(self, doc, query):
+        for key, condition in query.items():
+            if "$gte" in condition and not doc[key] >= condition["$gte"]:
+                return False
+            if "$in" in condition and doc[key] not in condition["$in"]:
+                return False
+        return True
+
+    def find(self, query=None, projection=None, batch_size=None):
+        docs = [copy.deepcopy(doc) for doc in self.docs if self._matches(doc, query or {})]
+        if projection:
+            docs = [{key: doc[key] for key, include in projection.items() if include} for doc in docs]
+        return docs
+
+
+class FakeSetup(object):
+
+    def __init__(self, docs):
+        self.db = {COLLECTION: FakeCollection(docs)}
+
+
+class TestUpdateFrame(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.workdir = tempfile.mkdtemp()
+        os.chdir(self.workdir)
+        os.mkdir("model")
+        self.built = datetime(2021, 6, 1)
+        self.docs = [dict(flatten_document(doc), updated_at=self.built) for doc in make_corpus(300, seed=21)]
+        creator = CreateDataframe(copy.deepcopy(self.docs), COLLECTION, n_components=3,
+                                  paths=projected_paths(pipeline_domains_dataframe({})[1]["$project"]))
+        creator.create_dataframe()
+        self.full = creator.df
+        self.path = "model/features_{}.parquet".format(COLLECTION)
+        save_features(self.full, self.path)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.workdir)
+
+    def test_changed_rows_match_full_build(self):
+        changed = [doc["name"] for doc in self.docs if doc["name"] in self.full.index][:40]
+        for doc in self.docs:
+            if doc["name"] in changed:
+                doc["updated_at"] = self.built + timedelta(days=1)
+
+        update_frame(FakeSetup(self.docs), COLLECTION, self.path, self.built + timedelta(hours=1))
+        updated = load_features(self.path)
+
+        self.assertEqual(sorted(updated.index), sorted(self.full.index))
+        pd.testing.assert_frame_equal(self.full.loc[changed], updated.loc[changed])
+
+
+class TestParser(unittest.TestCase):
+
+    def test_frame_outfile_is_parquet(self):
+        args = create_parser().parse_args(["frame", "-c", COLLECTION, "-o", "model/features.parquet"])
+        self.assertEqual(args.outfile, "model/features.parquet")
+        with self.assertRaises(SystemExit):
+            create_parser().parse_args(["frame", "-c", COLLECTION, "-o", "model/features.pickle"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import os
+import unittest
+
+os.environ.setdefault("BROKER_URI", "memory://")
+os.environ.setdefault("BACKEND_URI", "cache+memory://")
+
+from predict.domain_predicter import DomainPredicter
+from predict.tasks import predict_batch
+
+
+def failing_predicter():
+    """ a `DomainPredicter` with its artifacts in place whose model fails on every batch """
+    predicter = DomainPredicter.__new__(DomainPredicter)
+    predicter._load_artifacts = lambda: None
+    predicter.manifest = {"feature_names": ["reputation"]}
+    predicter.threshold = 0.5
+
+    def predict(X):
+        raise ValueError("feature shape mismatch")
+    predicter.predict = predict
+    return predicter
+
+
+class TestPredictBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.model = predict_batch.model
+        predict_batch.model = failing_predicter()
+
+    def tearDown(self):
+        predict_batch.model = self.model
+
+    def test_batch_failure_fails_every_item(self):
+        items = [("task-{}".format(i), {"reputation": {"host{}.example.com".format(i): 0.5}}, None) for i in range(3)]
+        with self.assertRaises(ValueError):
+            predict_batch.run(items)
+        for task_id, _, _ in items:
+            self.assertEqual(predict_batch.AsyncResult(task_id).state, "FAILURE")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from train.tune import successive_halving, leaderboard, save_leaderboard, load_best_params, sample_params
+
+
+def fake_run(candidates, num_boost_round):
+    """ scores a candidate by its max_depth, more rounds score a bit better """
+    return [{"params": candidate, "num_boost_round": num_boost_round, "score": candidate["max_depth"] + num_boost_round / 1000}
+            for candidate in candidates]
+
+
+class TestTune(unittest.TestCase):
+
+    def test_successive_halving(self):
+        candidates = [{"max_depth": depth} for depth in range(9)]
+        results = successive_halving(candidates, fake_run, min_rounds=50, max_rounds=500, eta=3)
+
+        rungs = {}
+        for result in results:
+            rungs.setdefault(result["num_boost_round"], []).append(result["params"]["max_depth"])
+        self.assertEqual(sorted(rungs), [50, 150, 450])
+        self.assertEqual(sorted(rungs[150]), [6, 7, 8])
+        self.assertEqual(rungs[450], [8])
+
+    def test_best_params_round_trip(self):
+        results = fake_run([sample_params(np.random.default_rng(seed)) for seed in range(4)], 500)
+        board = leaderboard(results, "fixture_dataframe", "random")
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "leaderboard.json")
+            save_leaderboard(board, path)
+            params = load_best_params(path)
+        best = max(results, key=lambda result: result["score"])["params"]
+        self.assertEqual(params["max_depth"], best["max_depth"])
+        self.assertEqual(params["objective"], "binary:logistic")
+
+
+if __name__ == '__main__':
+    unittest.main()
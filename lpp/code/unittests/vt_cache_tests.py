@@ -0,0 +1,33 @@
+import unittest
+
+from datetime import datetime, timedelta
+
+from utils.vt_cache import VtCache, freshness
+
+
+class FakeCollection(object):
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query, projection=None):
+        return [doc for doc in self.docs if doc["domain"] == query["domain"] and doc["endpoint"] in query["endpoint"]["$in"]]
+
+
+class TestFreshness(unittest.TestCase):
+
+    def test_cached_responses_keep_their_fetch_date(self):
+        now = datetime(2021, 6, 2)
+        cached_at = now - timedelta(hours=20)
+        cache = VtCache(FakeCollection([
+            {"domain": "example.com", "endpoint": "domain", "response": {"data": {}}, "fetched_at": cached_at}
+        ]))
+        fetched_at = {}
+        vt_data = cache.get_many("example.com", [None, "urls"], fetched_at=fetched_at)
+        vt_data.update({"urls": {"data": []}, "resolutions": {"error": {"code": "QuotaExceededError"}}})
+
+        self.assertEqual(freshness(vt_data, now=now, fetched_at=fetched_at), {"domain": cached_at, "urls": now})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from train.xgb import params, balanced_params
+from train.external_memory import train_model, predict_batches, CACHE_DIR
+from utils.feature_store import save_features, load_labels
+
+
+class TestBalancedParams(unittest.TestCase):
+
+    def test_scale_pos_weight(self):
+        y_train = np.array([0, 0, 0, 0, 0, 0, 1, 1], dtype=np.uint8)
+        balanced = balanced_params(params, y_train)
+        self.assertEqual(balanced["scale_pos_weight"], 3.0)
+        self.assertEqual(balanced["max_depth"], params["max_depth"])
+        # the shared params are left as they are
+        self.assertEqual(params["scale_pos_weight"], 1)
+
+
+class TestExternalMemory(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.workdir = tempfile.mkdtemp()
+        os.chdir(self.workdir)
+        os.mkdir("model")
+        rng = np.random.default_rng(11)
+        df = pd.DataFrame(rng.random((1000, 4)), columns=["svd_alerts_0", "svd_alerts_1", "reputation", "tld_com"])
+        df.insert(0, "ticket_label", (df["reputation"] + 0.2 * rng.random(1000) > 0.6).astype(float))
+        df.index = pd.Index(["host{}.example.com".format(i) for i in range(1000)], name="name")
+        self.path = "model/features.parquet"
+        save_features(df, self.path, row_group_size=150)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.workdir)
+
+    def test_predict_batches_labels(self):
+        xgb_model, train_idx, test_idx = train_model(self.path, dict(params, max_depth=3, verbosity=0))
+        probabilities, y_test = predict_batches(xgb_model, self.path, test_idx)
+
+        np.testing.assert_array_equal(y_test, load_labels(self.path)[np.sort(test_idx)])
+        self.assertEqual(len(probabilities), len(test_idx))
+        self.assertEqual(len(np.intersect1d(train_idx, test_idx)), 0)
+        # the cached pages of the run are removed
+        self.assertEqual(os.listdir(CACHE_DIR), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
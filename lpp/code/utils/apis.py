@@ -4,28 +4,61 @@ from aiohttp.client_exceptions import ContentTypeError
 
 from datetime import datetime
 from ratelimit import limits, sleep_and_retry
+from utils.vt_pagination import next_cursor
 import copy
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(asctime)s %(levelname)-8s:%(name)s:  %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
 logger = logging.getLogger("l++ apis")
 
+# characters mongodb does not accept in keys, replaced by `_`
+FORBIDDEN_KEY_CHARS = "[]$,."
+KEY_TRANSLATION = str.maketrans({char: "_" for char in FORBIDDEN_KEY_CHARS})
+KEY_CACHE_SIZE = 2 ** 16
+
+# VT uses the same keys over and over, e.g. engine names, so sanitized keys are cached
+_clean_key_cache = {}
+
+def clean_key(key):
+    """ `key` with the forbidden characters replaced """
+    try:
+        return _clean_key_cache[key]
+    except KeyError:
+        pass
+    new_key = key.translate(KEY_TRANSLATION) if any(char in key for char in FORBIDDEN_KEY_CHARS) else key
+    if len(_clean_key_cache) >= KEY_CACHE_SIZE:
+        _clean_key_cache.clear()
+    _clean_key_cache[key] = new_key
+    return new_key
+
 def clean_keys(data):
-    """ remove forbidden characters from chars in keys of json """
-    if isinstance(data, dict):
-        for key, val in data.copy().items():
-            new_key = re.sub(r"[\[\]\$,\.]", "_", key)
-            if new_key != key:
-                data[new_key] = clean_keys(val)
-                del data[key]
-            else:
-                data[key] = clean_keys(val)
-        return data
-    elif isinstance(data, list):
-        for item in data:
-            clean_keys(item)
-        return data
-    else:
-        return data
+    """ remove forbidden characters from chars in keys of json, in place.
+
+    `data` is json as parsed, i.e. plain dicts and lists, which are checked by exact type to keep the walk fast.
+    """
+    cache = _clean_key_cache
+    stack = [data]
+    pop, push = stack.pop, stack.append
+    while stack:
+        node = pop()
+        if type(node) is dict:
+            renames = None
+            for key, val in node.items():
+                if type(val) is dict or type(val) is list:
+                    push(val)
+                new_key = cache.get(key)
+                if new_key is None:
+                    new_key = clean_key(key)
+                if new_key != key:
+                    renames = renames or []
+                    renames.append((key, new_key))
+            if renames:
+                for key, new_key in renames:
+                    node[new_key] = node.pop(key)
+        elif type(node) is list:
+            for item in node:
+                if type(item) is dict or type(item) is list:
+                    push(item)
+    return data
 
 class DomainNotFoundException(Exception):
     def __init__(self, message, *args: object) -> None:
@@ -155,22 +188,44 @@ class SnowApi(object):
 
 class VtApi(object):
 
-    def __init__(self):
+    def __init__(self, cache=None, limiter=None):
+        self.cache = cache # optional `utils.vt_cache.VtCache`, responses are fetched from VT on a miss
+        self.limiter = limiter # optional `utils.rate_limit.RateLimiter`, every request to VT takes a token
         self.api_key = os.getenv("VT_API_KEY")
         self.base_url = "https://www.virustotal.com/api/v3/"
         self.header = {"x-apikey": self.api_key}
         self.querystring = {"limit": 25} # max number of entries to return
         self.endpoints = ["communicating_files", "downloaded_files", "historical_whois", "referrer_files", "resolutions", "siblings", "subdomains", "urls", "votes"]
 
-    async def get(self, id, end_point, session):
+    async def get(self, id, end_point, session, cursor=None):
+        params = dict(self.querystring, cursor=cursor) if cursor else self.querystring
         if end_point:
             url = "{}domains/{}/{}".format(self.base_url, id, end_point)
         else:
             url = "{}domains/{}".format(self.base_url, id)
-        return await fetch(url, headers=self.header, params=self.querystring, session=session), end_point
+        if self.limiter:
+            await self.limiter.acquire()
+        return await fetch(url, headers=self.header, params=params, session=session), end_point
+
+    async def iter_pages(self, fqdn, end_point, session, cursor, budget):
+        """ yields the entries of the pages after `cursor` of a relationship, one page at a time, until `budget` is spent.
+        
+        Throws QuotaExceededException
+        """
+        while cursor and not budget.exhausted():
+            response, _ = await self.get(fqdn, end_point, session, cursor=cursor)
+            if "error" in response:
+                if response["error"].get("code") == "QuotaExceededError":
+                    raise QuotaExceededException(f"Quota reached when paging `{end_point}` of `{fqdn}`")
+                logger.error(response["error"].get("message"))
+                return
+            items = response.get("data", [])
+            yield items[:budget.take(len(items))]
+            cursor = next_cursor(response)
     
-    async def fetch_vt(self, fqdn, session):
-        """fetches vt data. 
+    async def fetch_vt(self, fqdn, session, end_points=None, fetched_at=None):
+        """fetches vt data for `end_points`, all endpoints and the domain object (`None`) by default.
+        A `fetched_at` dict gets the fetch dates of the responses served from the cache, see `VtCache.get_many`.
         
         Throws IsIpException, InvalidDomainException, QuotaExceededException, DomainNotFoundException and  OtherVtException
         
@@ -183,19 +238,15 @@ class VtApi(object):
             raise InvalidDomainException(f"{fqdn} not a valid domain name")
         logger.info(f"running queries for `{fqdn}`.")
         
-        # For each document, call vt api endpoints
-        tasks = []
-    
-        task = asyncio.ensure_future(
-            self.get(
-                id=fqdn,
-                end_point=None,
-                session=session
-            )
-        )
+        if end_points is None:
+            end_points = [None] + self.endpoints
+        cached = self.cache.get_many(fqdn, end_points, fetched_at=fetched_at) if self.cache else {}
 
-        tasks.append(task)
-        for endpoint in self.endpoints:
+        # For each document, call vt api endpoints that are not cached
+        tasks = []
+        for endpoint in end_points:
+            if endpoint in cached:
+                continue
             task = asyncio.ensure_future(
                 self.get(
                     id=fqdn, 
@@ -205,7 +256,12 @@ class VtApi(object):
             )
             tasks.append(task)
         tuples = await asyncio.gather(*tasks)
-        data = format_data(tuples)
+        data = format_data(list(tuples) + [(val, endpoint) for endpoint, val in cached.items()])
+
+        if "domain" not in data: # partial refresh, the quota shows up on the relationships
+            for val in data.values():
+                if isinstance(val, dict) and val.get("error", {}).get("code") == "QuotaExceededError":
+                    raise QuotaExceededException(f"Quota reached when looking up `{fqdn}`")
         
         try:
             code = data["domain"]["error"]["code"]
@@ -218,5 +274,8 @@ class VtApi(object):
                 raise OtherVtException(message=data["domain"]["error"]["message"])
         except KeyError:
             pass
-            
+
+        if self.cache and tuples:
+            # mongo does not accept every key VT sends, the cached copy is cleaned up front
+            self.cache.set_many(fqdn, {endpoint: clean_keys(copy.deepcopy(val)) for val, endpoint in tuples})
         return data
\ No newline at end of file
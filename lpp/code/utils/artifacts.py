@@ -0,0 +1,55 @@
+import os, sys, pickle, logging, threading
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(asctime)s %(levelname)-8s:%(name)s:  %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger("l++ artifacts")
+
+
+def load_pickle(file_path):
+    with open(file_path, 'rb') as fp:
+        obj = pickle.load(fp)
+    return obj
+
+
+class ArtifactRegistry(object):
+    """
+    In-process cache of the artifacts under `model/`.
+
+    Artifacts are keyed by path, which includes the collection, and by the file's mtime and size. A file
+    that is replaced, e.g. by a new `lpp frame` or `lpp train`, is loaded again on its next lookup.
+    """
+
+    def __init__(self, loader=load_pickle):
+        self.loader = loader
+        self.hits = 0
+        self.loads = 0
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def signature(file_path):
+        stat = os.stat(file_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self, file_path, loader=None):
+        """ returns the artifact at `file_path`, loading it only if it is new or has changed on disk """
+        signature = self.signature(file_path)
+        key = os.path.abspath(file_path)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached and cached[0] == signature:
+                self.hits += 1
+                return cached[1]
+            if cached:
+                logger.info(f"`{file_path}` changed on disk, reloading")
+            obj = (loader or self.loader)(file_path)
+            self._cache[key] = (signature, obj)
+            self.loads += 1
+            return obj
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+# shared by everything running in the same process, i.e. once per celery worker
+artifacts = ArtifactRegistry()
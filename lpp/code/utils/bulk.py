@@ -0,0 +1,68 @@
+import sys, time, logging
+
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(asctime)s %(levelname)-8s:%(name)s:  %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger("l++ bulk")
+
+BATCH_SIZE = 1000
+
+# write errors worth retrying: shutdowns, elections and stepdowns, exceeded time limits and write conflicts
+TRANSIENT_ERROR_CODES = {6, 7, 89, 91, 112, 189, 262, 9001, 10107, 11600, 11602, 13435, 13436}
+
+
+class BatchedWriter(object):
+    """
+    Collects write requests, e.g. `pymongo.UpdateOne`, and sends them with one unordered `bulk_write` per
+    `batch_size` requests. Batches that fail on a lost connection are sent again, and so are the requests of a
+    batch that failed with a transient write error. Other write errors are raised.
+
+    Use it as a context manager, the last batch is written when the block exits:
+
+        with BatchedWriter(setup.db[collection]) as writer:
+            for doc in cursor:
+                writer.add(UpdateOne({"_id": doc["_id"]}, {"$set": ...}))
+    """
+
+    def __init__(self, collection, batch_size=BATCH_SIZE, retries=3, backoff=0.5):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.retries = retries
+        self.backoff = backoff
+        self.requests = []
+        self.nr_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def add(self, request):
+        self.requests.append(request)
+        if len(self.requests) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        requests, self.requests = self.requests, []
+        for attempt in range(self.retries + 1):
+            if not requests:
+                return
+            try:
+                self.collection.bulk_write(requests, ordered=False)
+                self.nr_written += len(requests)
+                return
+            except AutoReconnect as e:
+                error = e
+            except BulkWriteError as e:
+                errors = e.details["writeErrors"]
+                if any(err["code"] not in TRANSIENT_ERROR_CODES for err in errors):
+                    raise
+                self.nr_written += len(requests) - len(errors)
+                requests = [requests[err["index"]] for err in errors]
+                error = e
+            if attempt < self.retries:
+                logger.warning("Transient error writing {} requests to `{}`, retrying: {}".format(len(requests), self.collection.name, error))
+                time.sleep(self.backoff * 2 ** attempt)
+        raise error
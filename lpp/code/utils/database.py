@@ -1,17 +1,27 @@
-import os, tldextract, sys, json, logging, io
+import os, sys, json, logging, io
 
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from tqdm import tqdm
-from pymongo import MongoClient
-from pymongo.errors import ServerSelectionTimeoutError
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import ServerSelectionTimeoutError, OperationFailure
 
 from utils.queries import HAS_NO_ALERT_ENRICHMENT, has_domain_enrichment, date_fields_exists_and_is_date
+from utils.bulk import BatchedWriter, BATCH_SIZE
+from utils.domains import split_domains
+from utils.pipelines import update_pipeline_hosts_array, update_pipeline_sys_created_on, update_pipeline_alert_date, \
+                            update_pipeline_u_json
 
 TICKETS_NAME = os.getenv("MONGO_TICKETS_NAME")
 ALERTS_NAME = os.getenv("MONGO_ALERTS_NAME")
 DOMAINS_NAME = os.getenv("MONGO_DOMAINS_NAME")
 INCIDENTS_NAME = os.getenv("MONGO_INCIDENTS_NAME")
 DOMAINS_REAL_TIME_NAME = os.getenv("MONGO_DOMAINS_REAL_TIME_NAME")
+VT_CACHE_NAME = os.getenv("MONGO_VT_CACHE_NAME")
+VT_JOBS_NAME = os.getenv("MONGO_VT_JOBS_NAME")
+
+# server versions needed for update pipelines and for `$function` in them
+PIPELINE_UPDATES_VERSION = (4, 2)
+FUNCTION_VERSION = (4, 4)
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(asctime)s %(levelname)-8s:%(name)s:  %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
 logger = logging.getLogger("l++ database")
@@ -26,6 +36,12 @@ def flatten_array_data(input_data, column):
             i += 1
     del input_data["vt"][column]["data"]
 
+
+def alert_date(timestamp):
+    """ the UTC date of the epoch seconds `timestamp`, truncated to milliseconds like `update_pipeline_alert_date` """
+    return datetime(1970, 1, 1, tzinfo=timezone.utc) + timedelta(milliseconds=int(float(timestamp) * 1000))
+
+
 class TqdmToLogger(io.StringIO):
     """
         Output stream for TQDM which will output to logger module instead of
@@ -57,13 +73,14 @@ class SetupDatabase(object):
         self.client = MongoClient(uri)
         logger.info(f"Testing connection to {usr}@{host}:{port}")
         try:
-            self.client.server_info()
+            info = self.client.server_info()
             logger.info(f"Connection successful towards {usr}@{host}:{port}")
         except ServerSelectionTimeoutError as e:
             logger.error(f"Connection failure when connecting to {usr}@{host}:{port}.")
             raise e
         db = os.getenv("MONGO_DBNAME")
         self.db = self.client[db]
+        self.server_version = tuple(info["versionArray"][:2])
     
     def __del__(self):
         logger.debug("closing mongodb connection")
@@ -72,60 +89,75 @@ class SetupDatabase(object):
         except TypeError:
             pass
     
-    def create_hosts_array(self, collection=ALERTS_NAME):
-        for doc in tqdm(self.db[collection].find(HAS_NO_ALERT_ENRICHMENT)):
-            try:
-                hosts_string = doc["dest_host_uniq"]
-                if hosts_string != "N/A":
-                    hosts = list(filter(lambda a: a != '', doc["dest_host_uniq"].split(',')))
-                    self.db[collection].update_one({"sha": doc["sha"]}, {"$set": {"hosts_array": hosts}})
-                else:
+    def update_server_side(self, collection, query, pipeline, min_version=PIPELINE_UPDATES_VERSION):
+        """ updates the documents matching `query` with an update pipeline, returns False if the server can't run it """
+        if self.server_version < min_version:
+            return False
+        try:
+            result = self.db[collection].update_many(query, pipeline)
+        except OperationFailure as e:
+            logger.warning("Server side update of `{}` failed, updating from python instead: {}".format(collection, e))
+            return False
+        logger.info("Updated {} documents in `{}` server side".format(result.modified_count, collection))
+        return True
+
+    def create_hosts_array(self, collection=ALERTS_NAME, batch_size=BATCH_SIZE, server_side=True):
+        if server_side and self.update_server_side(collection, HAS_NO_ALERT_ENRICHMENT, update_pipeline_hosts_array()):
+            return
+        with BatchedWriter(self.db[collection], batch_size=batch_size) as writer:
+            for doc in tqdm(self.db[collection].find(HAS_NO_ALERT_ENRICHMENT, projection={"sha": 1, "dst": 1, "dest_host_uniq": 1})):
+                try:
+                    hosts_string = doc["dest_host_uniq"]
+                    if hosts_string != "N/A":
+                        hosts = list(filter(lambda a: a != '', doc["dest_host_uniq"].split(',')))
+                    else:
+                        hosts = [doc["dst"]]
+                except KeyError:
                     hosts = [doc["dst"]]
-                    self.db[collection].update_one({"sha": doc["sha"]}, {"$set": {"hosts_array": hosts}})
-            except KeyError:
-                hosts = [doc["dst"]]
-                self.db[collection].update_one({"sha": doc["sha"]}, {"$set": {"hosts_array": hosts}})
+                writer.add(UpdateOne({"sha": doc["sha"]}, {"$set": {"hosts_array": hosts}}))
 
-    def add_domain_and_tld(self, collection):
+    def add_domain_and_tld(self, collection, batch_size=BATCH_SIZE):
         """ parses domains and extracts subdomain domain and tld """
         query = has_domain_enrichment(switch=False)
-        for doc in tqdm(self.db[collection].find(query)):
-            extractor = tldextract.extract(doc["name"])
-            data = {
-                "domain": "{dom}.{tld}".format(dom=extractor.domain, tld=extractor.suffix),
-                "subdomain": extractor.subdomain,
-                "tld": extractor.suffix
-
-            }
-            self.db[collection].update_one({"name": doc["name"]}, {"$set": data})
-
-    def add_date_obj_sys_created_on_incidents(self, collection="incidents"):
-        query = self.db[collection].find({"sys_created_on": {"$type": "string"}})
+        with BatchedWriter(self.db[collection], batch_size=batch_size) as writer:
+            names = [doc["name"] for doc in tqdm(self.db[collection].find(query, projection={"name": 1, "_id": 0}))]
+            for name, data in zip(names, split_domains(names)):
+                writer.add(UpdateOne({"name": name}, {"$set": dict(data, updated_at=datetime.utcnow())}))
+
+    def add_date_obj_sys_created_on_incidents(self, collection="incidents", batch_size=BATCH_SIZE, server_side=True):
+        if server_side and self.update_server_side(collection, {"sys_created_on": {"$type": "string"}}, update_pipeline_sys_created_on()):
+            return
+        query = self.db[collection].find({"sys_created_on": {"$type": "string"}}, projection={"sys_created_on": 1})
         nr = query.count()
         logger.info("Updating `{}` sys_created_on. Docs to Update {}".format(collection, nr))
-        for doc in tqdm(query, total=nr):
-            created_on_date = datetime.strptime(doc["sys_created_on"], "%Y-%m-%d %H:%M:%S")
-            self.db[collection].update_one({"_id": doc["_id"]}, {"$set": {"sys_created_on": created_on_date}})
+        with BatchedWriter(self.db[collection], batch_size=batch_size) as writer:
+            for doc in tqdm(query, total=nr):
+                created_on_date = datetime.strptime(doc["sys_created_on"], "%Y-%m-%d %H:%M:%S")
+                writer.add(UpdateOne({"_id": doc["_id"]}, {"$set": {"sys_created_on": created_on_date}}))
         logger.info("Updating `{}` sys_created_on done!".format(collection))
 
 
-    def add_object_u_json_on_incidents(self, collection="incidents"):
-        query = self.db[collection].find({ "u_json": { "$type": "string" } })
+    def add_object_u_json_on_incidents(self, collection="incidents", batch_size=BATCH_SIZE, server_side=True):
+        if server_side and self.update_server_side(collection, {"u_json": {"$type": "string"}}, update_pipeline_u_json(), min_version=FUNCTION_VERSION):
+            return
+        query = self.db[collection].find({ "u_json": { "$type": "string" } }, projection={"u_json": 1})
         nr = query.count()
         logger.info("Updating `{}` u_json values. Docs to update: {}".format(collection, nr))
-        for doc in tqdm(query, total=nr):
-            alert_data = json.loads(doc["u_json"])
-            self.db[collection].update_one({"_id": doc["_id"]}, {"$set": {"u_json": alert_data}})
-        query = self.db[collection].find({ "u_json": { "$type": "string" } })
-        nr = query.count()
+        with BatchedWriter(self.db[collection], batch_size=batch_size) as writer:
+            for doc in tqdm(query, total=nr):
+                alert_data = json.loads(doc["u_json"])
+                writer.add(UpdateOne({"_id": doc["_id"]}, {"$set": {"u_json": alert_data}}))
         logger.info("Updating `{}` u_json done!".format(collection))
 
-    def update_timestamps_alerts(self, collection="alerts"):
+    def update_timestamps_alerts(self, collection="alerts", batch_size=BATCH_SIZE, server_side=True):
         query = date_fields_exists_and_is_date(switch=False)
-        cursor = self.db[collection].find(query)
+        if server_side and self.update_server_side(collection, query, update_pipeline_alert_date()):
+            return
+        cursor = self.db[collection].find(query, projection={"sha": 1, "timestamp": 1})
         nr_updates = cursor.count()
-        for doc in tqdm(cursor, total=nr_updates):
-            date = datetime.fromtimestamp(float(doc["timestamp"]))
-            self.db[collection].update_one({"sha": doc["sha"]}, {"$set": {"date": date}})    
+        with BatchedWriter(self.db[collection], batch_size=batch_size) as writer:
+            for doc in tqdm(cursor, total=nr_updates):
+                date = alert_date(doc["timestamp"])
+                writer.add(UpdateOne({"sha": doc["sha"]}, {"$set": {"date": date}}))
 
     
@@ -0,0 +1,44 @@
+import sys, logging
+
+import numpy as np
+import pandas as pd
+import tldextract
+
+from functools import lru_cache
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(asctime)s %(levelname)-8s:%(name)s:  %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger("l++ domains")
+
+CACHE_SIZE = 2 ** 18
+
+# the public suffix list snapshot shipped with tldextract, never refreshed over the network nor cached on disk
+_extractor = tldextract.TLDExtract(suffix_list_urls=(), cache_dir=None)
+_extractor("example.com") # loads the snapshot at import instead of on the first request
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def split_domain(name):
+    """ (subdomain, domain, tld) of a hostname, the domain includes the tld """
+    extractor = _extractor(name)
+    return extractor.subdomain, "{dom}.{tld}".format(dom=extractor.domain, tld=extractor.suffix), extractor.suffix
+
+
+def domain_fields(name):
+    """ the `subdomain`, `domain` and `tld` fields of a domain document """
+    subdomain, domain, tld = split_domain(name)
+    return {
+        "domain": domain,
+        "subdomain": subdomain,
+        "tld": tld
+    }
+
+
+def split_domains(names):
+    """
+    `domain_fields` of every hostname in `names`, e.g. a list or a column. The names are factorized first so that
+    each distinct name is parsed once and the fields are gathered by code, repeated names share one dict.
+    """
+    codes, uniques = pd.factorize(np.asarray(names, dtype=object))
+    fields = np.empty(len(uniques), dtype=object)
+    fields[:] = [domain_fields(name) for name in uniques]
+    return fields[codes].tolist()
@@ -0,0 +1,192 @@
+import os, sys, json, logging
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from datetime import datetime, timedelta
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(asctime)s %(levelname)-8s:%(name)s:  %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger("l++ feature store")
+
+ROW_GROUP_SIZE = 10000
+
+# dtypes of the frame `lpp frame` writes, xgboost bins the features as float32 whatever it is given
+LABEL_COLUMN = "ticket_label"
+FEATURE_DTYPE = np.float32
+LABEL_DTYPE = np.uint8
+
+# rows are read again from a bit before the checkpoint, for clock skew between the writers and mongodb
+CHECKPOINT_OVERLAP = timedelta(minutes=5)
+
+
+def feature_store_path(collection):
+    return "model/features_{}.parquet".format(collection)
+
+
+def legacy_path(collection):
+    """ the pickled frame `lpp frame` wrote before the feature store """
+    return "model/df_post_scaling-{}.pickle".format(collection)
+
+
+def save_features(df, file_path, row_group_size=ROW_GROUP_SIZE):
+    """ writes the frame of `lpp frame` as parquet, the index (the domain names) included """
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    pq.write_table(table, file_path, row_group_size=row_group_size)
+    save_schema(df, file_path)
+    logger.info("Saved {} rows and {} columns to {}".format(df.shape[0], df.shape[1], file_path))
+
+
+def _row_group_bounds(parquet_file):
+    return np.cumsum([0] + [parquet_file.metadata.row_group(i).num_rows for i in range(parquet_file.num_row_groups)])
+
+
+def _row_groups(parquet_file, rows):
+    """ the row groups holding the positions in `rows` and the positions relative to the groups read """
+    bounds = _row_group_bounds(parquet_file)
+    groups = np.unique(np.searchsorted(bounds, rows, side="right") - 1)
+    offsets = np.cumsum([0] + [bounds[group + 1] - bounds[group] for group in groups])
+    positions = np.empty(len(rows), dtype=np.int64)
+    for i, group in enumerate(groups):
+        in_group = (rows >= bounds[group]) & (rows < bounds[group + 1])
+        positions[in_group] = rows[in_group] - bounds[group] + offsets[i]
+    return groups.tolist(), positions
+
+
+def _read_table(file_path, columns=None, rows=None, use_pandas_metadata=True):
+    parquet_file = pq.ParquetFile(file_path, memory_map=True)
+    if rows is None:
+        return parquet_file.read(columns=columns, use_pandas_metadata=use_pandas_metadata)
+    rows = np.asarray(rows, dtype=np.int64)
+    groups, positions = _row_groups(parquet_file, rows)
+    table = parquet_file.read_row_groups(groups, columns=columns, use_pandas_metadata=use_pandas_metadata)
+    return table.take(pa.array(positions))
+
+
+def load_features(file_path, columns=None, rows=None):
+    """
+    Reads a feature frame, only the `columns` if given and only the positions in `rows` if given, in that order.
+
+    Parquet is memory mapped and only the row groups holding `rows` are read. Pickled frames are loaded whole.
+    """
+    if file_path.endswith(".pickle"):
+        df = pd.read_pickle(file_path)
+        df = df if columns is None else df[columns]
+        return df if rows is None else df.iloc[rows]
+    return _read_table(file_path, columns=columns, rows=rows).to_pandas()
+
+
+def load_matrix(file_path, rows=None):
+    """
+    The features of a feature frame as one C ordered float32 matrix, the labels and the feature names, only the
+    positions in `rows` if given. Parquet columns are copied straight from arrow into the matrix, without a frame.
+    """
+    schema = load_schema(file_path)
+    features = schema["features"]
+    if file_path.endswith(".pickle"):
+        df = load_features(file_path, rows=rows)
+        return df[features].to_numpy(dtype=FEATURE_DTYPE), df[schema["label"]].to_numpy(), features
+
+    table = _read_table(file_path, columns=[schema["label"]] + features, rows=rows, use_pandas_metadata=False)
+    X = np.empty((table.num_rows, len(features)), dtype=FEATURE_DTYPE)
+    for j, col in enumerate(features):
+        X[:, j] = table.column(col).to_numpy()
+    return X, table.column(schema["label"]).to_numpy(), features
+
+
+def load_labels(file_path):
+    """ only the label column of a feature frame, e.g. to split it without reading the features """
+    return load_features(file_path, columns=[load_schema(file_path)["label"]]).iloc[:, 0].to_numpy()
+
+
+def row_group_batches(file_path, rows):
+    """ the positions in `rows` sorted and split by the row group holding them, each batch is read from one group """
+    rows = np.sort(np.asarray(rows, dtype=np.int64))
+    bounds = _row_group_bounds(pq.ParquetFile(file_path))
+    splits = np.searchsorted(rows, bounds[1:-1])
+    return [batch for batch in np.split(rows, splits) if len(batch)]
+
+
+def feature_columns(file_path):
+    """ the columns of a feature frame, read from the parquet footer without loading any data """
+    if file_path.endswith(".pickle"):
+        return list(pd.read_pickle(file_path).columns)
+    schema = pq.read_schema(file_path)
+    index_columns = set(schema.pandas_metadata["index_columns"]) if schema.pandas_metadata else set()
+    return [name for name in schema.names if name not in index_columns]
+
+
+def schema_path(file_path):
+    return file_path + ".schema.json"
+
+
+def save_schema(df, file_path):
+    """ the label, the features in model order and the dtypes of a feature frame, the label is the first column """
+    schema = {
+        "label": df.columns[0],
+        "features": list(df.columns[1:]),
+        "dtypes": {col: str(dtype) for col, dtype in df.dtypes.items()},
+    }
+    with open(schema_path(file_path), "w") as fp:
+        json.dump(schema, fp)
+
+
+def load_schema(file_path):
+    """ the schema saved with a feature frame, frames written before schemas existed get it from their columns """
+    try:
+        with open(schema_path(file_path), "r") as fp:
+            return json.load(fp)
+    except FileNotFoundError:
+        columns = feature_columns(file_path)
+        return {"label": columns[0], "features": columns[1:], "dtypes": None}
+
+
+def training_data_path(collection):
+    """ the feature store of `collection`, or the pickled frame if it was made before the feature store """
+    path = feature_store_path(collection)
+    if not os.path.exists(path) and os.path.exists(legacy_path(collection)):
+        logger.warning("No feature store for `{}`, reading {}".format(collection, legacy_path(collection)))
+        return legacy_path(collection)
+    return path
+
+
+def checkpoint_path(file_path):
+    return file_path + ".checkpoint.json"
+
+
+def load_checkpoint(file_path):
+    """ the time of the `lpp frame` run that wrote `file_path`, None if it has no checkpoint """
+    try:
+        with open(checkpoint_path(file_path), "r") as fp:
+            return datetime.fromisoformat(json.load(fp)["updated_at"])
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(file_path, updated_at):
+    with open(checkpoint_path(file_path), "w") as fp:
+        json.dump({"updated_at": updated_at.isoformat()}, fp)
+
+
+def changed_since(checkpoint):
+    """ query for the documents with an `updated_at` after `checkpoint` """
+    return {"updated_at": {"$gte": checkpoint - CHECKPOINT_OVERLAP}}
+
+
+def upsert_features(df, file_path, replaced, keep=None):
+    """
+    Replaces the rows of the domains in `replaced` with the rows in `df`, aligned to the stored columns, and
+    drops the rows of domains not in `keep` if given. Domains in `replaced` without a row in `df` are dropped.
+    """
+    stored = load_features(file_path)
+    dropped = stored.index.isin(list(replaced))
+    if keep is not None:
+        keep = list(keep)
+        dropped |= ~stored.index.isin(keep)
+        df = df.loc[df.index.isin(keep)]
+    rows = df.reindex(columns=stored.columns, fill_value=0).astype(stored.dtypes.to_dict())
+    updated = pd.concat([stored.loc[~dropped], rows])
+    logger.info("Dropped {} of {} stored rows, upserted {} rows".format(dropped.sum(), len(stored), len(rows)))
+    save_features(updated, file_path)
+    return updated
@@ -50,9 +50,25 @@ def pipeline_join_tickets_aggregation_on_domains(output_collection):
                     "pipeline": [
                         {"$match": {"$expr": {"$eq": ["$name","$$name"]}}}
                     ],
-                    "as": "tickets"
+                    "as": "_tickets"
                 }
             },
+            {
+                # `updated_at` only moves when the tickets of the domain changed
+                "$set": {
+                    "tickets": "$_tickets",
+                    "updated_at": {
+                        "$cond": [
+                            {"$setEquals": [{"$ifNull": ["$tickets.tickets", []]}, "$_tickets.tickets"]},
+                            "$updated_at",
+                            "$$NOW"
+                        ]
+                    }
+                }
+            },
+            {
+                "$unset": "_tickets"
+            },
             {
                 "$out": output_collection
             }
@@ -82,13 +98,28 @@ def pipeline_alerts(matching_stage, output_collection):
             '$project': {
                 'name': '$_id', 
                 'alerts': 1, 
+                'updated_at': '$$NOW',
                 '_id': 0
             }
         }, {
             '$merge': {
                 'into': output_collection, 
                 'on': 'name', 
-                'whenMatched': 'merge', 
+                # `updated_at` only moves when the alerts of the domain changed
+                'whenMatched': [
+                    {
+                        '$set': {
+                            'alerts': '$$new.alerts',
+                            'updated_at': {
+                                '$cond': [
+                                    {'$setEquals': [{'$ifNull': ['$alerts', []]}, '$$new.alerts']},
+                                    '$updated_at',
+                                    '$$new.updated_at'
+                                ]
+                            }
+                        }
+                    }
+                ], 
                 'whenNotMatched': 'insert'
             }
         }
@@ -222,6 +253,7 @@ def pipeline_domains_dataframe(matching_stage, output_collection="domains_datafr
             "subdomain": 1.0,
             "domain": 1.0,
             "name": 1.0,
+            "updated_at": 1,
             "ioc_first_date": 1,
             "vt.domain.data.attributes.creation_date": 1,
             "vt.domain.data.attributes.last_dns_records_date": 1,
@@ -282,3 +314,66 @@ def pipeline_domains_dataframe(matching_stage, output_collection="domains_datafr
     ]
     pipeline.insert(0, {"$match": matching_stage})
     return pipeline
+
+
+# Update pipelines, run with `update_many` on MongoDB 4.2+ instead of round tripping every document through python
+
+def update_pipeline_hosts_array():
+    """ `hosts_array` from the comma separated `dest_host_uniq`, or `dst` when it is missing or `N/A` """
+    return [
+        {
+            '$set': {
+                'hosts_array': {
+                    '$cond': [
+                        {'$and': [
+                            {'$eq': [{'$type': '$dest_host_uniq'}, 'string']},
+                            {'$ne': ['$dest_host_uniq', 'N/A']}
+                        ]},
+                        {'$filter': {
+                            'input': {'$split': ['$dest_host_uniq', ',']},
+                            'as': 'host',
+                            'cond': {'$ne': ['$$host', '']}
+                        }},
+                        ['$dst']
+                    ]
+                }
+            }
+        }
+    ]
+
+def update_pipeline_sys_created_on():
+    return [
+        {
+            '$set': {
+                'sys_created_on': {
+                    '$dateFromString': {'dateString': '$sys_created_on', 'format': '%Y-%m-%d %H:%M:%S'}
+                }
+            }
+        }
+    ]
+
+def update_pipeline_alert_date():
+    """ `date` from the epoch seconds in `timestamp`, stored as a string or a double """
+    return [
+        {
+            '$set': {
+                'date': {'$toDate': {'$multiply': [{'$toDouble': '$timestamp'}, 1000]}}
+            }
+        }
+    ]
+
+def update_pipeline_u_json():
+    """ parses the `u_json` string, needs MongoDB 4.4+ with server side javascript enabled """
+    return [
+        {
+            '$set': {
+                'u_json': {
+                    '$function': {
+                        'body': 'function(u_json) { return JSON.parse(u_json); }',
+                        'args': ['$u_json'],
+                        'lang': 'js'
+                    }
+                }
+            }
+        }
+    ]
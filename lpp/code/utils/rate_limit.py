@@ -0,0 +1,52 @@
+import sys, time, asyncio, logging
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(asctime)s %(levelname)-8s:%(name)s:  %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger("l++ rate limit")
+
+MINUTE = 60
+DAY = 24 * 60 * 60
+
+
+class TokenBucket(object):
+    """
+    Async token bucket holding at most `capacity` tokens, refilled at `capacity` tokens per `period` seconds.
+    """
+
+    def __init__(self, capacity, period):
+        self.capacity = capacity
+        self.period = period
+        self.rate = capacity / period
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        # the lock makes waiters take turns, i.e. tokens are handed out in the order they were requested
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+class RateLimiter(object):
+    """
+    Limits VirusTotal requests to our quota. A request takes one token from every bucket, `None` means no limit.
+    """
+
+    def __init__(self, per_minute=None, per_day=None):
+        self.buckets = []
+        if per_day:
+            self.buckets.append(TokenBucket(per_day, DAY))
+        if per_minute:
+            self.buckets.append(TokenBucket(per_minute, MINUTE))
+
+    async def acquire(self):
+        for bucket in self.buckets:
+            await bucket.acquire()
@@ -1,15 +1,13 @@
-import tldextract
 from datetime import datetime
 
+from utils.domains import domain_fields
+
 def format_data(vtdata, domain):
-    extractor = tldextract.extract(domain)
     return {
         "vt": vtdata,
         "tickets": [],
         "name": domain,
-        "domain": "{dom}.{tld}".format(dom=extractor.domain, tld=extractor.suffix),
-        "subdomain": extractor.subdomain,
-        "tld": extractor.suffix
+        **domain_fields(domain)
     }
 
 def create_mock_alert():
@@ -0,0 +1,128 @@
+import sys, logging
+
+from collections import Counter
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(asctime)s %(levelname)-8s:%(name)s:  %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger("l++ vt cache")
+
+# name of the domain object in the cache, the relationships use their endpoint name
+DOMAIN_OBJECT = "domain"
+
+# how long a VirusTotal response stays fresh, per endpoint
+ENDPOINT_TTLS = {
+    DOMAIN_OBJECT: timedelta(days=1),
+    "communicating_files": timedelta(days=1),
+    "downloaded_files": timedelta(days=1),
+    "historical_whois": timedelta(days=7),
+    "referrer_files": timedelta(days=1),
+    "resolutions": timedelta(days=1),
+    "siblings": timedelta(days=3),
+    "subdomains": timedelta(days=3),
+    "urls": timedelta(days=1),
+    "votes": timedelta(days=1),
+}
+DEFAULT_TTL = timedelta(days=1)
+
+
+def endpoint_name(end_point):
+    return end_point if end_point else DOMAIN_OBJECT
+
+
+class VtCache(object):
+    """
+    Mongo backed cache of VirusTotal responses keyed by (domain, endpoint).
+
+    Expired responses are never served and are removed by the TTL index on `expires_at`, see
+    `setup/create_indeces.py`. Error responses, e.g. quota errors, are not cached.
+    """
+
+    def __init__(self, collection, ttls=ENDPOINT_TTLS):
+        self.collection = collection
+        self.ttls = ttls
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def get_many(self, domain, end_points, fetched_at=None):
+        """
+        fresh cached responses for `domain` as {end_point: response}, counting hits and misses. A `fetched_at` dict
+        gets the fetch date of every returned response, by endpoint name.
+        """
+        names = {endpoint_name(end_point): end_point for end_point in end_points}
+        cursor = self.collection.find(
+            {"domain": domain, "endpoint": {"$in": list(names)}, "expires_at": {"$gt": datetime.now()}},
+            projection={"endpoint": 1, "response": 1, "fetched_at": 1, "_id": 0}
+        )
+        cached = {}
+        for doc in cursor:
+            cached[names[doc["endpoint"]]] = doc["response"]
+            if fetched_at is not None:
+                fetched_at[doc["endpoint"]] = doc["fetched_at"]
+        for name, end_point in names.items():
+            if end_point in cached:
+                self.hits[name] += 1
+            else:
+                self.misses[name] += 1
+        return cached
+
+    def set_many(self, domain, responses):
+        """ caches {end_point: response}, skipping error responses """
+        now = datetime.now()
+        requests = []
+        for end_point, response in responses.items():
+            if is_error_response(response):
+                continue
+            name = endpoint_name(end_point)
+            requests.append(UpdateOne(
+                {"domain": domain, "endpoint": name},
+                {"$set": {
+                    "response": response,
+                    "fetched_at": now,
+                    "expires_at": now + self.ttls.get(name, DEFAULT_TTL)
+                }},
+                upsert=True
+            ))
+        if requests:
+            self.collection.bulk_write(requests, ordered=False)
+
+    def stats(self):
+        hits, misses = sum(self.hits.values()), sum(self.misses.values())
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else None,
+            "endpoints": {
+                name: {"hits": self.hits[name], "misses": self.misses[name]}
+                for name in sorted(set(self.hits) | set(self.misses))
+            }
+        }
+
+
+def is_error_response(response):
+    return not isinstance(response, dict) or "error" in response
+
+
+def plan_refresh(fetched_at, end_points, now=None, ttls=ENDPOINT_TTLS):
+    """ the `end_points` whose response in `vt` is missing or older than its TTL, `fetched_at` as stored in `vt_fetched_at` """
+    now = now or datetime.now()
+    fetched_at = fetched_at or {}
+    return [
+        end_point for end_point in end_points
+        if endpoint_name(end_point) not in fetched_at
+        or fetched_at[endpoint_name(end_point)] + ttls.get(endpoint_name(end_point), DEFAULT_TTL) <= now
+    ]
+
+
+def freshness(vt_data, now=None, fetched_at=None):
+    """
+    `vt_fetched_at` entries for the successful responses in `vt_data`, `now` or the date in `fetched_at` for the
+    responses served from the cache
+    """
+    now = now or datetime.now()
+    fetched_at = fetched_at or {}
+    return {
+        endpoint_name(end_point): fetched_at.get(endpoint_name(end_point), now)
+        for end_point, response in vt_data.items() if not is_error_response(response)
+    }
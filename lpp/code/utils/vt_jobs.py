@@ -0,0 +1,98 @@
+import sys, logging
+
+from datetime import datetime, timedelta, timezone
+
+from pymongo import UpdateOne, ASCENDING, DESCENDING
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(asctime)s %(levelname)-8s:%(name)s:  %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger("l++ vt jobs")
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+# domains without alerts are fetched last
+NO_ALERTS = datetime(1970, 1, 1)
+# failed jobs are seeded again until they failed this many times
+MAX_ATTEMPTS = 3
+
+
+class JobLedger(object):
+    """
+    Per-domain status of a VT export into `collection`, kept in a mongo collection.
+
+    Pending jobs are handed out most recent alert first. A job only leaves `pending` once its result has been
+    written, so a crashed or paused export picks up where it stopped without fetching a domain twice. Seeding
+    makes the jobs of the matching domains pending again, so a domain is refetched when it needs VT data again.
+    """
+
+    def __init__(self, ledger, collection):
+        self.ledger = ledger
+        self.collection = collection
+
+    def seed(self, source, query, max_attempts=MAX_ATTEMPTS):
+        """
+        makes the job of every domain in `source` matching `query` pending, except failed jobs that have been tried
+        `max_attempts` times. Returns the number of new jobs.
+        """
+        given_up = {doc["name"] for doc in self.ledger.find(
+            {"collection": self.collection, "status": FAILED, "attempts": {"$gte": max_attempts}},
+            projection={"name": 1, "_id": 0}
+        )}
+        if given_up:
+            logger.warning("{} failed jobs are not retried, they failed {} times".format(len(given_up), max_attempts))
+        cursor = source.aggregate([
+            {"$match": query},
+            {"$project": {"_id": 0, "name": 1, "priority": {"$ifNull": [{"$max": "$alerts.date"}, NO_ALERTS]}}}
+        ], allowDiskUse=True)
+        requests = [
+            UpdateOne(
+                {"collection": self.collection, "name": doc["name"]},
+                {
+                    "$set": {"priority": doc["priority"], "status": PENDING},
+                    "$setOnInsert": {"created_at": datetime.now()}
+                },
+                upsert=True
+            )
+            for doc in cursor if doc["name"] not in given_up
+        ]
+        if not requests:
+            return 0
+        return self.ledger.bulk_write(requests, ordered=False).upserted_count
+
+    def count_pending(self):
+        return self.ledger.count_documents({"collection": self.collection, "status": PENDING})
+
+    def pending(self, limit=0):
+        """ names of the pending jobs, highest priority first """
+        cursor = self.ledger.find(
+            {"collection": self.collection, "status": PENDING},
+            projection={"name": 1, "_id": 0},
+            sort=[("priority", DESCENDING), ("name", ASCENDING)],
+            limit=limit
+        )
+        return [doc["name"] for doc in cursor]
+
+    def mark(self, statuses):
+        """ records {name: (status, error)} for finished jobs """
+        now = datetime.now()
+        requests = [
+            UpdateOne(
+                {"collection": self.collection, "name": name},
+                {"$set": {"status": status, "error": error, "updated_at": now}, "$inc": {"attempts": 1}}
+            )
+            for name, (status, error) in statuses.items()
+        ]
+        if requests:
+            self.ledger.bulk_write(requests, ordered=False)
+
+
+def next_quota_reset(now, minute_retried):
+    """
+    VirusTotal reports the per-minute and the daily quota with the same error. The first pause waits out the
+    minute window, if the quota is still exceeded after that the daily quota is spent and it resets at 00:00 UTC.
+    """
+    if not minute_retried:
+        return timedelta(minutes=1)
+    tomorrow = (now.astimezone(timezone.utc) + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return tomorrow - now.astimezone(timezone.utc)
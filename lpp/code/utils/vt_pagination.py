@@ -0,0 +1,34 @@
+import sys, logging
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(asctime)s %(levelname)-8s:%(name)s:  %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger("l++ vt pagination")
+
+# relationships that are commonly truncated by the page size of 25
+PAGINATED_ENDPOINTS = ["communicating_files", "resolutions", "subdomains", "urls"]
+
+
+def next_cursor(response):
+    """ the cursor of the next page of a relationship response, `None` on the last page """
+    if not isinstance(response, dict) or "error" in response:
+        return None
+    return response.get("meta", {}).get("cursor")
+
+
+class PageBudget(object):
+    """ how many extra pages and entries may be fetched for one endpoint of one domain """
+
+    def __init__(self, max_pages, max_items=None):
+        self.max_pages = max_pages
+        self.max_items = max_items
+        self.pages = 0
+        self.items = 0
+
+    def take(self, nr_items):
+        """ the number of the `nr_items` on a page that fit in the budget """
+        nr_items = min(nr_items, self.max_items - self.items) if self.max_items is not None else nr_items
+        self.pages += 1
+        self.items += nr_items
+        return nr_items
+
+    def exhausted(self):
+        return self.pages >= self.max_pages or (self.max_items is not None and self.items >= self.max_items)
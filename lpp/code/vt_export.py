@@ -11,17 +11,29 @@ sys.path.append(setup_dir)
 from tqdm import tqdm
 from aiohttp import ClientSession
 from aiohttp.client_exceptions import ContentTypeError
-from datetime import datetime
+from datetime import datetime, timezone
 
-from pymongo.errors import WriteError, InvalidDocument
+from pymongo import UpdateOne, DeleteOne
+from pymongo.errors import WriteError, BulkWriteError, InvalidDocument
 
-from database import SetupDatabase, DOMAINS_NAME, TqdmToLogger
+from database import SetupDatabase, DOMAINS_NAME, VT_CACHE_NAME, VT_JOBS_NAME, TqdmToLogger
+from vt_cache import VtCache, freshness
+from rate_limit import RateLimiter
+from vt_jobs import JobLedger, DONE, FAILED, next_quota_reset
+from vt_pagination import PAGINATED_ENDPOINTS, PageBudget, next_cursor
 from apis import VtApi, IsIpException, InvalidDomainException, QuotaExceededException, OtherVtException, clean_keys
 from queries import NO_ERROR_AND_NO_VT_OR_QUOTA_ERROR
 
 def parse_args():
     parser = argparse.ArgumentParser(description='vt api script')
     parser.add_argument("-c", "--collection", required=False)
+    parser.add_argument("-j", "--jobs", type=int, default=int(os.getenv("VT_CONCURRENCY", 4)), help="number of domains fetched concurrently")
+    parser.add_argument("--per-minute", type=int, default=os.getenv("VT_REQUESTS_PER_MINUTE"), help="VT requests per minute, unlimited if not set")
+    parser.add_argument("--per-day", type=int, default=os.getenv("VT_REQUESTS_PER_DAY"), help="VT requests per day, unlimited if not set")
+    parser.add_argument("--batch-size", type=int, default=100, help="number of results per bulk write")
+    parser.add_argument("--no-wait", action="store_true", help="exit when the quota is reached instead of pausing until it resets")
+    parser.add_argument("--max-pages", type=int, default=1, help="pages fetched per paginated relationship, 1 keeps only the first page")
+    parser.add_argument("--max-items", type=int, default=None, help="entries fetched per paginated relationship, unlimited if not set")
     return parser.parse_args()
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(asctime)s %(levelname)-8s:%(name)s:  %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
@@ -36,39 +48,180 @@ def format_error_entry(data, api_name):
         }
     }
 
-async def main(vt_api, setup, collection):
+class ResultWriter(object):
+    """
+    Buffers the results of the workers and writes them with one bulk write per `batch_size` domains. The jobs
+    are marked finished in the ledger right after their result is written.
+    """
+
+    def __init__(self, setup, collection, ledger, batch_size):
+        self.setup = setup
+        self.collection = collection
+        self.ledger = ledger
+        self.batch_size = batch_size
+        self.names = []
+        self.requests = []
+        self.statuses = {}
+
+    def add(self, name, request, status=DONE, error=None):
+        self.statuses[name] = (status, error)
+        if request is not None:
+            self.names.append(name)
+            self.requests.append(request)
+        if len(self.statuses) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        names, requests, statuses = self.names, self.requests, self.statuses
+        self.names, self.requests, self.statuses = [], [], {}
+        if requests:
+            try:
+                self.setup.db[self.collection].bulk_write(requests, ordered=False)
+            except BulkWriteError as e:
+                for error in e.details["writeErrors"]:
+                    statuses[names[error["index"]]] = self.write_error(names[error["index"]], error["errmsg"])
+            except (UnicodeEncodeError, InvalidDocument, OverflowError):
+                # the batch could not be encoded, write it domain by domain to find the bad ones
+                for name, request in zip(names, requests):
+                    statuses[name] = self.write_now(name, request)
+        self.ledger.mark(statuses)
+
+    def write_now(self, name, request):
+        """ writes the result of `name` right away, returns its job status and error """
+        try:
+            self.setup.db[self.collection].bulk_write([request])
+        except (UnicodeEncodeError, WriteError, BulkWriteError, InvalidDocument, OverflowError) as e:
+            return self.write_error(name, str(e))
+        return DONE, None
+
+    def write_error(self, name, message):
+        self.setup.db[self.collection].update_one({"name": name}, {"$set": format_error_entry(message, "vt")})
+        logger.error("Database Exception when inserting domain `{}`. saving stacktrace to error...".format(name))
+        logger.debug(message)
+        return FAILED, message
+
+
+class Pagination(object):
+    """
+    Follows the cursors of the relationships in `PAGINATED_ENDPOINTS` past the first page.
+
+    Every page is pushed onto `vt.<endpoint>.data` as it arrives, so only one page is held in memory. The
+    `vt_stats.*` features are computed from the stored pages, so they cover all the fetched entries.
+    """
+
+    def __init__(self, setup, collection, max_pages, max_items=None):
+        self.setup = setup
+        self.collection = collection
+        self.max_pages = max_pages
+        self.max_items = max_items
+
+    async def stream(self, vt_api, session, name, data):
+        update = {}
+        for end_point in PAGINATED_ENDPOINTS:
+            first_page = data.get(end_point, {}).get("data", [])
+            budget = PageBudget(self.max_pages - 1, self.max_items - len(first_page) if self.max_items else None)
+            async for items in vt_api.iter_pages(name, end_point, session, next_cursor(data.get(end_point)), budget):
+                if items:
+                    self.setup.db[self.collection].update_one(
+                        {"name": name},
+                        {"$push": {f"vt.{end_point}.data": {"$each": clean_keys(items)}}, "$set": {"updated_at": datetime.utcnow()}}
+                    )
+            update[f"vt_pages.{end_point}"] = {"pages": budget.pages + 1, "items": len(first_page) + budget.items}
+        self.setup.db[self.collection].update_one({"name": name}, {"$set": update})
+
+
+async def fetch_domain(vt_api, session, name, writer, paging=None):
+    """ fetches `name` and returns the write for its result, its job status and error """
+    fetched_at = {}
+    try: # fetch the data
+        data = await vt_api.fetch_vt(name, session, fetched_at=fetched_at)
+    except IsIpException as e:
+        logger.debug("this is an ip {}".format(name))
+        return DeleteOne({"name": name}), DONE, None
+    except InvalidDomainException as e:
+        logger.debug("invalid domain name found `{}`.".format(name))
+        return UpdateOne({"name": name}, {"$set": format_error_entry("invalid domain name", "badf00d")}), FAILED, e.message
+    except ContentTypeError:
+        logger.warn("ContentTypeError occurred while fetching data for `{}`".format(name))
+        return UpdateOne({"name": name}, {"$set": format_error_entry("ContentTypeError", "badf00d")}), FAILED, "ContentTypeError"
+    except OtherVtException as e:
+        logger.error(f"Other VT error occurred {e.message}")
+        return UpdateOne({"name": name}, {"$set": format_error_entry(e.message, "vt")}), FAILED, e.message
+
+    data = clean_keys(data)
+    request = UpdateOne({"name": name}, {"$set": {"vt": data, "vt_fetched_at": freshness(data, fetched_at=fetched_at), "updated_at": datetime.utcnow()}})
+    if paging is None:
+        return request, DONE, None
+
+    # the first pages have to be stored before the next pages are pushed onto them
+    status, error = writer.write_now(name, request)
+    if status == DONE:
+        await paging.stream(vt_api, session, name, data)
+    return None, status, error
+
+
+async def worker(vt_api, session, queue, writer, progress, quota_reached, paging):
+    while True:
+        name = await queue.get()
+        try:
+            if not quota_reached.is_set():
+                writer.add(name, *await fetch_domain(vt_api, session, name, writer, paging))
+        except QuotaExceededException:
+            # nothing is written, the job stays pending and is retried once the quota resets
+            logger.warning("Quota reached when looking up `{}`.".format(name))
+            quota_reached.set()
+        except Exception as e:
+            logger.exception("Unexpected error when looking up `{}`.".format(name))
+            writer.add(name, None, FAILED, str(e))
+        finally:
+            progress.update()
+            queue.task_done()
+
+
+async def run_jobs(vt_api, session, setup, collection, ledger, jobs, batch_size, paging):
+    """ fetches the pending jobs, returns the number of finished jobs and whether the quota was reached """
+    names = ledger.pending()
+    tqdm_out = TqdmToLogger(logger,level=logging.INFO)
+    progress = tqdm(file=tqdm_out, mininterval=30, total=len(names))
+
+    queue = asyncio.Queue(maxsize=2 * jobs)
+    writer = ResultWriter(setup, collection, ledger, batch_size)
+    quota_reached = asyncio.Event()
+    workers = [asyncio.ensure_future(worker(vt_api, session, queue, writer, progress, quota_reached, paging)) for _ in range(jobs)]
+    try:
+        for name in names:
+            if quota_reached.is_set():
+                break
+            await queue.put(name)
+        await queue.join()
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        writer.flush()
+        progress.close()
+    return len(names) - ledger.count_pending(), quota_reached.is_set()
+
+
+async def main(vt_api, setup, collection, ledger, jobs=1, batch_size=100, wait_for_quota=True, paging=None):
+        nr_new = ledger.seed(setup.db[collection], NO_ERROR_AND_NO_VT_OR_QUOTA_ERROR)
+        logger.info("Added {} domains to the job ledger, {} domains pending".format(nr_new, ledger.count_pending()))
         async with ClientSession(trust_env=True) as session:
-            nr_domains = setup.db[collection].count_documents(NO_ERROR_AND_NO_VT_OR_QUOTA_ERROR)
-            logger.info("Calling VT endpoints for {} domains".format(nr_domains))
-            tqdm_out = TqdmToLogger(logger,level=logging.INFO)
-            for doc in tqdm(setup.db[collection].find(NO_ERROR_AND_NO_VT_OR_QUOTA_ERROR), file=tqdm_out, mininterval=30, total=nr_domains):
-                try: # fetch the data
-                    data = await vt_api.fetch_vt(doc["name"], session)
-                except IsIpException as e:
-                    logger.debug("this is an ip {}".format(doc["name"]))
-                    setup.db[collection].remove({"name": doc["name"]})
-                    continue
-                except InvalidDomainException as e:
-                    setup.db[collection].update_one({"name": doc["name"]}, {"$set": format_error_entry("invalid domain name", "badf00d")})
-                    logger.debug("invalid domain name found `{}`.".format(doc["name"]))
-                except ContentTypeError:
-                    logger.warn("ContentTypeError occurred while fetching data for `{}`".format(doc["name"]))
-                    setup.db[collection].update_one({"name": doc["name"]}, {"$set": format_error_entry("ContentTypeError", "badf00d")})
-                except OtherVtException as e:
-                    setup.db[collection].update_one({"name": doc["name"]}, {"$set": format_error_entry(e.message, "vt")})
-                    logger.error(f"Other VT error occurred {e.message}")
-                except QuotaExceededException:
-                    logger.error("Quota reached when looking up `{}`. Exiting.".format(doc["name"]))
-                
-                data = clean_keys(data)
-                try:
-                    setup.db[collection].update_one({"name": doc["name"]}, {"$set": {"vt": data}})
-                except (UnicodeEncodeError, WriteError, InvalidDocument, OverflowError) as e:
-                    setup.db[collection].update_one({"name": doc["name"]},
-                                                    {"$set": format_error_entry(str(e), "vt")})
-                    logger.error("Database Exception when inserting domain `{}`. saving stacktrace to error...".format(
-                        doc["name"]))
-                    logger.debug(str(e))
+            exhausted = False
+            while True:
+                logger.info("Calling VT endpoints for {} domains, {} at a time".format(ledger.count_pending(), jobs))
+                nr_finished, quota_reached = await run_jobs(vt_api, session, setup, collection, ledger, jobs, batch_size, paging)
+                if not quota_reached:
+                    break
+                if not wait_for_quota:
+                    logger.error("Quota reached with {} domains pending. Exiting.".format(ledger.count_pending()))
+                    break
+                # a round that resumed after a pause and finished nothing means the daily quota is spent
+                pause = next_quota_reset(datetime.now(timezone.utc), exhausted and nr_finished == 0)
+                exhausted = True
+                logger.warning("Quota reached with {} domains pending, resuming at {}".format(
+                    ledger.count_pending(), (datetime.now() + pause).strftime("%Y-%m-%d %H:%M:%S")))
+                await asyncio.sleep(pause.total_seconds())
 
 
 def main_wrapper():
@@ -80,10 +233,19 @@ def main_wrapper():
         collection = DOMAINS_NAME
     
     logger.info("Making api calls to VirusTotal for domains in `{}`".format(collection))
-    vt_api = VtApi()
+    vt_api = VtApi(
+        cache=VtCache(setup.db[VT_CACHE_NAME]),
+        limiter=RateLimiter(per_minute=args.per_minute, per_day=args.per_day)
+    )
     loop = asyncio.get_event_loop()
-    future = asyncio.ensure_future(main(vt_api, setup, collection))
+    ledger = JobLedger(setup.db[VT_JOBS_NAME], collection)
+    paging = None
+    if args.max_pages > 1:
+        paging = Pagination(setup, collection, args.max_pages, max_items=args.max_items)
+    future = asyncio.ensure_future(main(vt_api, setup, collection, ledger, jobs=args.jobs, batch_size=args.batch_size,
+                                        wait_for_quota=not args.no_wait, paging=paging))
     loop.run_until_complete(future)
+    logger.info("VT cache stats: {}".format(json.dumps(vt_api.cache.stats())))
 
 if __name__ == "__main__":
     main_wrapper()